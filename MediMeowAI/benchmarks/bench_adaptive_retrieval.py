@@ -0,0 +1,160 @@
+"""
+固定 top-k 与自适应检索（相似度阈值 + MMR 重排）的块数分布、上下文规模与命中率
+
+medical_docs 按线上配置分块，测试查询分两类：
+- 简单查询：单篇文档 "主要表现为……" 一句，目标文档为该篇；
+- 复杂查询：同一科室随机 2~3 篇文档的症状拼接，目标文档为这几篇（--complex 条）。
+查询均携带目标文档所属科室，两种模式使用相同的分区与扩大规则。
+统计每类查询的返回块数分布、组装后的上下文 token 数（context_assembler，预算不限）、
+目标文档召回率、返回块中目标文档的比例与检索耗时。
+
+--embedding bge 使用服务实际加载的 bge 模型（需下载模型）；--embedding hashing 为离线替代，
+其相似度量级与 bge 不同，需用 --min-score 另行设置阈值，结果只用于验证流程。
+
+运行:
+    python benchmarks/bench_adaptive_retrieval.py --embedding bge --complex 100
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _ROOT)
+sys.path.insert(0, os.path.join(os.path.dirname(_ROOT), "zhipuGLM"))
+
+import config.config as config  # noqa: E402
+import rag.rag_core as rag_core  # noqa: E402
+import rag.chunk_index as chunk_index  # noqa: E402
+import utils.context_assembler as context_assembler  # noqa: E402
+from bench_pretriage import HashingEmbeddings  # noqa: E402
+
+_SYMPTOM_PATTERN = re.compile(r"主要表现为([^。]+)")
+
+
+def _load_chunks() -> List:
+    """与 rag_core.build_or_load_rag_index 相同的分块方式"""
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    documents = []
+    for name in sorted(os.listdir(config.DOCS_DIRECTORY)):
+        path = os.path.join(config.DOCS_DIRECTORY, name)
+        with open(path, encoding="utf-8") as f:
+            documents.append(Document(page_content=f.read(), metadata={"source": path}))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len,
+                                              add_start_index=True)
+    chunks = splitter.split_documents(documents)
+    for chunk in chunks:
+        chunk.metadata.update(rag_core.chunk_metadata(chunk.metadata["source"]))
+    return chunks
+
+
+def _build_queries(chunks, rng: random.Random, complex_count: int) -> Dict[str, List[dict]]:
+    symptoms: Dict[str, List[tuple]] = {}
+    for chunk in chunks:
+        match = _SYMPTOM_PATTERN.search(chunk.page_content)
+        if match and chunk.metadata["department"]:
+            symptoms.setdefault(chunk.metadata["department"], []).append(
+                (chunk.metadata["source"], match.group(1)))
+    queries = {"简单": [], "复杂": []}
+    for department, items in symptoms.items():
+        for source, text in items:
+            queries["简单"].append({"text": text, "department": department, "targets": {source}})
+    departments = [d for d, items in symptoms.items() if len(items) >= 2]
+    for _ in range(complex_count):
+        department = rng.choice(departments)
+        picked = rng.sample(symptoms[department], min(rng.choice([2, 3]), len(symptoms[department])))
+        queries["复杂"].append({
+            "text": "，".join(text for _, text in picked),
+            "department": department,
+            "targets": {source for source, _ in picked},
+        })
+    return queries
+
+
+def _fixed_search(index: chunk_index.ChunkIndex, query: str, department: str, k: int) -> List[tuple]:
+    """固定 top-k：与 rag_core.search_partitioned 相同的分区规则，相似度改为余弦相似度"""
+    scores = index.scores(query)
+    departments = np.array([doc.metadata.get("department", "") for doc in index.documents])
+    mask = departments == department
+    order = np.argsort(-np.where(mask, scores, -np.inf))[:k]
+    strong = int(np.count_nonzero(scores[order] >= config.RAG_ADAPTIVE_MIN_SCORE))
+    if not mask.any() or strong < min(config.RAG_PARTITION_MIN_HITS, k):
+        order = np.argsort(-scores)[:k]
+    return [(index.documents[i], float(scores[i])) for i in order]
+
+
+def _report(label: str, rows: List[dict]) -> None:
+    ks = [row["k"] for row in rows]
+    tokens = [row["tokens"] for row in rows]
+    histogram = Counter(ks)
+    distribution = " ".join(f"{k}:{histogram[k]}" for k in sorted(histogram))
+    print(f"{label:<10} {np.mean(ks):>6.2f} {min(ks):>4} {int(np.percentile(ks, 50)):>4} {max(ks):>4} "
+          f"{np.mean(tokens):>10.0f} {np.percentile(tokens, 95):>8.0f} "
+          f"{np.mean([row['recall'] for row in rows]):>8.1%} {np.mean([row['precision'] for row in rows]):>8.1%} "
+          f"{np.percentile([row['ms'] for row in rows], 50):>8.2f}  {distribution}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="固定 top-k 与自适应检索对比")
+    parser.add_argument("--embedding", choices=["bge", "hashing"], default="bge")
+    parser.add_argument("--complex", type=int, default=100, help="复杂查询条数")
+    parser.add_argument("--k", type=int, default=config.RAG_TOP_K, help="固定模式的块数")
+    parser.add_argument("--min-score", type=float, default=config.RAG_ADAPTIVE_MIN_SCORE)
+    parser.add_argument("--relative-score", type=float, default=config.RAG_ADAPTIVE_RELATIVE_SCORE)
+    parser.add_argument("--mmr-lambda", type=float, default=config.RAG_MMR_LAMBDA)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    config.RAG_ADAPTIVE_MIN_SCORE = args.min_score
+    config.RAG_ADAPTIVE_RELATIVE_SCORE = args.relative_score
+    config.RAG_MMR_LAMBDA = args.mmr_lambda
+
+    if args.embedding == "bge":
+        import utils.utils as utils
+        embeddings = utils.get_bge_embedding_model()
+    else:
+        embeddings = HashingEmbeddings()
+
+    chunks = _load_chunks()
+    start = time.perf_counter()
+    index = chunk_index.ChunkIndex(chunks, embeddings.embed_documents([c.page_content for c in chunks]), embeddings)
+    print(f"\n嵌入: {args.embedding}，文档块 {len(index)} 个，向量计算 {time.perf_counter() - start:.1f}s；"
+          f"自适应参数 候选池 {config.RAG_CANDIDATE_POOL}，k∈[{config.RAG_ADAPTIVE_MIN_K}, {config.RAG_ADAPTIVE_MAX_K}]，"
+          f"最低相似度 {args.min_score:g}，相对阈值 {args.relative_score:g}，MMR λ={args.mmr_lambda:g}")
+
+    queries = _build_queries(chunks, random.Random(args.seed), args.complex)
+    modes = {
+        f"固定k={args.k}": lambda q: _fixed_search(index, q["text"], q["department"], args.k),
+        "自适应": lambda q: index.search(q["text"], q["department"])[0],
+    }
+    print(f"\n{'查询':<4} {'模式':<10} {'平均k':>6} {'最小':>4} {'p50':>4} {'最大':>4} {'上下文token':>10} "
+          f"{'p95':>8} {'召回率':>8} {'命中占比':>8} {'检索ms':>8}  k 分布")
+    for kind, query_list in queries.items():
+        for label, search in modes.items():
+            rows = []
+            for query in query_list:
+                search_start = time.perf_counter()
+                results = search(query)
+                elapsed = (time.perf_counter() - search_start) * 1000
+                sources = [doc.metadata["source"] for doc, _ in results]
+                rows.append({
+                    "k": len(results),
+                    "tokens": context_assembler.assemble(results, budget=0).tokens_after,
+                    "recall": len(query["targets"] & set(sources)) / len(query["targets"]),
+                    "precision": sum(source in query["targets"] for source in sources) / max(len(sources), 1),
+                    "ms": elapsed,
+                })
+            print(f"{kind:<4} ", end="")
+            _report(label, rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+阶段3 上下文组装前后的提示词 token 数与阶段3 延迟
+
+medical_docs 中每篇文档只有约 85 个字符，按线上配置（chunk_size=1000）分块时每篇只有一个块，
+不会出现重叠。评估时把同一科室的文档按编号拼接为一篇科室汇编，按与线上相同的重叠比例
+（默认 chunk_size=150、chunk_overlap=30）分块，再以每篇文档 "主要表现为……" 一句作为检索关键词，
+在所选科室分区内按字符二元组覆盖率取前 k 个文档块，比较：
+- 原拼接方式（"\\n---\\n" 直接拼接）与 context_assembler 组装后的上下文 / 完整提示词 token 数；
+- 不同 token 预算下的合并、去重、跳过次数与块保留率（检索到的文档块全文仍出现在组装结果中的比例）；
+- 假 LLM 服务按提示词长度模拟处理耗时（--prefill-chars-per-sec）时，阶段3 调用的延迟。
+
+--legacy-index 去掉文档块的 start_index，模拟旧索引只能按文本首尾重叠合并的情况。
+
+运行:
+    python benchmarks/bench_context_assembly.py --budgets 0,1500,600 --prefill-chars-per-sec 1500
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import urllib.request
+from typing import Dict, List
+
+import numpy as np
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _ROOT)
+sys.path.insert(0, os.path.join(os.path.dirname(_ROOT), "zhipuGLM"))
+
+import config.config as config  # noqa: E402
+import prompts.prompts as prompts  # noqa: E402
+import rag.rag_core as rag_core  # noqa: E402
+import utils.context_assembler as context_assembler  # noqa: E402
+from fake_llm_server import start_fake_server  # noqa: E402
+
+_SYMPTOM_PATTERN = re.compile(r"主要表现为([^。]+)")
+
+PATIENT_TEXT = "\n".join([
+    "**患者基本信息**", "姓名：测试患者", "性别：女", "年龄：35岁", "就诊科室：{department}", "",
+    "**问卷回答**", "主要症状：{symptoms}", "持续时间：3天", "既往病史（选填）：无", "",
+    "**主诉**", "患者描述了相关症状，请查看问卷详情",
+])
+MULTIMODAL_DESCRIPTION = "【多模态描述】未上传图片，仅根据问卷回答描述：{symptoms}。"
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _build_chunks(chunk_size: int, chunk_overlap: int, legacy_index: bool) -> Dict[str, List[tuple]]:
+    """科室 -> [(文档块, 二元组集合)]；同一科室的文档按编号拼接后分块
+
+    拼接时不加换行，与线上长篇文档一样由分块器按字符切分，相邻块之间有 chunk_overlap 个字符的重叠。
+    """
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    texts: Dict[str, List[str]] = {}
+    for name in sorted(os.listdir(config.DOCS_DIRECTORY)):
+        department = rag_core.doc_department(name)
+        if department is None:
+            continue
+        with open(os.path.join(config.DOCS_DIRECTORY, name), encoding="utf-8") as f:
+            texts.setdefault(department, []).append(f.read().strip())
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len, add_start_index=not legacy_index
+    )
+    chunks: Dict[str, List[tuple]] = {}
+    for department, docs in texts.items():
+        source = f"{department}汇编.txt"
+        document = Document(page_content="".join(docs), metadata={"source": source, "department": department})
+        chunks[department] = [(chunk, _bigrams(chunk.page_content)) for chunk in splitter.split_documents([document])]
+    return chunks
+
+
+def _search(chunks: List[tuple], query: str, k: int) -> List[tuple]:
+    grams = _bigrams(query)
+    scored = [(doc, len(grams & chunk_grams) / max(len(grams), 1)) for doc, chunk_grams in chunks]
+    return sorted(scored, key=lambda item: item[1], reverse=True)[:k]
+
+
+def _coverage(results: List[tuple], context: str) -> float:
+    """检索到的文档块中，全文仍出现在组装结果里的比例"""
+    return sum(doc.page_content.strip() in context for doc, _ in results) / max(len(results), 1)
+
+
+def _prompt(department: str, symptoms: str, context: str) -> str:
+    return prompts.FINAL_REPORT_PROMPT.format(
+        original_text_data=PATIENT_TEXT.format(department=department, symptoms=symptoms),
+        multimodal_description=MULTIMODAL_DESCRIPTION.format(symptoms=symptoms),
+        retrieved_context=context,
+    )
+
+
+def _call_llm(url: str, prompt: str) -> float:
+    body = json.dumps({"model": "fake", "messages": [{"role": "user", "content": prompt}]}).encode("utf-8")
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def _pct(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="阶段3 上下文组装前后的 token 数与延迟")
+    parser.add_argument("--chunk-size", type=int, default=150)
+    parser.add_argument("--chunk-overlap", type=int, default=30)
+    parser.add_argument("--k", type=int, default=config.RAG_TOP_K)
+    parser.add_argument("--budgets", default=f"0,{config.CONTEXT_TOKEN_BUDGET},600",
+                        help="逗号分隔的 token 预算，0 表示不限制")
+    parser.add_argument("--legacy-index", action="store_true", help="去掉 start_index，只按文本重叠合并")
+    parser.add_argument("--latency-requests", type=int, default=20, help="每种上下文调用假 LLM 的次数")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--prefill-chars-per-sec", type=float, default=1500)
+    args = parser.parse_args()
+
+    chunks = _build_chunks(args.chunk_size, args.chunk_overlap, args.legacy_index)
+    cases = []
+    for department, department_chunks in chunks.items():
+        seen = set()
+        for doc, _ in department_chunks:
+            for symptoms in _SYMPTOM_PATTERN.findall(doc.page_content):
+                if symptoms not in seen:
+                    seen.add(symptoms)
+                    cases.append((department, symptoms, _search(department_chunks, symptoms, args.k)))
+    print(f"\n文档块 {sum(len(c) for c in chunks.values())} 个（chunk_size={args.chunk_size}，"
+          f"overlap={args.chunk_overlap}，{'无' if args.legacy_index else '有'} start_index），"
+          f"查询 {len(cases)} 条，每条取前 {args.k} 个文档块")
+
+    budgets = [int(b) for b in args.budgets.split(",") if b.strip()]
+    legacy_contexts = [context_assembler.SEPARATOR.join(doc.page_content for doc, _ in results)
+                       for _, _, results in cases]
+    legacy_tokens = [context_assembler.count_tokens(text) for text in legacy_contexts]
+    legacy_prompts = [_prompt(department, symptoms, context)
+                      for (department, symptoms, _), context in zip(cases, legacy_contexts)]
+    legacy_prompt_tokens = [context_assembler.count_tokens(prompt) for prompt in legacy_prompts]
+
+    print(f"\n{'方式':<14} {'上下文token均值':>14} {'p95':>6} {'提示词token均值':>14} {'片段数':>6} "
+          f"{'合并':>5} {'去重':>5} {'跳过':>5} {'截断':>5} {'块保留率':>7} {'组装p50(ms)':>11}")
+    print(f"{'原拼接':<14} {np.mean(legacy_tokens):>14.0f} {_pct(legacy_tokens, 95):>6.0f} "
+          f"{np.mean(legacy_prompt_tokens):>14.0f} {args.k:>6} {'-':>5} {'-':>5} {'-':>5} {'-':>5} {1:>7.1%} {'-':>11}")
+
+    assembled_prompts: Dict[int, List[str]] = {}
+    for budget in budgets:
+        totals = {"merged": 0, "duplicates": 0, "skipped": 0, "truncated": 0, "segments": 0}
+        tokens, prompt_tokens, elapsed, retention = [], [], [], []
+        assembled_prompts[budget] = []
+        for department, symptoms, results in cases:
+            start = time.perf_counter()
+            assembled = context_assembler.assemble(results, budget=budget)
+            elapsed.append((time.perf_counter() - start) * 1000)
+            stats = assembled.stats()
+            for key in totals:
+                totals[key] += int(stats[key])
+            tokens.append(assembled.tokens_after)
+            prompt = _prompt(department, symptoms, assembled.text)
+            assembled_prompts[budget].append(prompt)
+            prompt_tokens.append(context_assembler.count_tokens(prompt))
+            retention.append(_coverage(results, assembled.text))
+        label = f"组装(预算{budget or '不限'})"
+        print(f"{label:<14} {np.mean(tokens):>14.0f} {_pct(tokens, 95):>6.0f} {np.mean(prompt_tokens):>14.0f} "
+              f"{totals['segments'] / len(cases):>6.1f} {totals['merged']:>5} {totals['duplicates']:>5} "
+              f"{totals['skipped']:>5} {totals['truncated']:>5} {np.mean(retention):>7.1%} {_pct(elapsed, 50):>11.2f}")
+
+    if args.latency_requests <= 0:
+        return
+    server = start_fake_server(capacity=64, latency_ms=args.latency_ms, jitter_ms=0,
+                               prefill_chars_per_sec=args.prefill_chars_per_sec)
+    url = f"http://127.0.0.1:{server.server_address[1]}/v4/chat/completions"
+    try:
+        print(f"\n阶段3 延迟（假 LLM 固定延迟 {args.latency_ms:g}ms + 提示词字符数 / "
+              f"{args.prefill_chars_per_sec:g} 字符每秒，每种 {args.latency_requests} 次）")
+        print(f"{'方式':<14} {'提示词字符均值':>14} {'p50(ms)':>9} {'p95(ms)':>9}")
+        rows = [("原拼接", legacy_prompts)] + [(f"组装(预算{b or '不限'})", assembled_prompts[b]) for b in budgets]
+        for label, prompt_list in rows:
+            sample = prompt_list[:args.latency_requests]
+            latencies = [_call_llm(url, prompt) for prompt in sample]
+            print(f"{label:<14} {np.mean([len(p) for p in sample]):>14.0f} "
+                  f"{_pct(latencies, 50):>9.0f} {_pct(latencies, 95):>9.0f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+对冲请求尾延迟测试
+
+假 LLM 服务以 --tail-prob 的概率额外卡顿 --tail-ms，分别在不对冲和对冲两种模式下
+发起 --requests 次调用，比较 p50/p95/p99 延迟与实际对冲比例。
+
+运行:
+    python benchmarks/bench_hedging.py --requests 400 --tail-prob 0.03 --tail-ms 3000
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "zhipuGLM"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+
+import utils.hedging as hedging
+import utils.provider_limiter as provider_limiter
+from fake_llm_server import start_fake_server
+
+
+def _percentile(sorted_values, pct):
+    index = min(int(len(sorted_values) * pct / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _attempt_factory(llm, messages):
+    """与 service._invoke_llm 相同：流式读取，取消事件置位时中止"""
+    def attempt(cancel: threading.Event):
+        if cancel.is_set():
+            raise provider_limiter.CallCancelled()
+        parts = []
+        for chunk in llm.stream(messages):
+            if cancel.is_set():
+                raise provider_limiter.CallCancelled()
+            parts.append(chunk.content)
+        return "".join(parts)
+    return attempt
+
+
+def run_round(llm, hedger, requests: int, concurrency: int):
+    messages = [HumanMessage(content="请描述舌象")]
+    attempt = _attempt_factory(llm, messages)
+    latencies = []
+    lock = threading.Lock()
+
+    def one(_):
+        start = time.perf_counter()
+        if hedger is None:
+            attempt(threading.Event())
+        else:
+            hedger.run("bench", attempt)
+        with lock:
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对冲请求尾延迟测试")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=60)
+    parser.add_argument("--tail-prob", type=float, default=0.03)
+    parser.add_argument("--tail-ms", type=float, default=3000)
+    parser.add_argument("--max-ratio", type=float, default=0.1, help="对冲比例上限")
+    args = parser.parse_args()
+
+    server = start_fake_server(
+        capacity=1000, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        tail_prob=args.tail_prob, tail_ms=args.tail_ms
+    )
+    llm = ChatOpenAI(
+        model="fake",
+        temperature=0,
+        openai_api_base=f"http://127.0.0.1:{server.server_address[1]}/v4/",
+        openai_api_key="fake",
+        max_retries=0
+    )
+
+    print(f"假服务: 延迟 {args.latency_ms:.0f}±{args.jitter_ms:.0f}ms, "
+          f"{args.tail_prob:.0%} 概率额外卡顿 {args.tail_ms:.0f}ms; 并发 {args.concurrency}, 请求数 {args.requests}")
+    print(f"{'模式':<8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  对冲统计")
+
+    baseline = run_round(llm, None, args.requests, args.concurrency)
+    print(f"{'不对冲':<8} {_percentile(baseline, 50):>8.0f} {_percentile(baseline, 95):>8.0f} "
+          f"{_percentile(baseline, 99):>8.0f} {baseline[-1]:>8.0f}")
+
+    hedger = hedging.Hedger(
+        max_workers=args.concurrency * 2 + 2,
+        percentile=95,
+        min_delay=0.05,
+        default_delay=1.0,
+        max_ratio=args.max_ratio,
+        window=200,
+        min_samples=20,
+    )
+    # 先用少量请求填充延迟窗口，避免样本不足时一直使用默认延迟
+    run_round(llm, hedger, 40, args.concurrency)
+    hedged = run_round(llm, hedger, args.requests, args.concurrency)
+    print(f"{'对冲':<8} {_percentile(hedged, 50):>8.0f} {_percentile(hedged, 95):>8.0f} "
+          f"{_percentile(hedged, 99):>8.0f} {hedged[-1]:>8.0f}  {hedger.stats()}")
+
+    snap = server.snapshot()
+    print(f"\n服务端: 卡顿请求 {snap['tail_delays']} 次, 被客户端取消 {snap['client_closed']} 次")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
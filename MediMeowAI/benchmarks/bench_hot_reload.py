@@ -0,0 +1,130 @@
+"""
+知识库热更新压测
+
+启动假 LLM 服务和 AI 服务，先跑一轮无重建的基线负载，再在同样的负载进行中
+每隔 --interval 秒调用一次 ReloadKnowledgeBase（wait=True），比较：
+- 两轮的请求结果与客户端端到端延迟 p50/p95/p99（重建期间应无失败请求）；
+- 每次重建、校验与切换的耗时，切换前后的版本号与文档块数；
+- AI 服务进程的常驻内存（旧版本释放后不应随重建次数持续增长）。
+
+CHROMA_VERSIONS_DIR 指向临时目录，不修改仓库中的向量库。
+--retriever fake 时重建的是内存关键词检索（不依赖 bge 模型），只验证切换与请求路径；
+--retriever chroma 时为真实的 Chroma 重建。
+
+运行:
+    python benchmarks/bench_hot_reload.py --concurrency 8 --requests 80 --reloads 3
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import List
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _BENCH_DIR)
+
+import grpc
+from bench_pipeline import _start_fake_llm, _start_ai_server, _read_rss_kb, run_level, pb2, pb2_grpc
+
+
+def _print_level(label: str, result: dict) -> None:
+    client = result["client_ms"]
+    print(f"{label:<8} {str(result['outcomes']):<24} {result['throughput_rps']:>8.2f} "
+          f"{client['p50']:>8.1f} {client['p95']:>8.1f} {client['p99']:>8.1f} "
+          f"{result['rss_mb']['start']:>8.1f} {result['rss_mb']['peak']:>8.1f}")
+
+
+def _reload_loop(stub, reloads: int, interval: float, server_pid: int, rows: List[dict]) -> None:
+    for i in range(reloads):
+        time.sleep(interval)
+        start = time.perf_counter()
+        try:
+            response = stub.ReloadKnowledgeBase(
+                pb2.ReloadKnowledgeBaseRequest(wait=True, reason=f"压测第 {i + 1} 次"), timeout=600
+            )
+            status = json.loads(response.status_json or "{}")
+            rows.append({
+                "ok": response.ok,
+                "message": response.message,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+                "version": status.get("current", {}).get("version"),
+                "chunks": status.get("current", {}).get("chunks"),
+                "retired": len(status.get("retired", [])),
+                "rss_mb": round(_read_rss_kb(server_pid) / 1024, 1),
+            })
+        except grpc.RpcError as e:
+            rows.append({"ok": False, "message": f"{e.code().name}: {e.details()}",
+                         "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库热更新压测")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=80, help="每轮的请求数")
+    parser.add_argument("--reloads", type=int, default=3, help="负载期间的重建次数")
+    parser.add_argument("--interval", type=float, default=1.0, help="相邻两次重建的间隔（秒）")
+    parser.add_argument("--retriever", choices=["chroma", "fake"], default="fake")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--image-kb", type=int, default=0)
+    # 假 LLM 服务参数（与 bench_pipeline.py 相同）
+    parser.add_argument("--llm-capacity", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--latency-dist", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--reply-tokens", type=int, default=0)
+    parser.add_argument("--tail-prob", type=float, default=0.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    image_base64 = base64.b64encode(os.urandom(args.image_kb * 1024)).decode("ascii")
+    versions_dir = tempfile.mkdtemp(prefix="medimeow-kb-")
+    os.environ["CHROMA_VERSIONS_DIR"] = versions_dir
+
+    log = tempfile.NamedTemporaryFile("w", prefix="medimeow-bench-", suffix=".log", delete=False)
+    print(f"服务日志: {log.name}  版本目录: {versions_dir}")
+    llm_proc, llm_port = _start_fake_llm(args, log)
+    ai_proc = None
+    try:
+        ai_proc, address = _start_ai_server(args, llm_port, log)
+        print(f"AI 服务: {address} (pid {ai_proc.pid}, 检索器 {args.retriever})")
+        channel = grpc.insecure_channel(address)
+        stub = pb2_grpc.MedicalAIServiceStub(channel)
+        run_level(stub, 1, 1, image_base64, False, ai_proc.pid)
+
+        print(f"\n{'轮次':<8} {'结果':<24} {'吞吐':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'起始MB':>8} {'峰值MB':>8}")
+        _print_level("基线", run_level(stub, args.concurrency, args.requests, image_base64, False, ai_proc.pid))
+
+        reload_rows: List[dict] = []
+        reloader = threading.Thread(
+            target=_reload_loop, args=(stub, args.reloads, args.interval, ai_proc.pid, reload_rows)
+        )
+        reloader.start()
+        _print_level("重建中", run_level(stub, args.concurrency, args.requests, image_base64, False, ai_proc.pid))
+        reloader.join()
+
+        print(f"\n{'次序':<4} {'结果':<6} {'耗时ms':>9} {'版本':<26} {'块数':>6} {'待释放':>6} {'RSS MB':>8}  说明")
+        for i, row in enumerate(reload_rows, 1):
+            print(f"{i:<4} {'成功' if row['ok'] else '失败':<6} {row['elapsed_ms']:>9.1f} "
+                  f"{str(row.get('version')):<26} {str(row.get('chunks')):>6} {str(row.get('retired')):>6} "
+                  f"{str(row.get('rss_mb')):>8}  {row['message']}")
+        channel.close()
+    finally:
+        for proc in (ai_proc, llm_proc):
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+三阶段分析流程离线压测
+
+启动本地假 LLM 服务（fake_llm_server.py）和指向它的 AI 服务（run_ai_server.py），
+按给定的并发级别通过 gRPC 调用 MedicalAIService，输出每个级别的：
+- 吞吐量、成功/失败数；
+- 客户端端到端延迟与各阶段耗时（AnalysisReport.timings）的 p50/p95/p99；
+- AI 服务进程的常驻内存（起始 / 峰值）。
+
+无需 GLM 密钥和外网，任意 Linux 机器上可复现。
+
+运行:
+    python benchmarks/bench_pipeline.py --concurrency 1,4,8,16 --requests 40
+    python benchmarks/bench_pipeline.py --latency-dist lognormal --tokens-per-sec 60 --reply-tokens 400
+"""
+import os
+import sys
+import json
+import base64
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_BENCH_DIR)
+sys.path.insert(0, os.path.join(_ROOT, "connect"))
+
+import grpc
+import medical_ai_pb2 as pb2
+import medical_ai_pb2_grpc as pb2_grpc
+
+# 与 proto 中 StageTimings 字段一致
+STAGE_FIELDS = ["queue_wait_ms", "stage1_ms", "keyword_ms", "vector_search_ms", "stage3_ms", "total_ms"]
+
+PATIENT_TEXT = """
+**患者基本信息**
+性别：男
+年龄：20 岁
+过敏史：无
+
+**主诉与现病史**
+主诉：咽喉剧烈疼痛，伴低热两天。
+症状描述：吞咽时疼痛加重，夜间咳嗽，无明显咳痰。
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * pct / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50": round(_percentile(values, 50), 1),
+        "p95": round(_percentile(values, 95), 1),
+        "p99": round(_percentile(values, 99), 1),
+    }
+
+
+def _read_rss_kb(pid: int) -> int:
+    """读取进程常驻内存（KB），仅支持 Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler:
+    """后台定期采样进程 RSS，记录采样期间的峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, _read_rss_kb(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _start_fake_llm(args, log) -> Tuple[subprocess.Popen, int]:
+    port = _free_port()
+    cmd = [
+        sys.executable, os.path.join(_BENCH_DIR, "fake_llm_server.py"),
+        "--port", str(port),
+        "--capacity", str(args.llm_capacity),
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--latency-dist", args.latency_dist,
+        "--sigma", str(args.sigma),
+        "--tokens-per-sec", str(args.tokens_per_sec),
+        "--reply-tokens", str(args.reply_tokens),
+        "--tail-prob", str(args.tail_prob),
+        "--tail-ms", str(args.tail_ms),
+    ]
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/v4/stats", timeout=1).read()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("假 LLM 服务启动超时")
+
+
+def _start_ai_server(args, llm_port: int, log, extra_args: Sequence[str] = ()) -> Tuple[subprocess.Popen, str]:
+    address = f"127.0.0.1:{_free_port()}"
+    env = dict(os.environ)
+    env.update({
+        "GLM_API_BASE": f"http://127.0.0.1:{llm_port}/v4/",
+        "GLM_API_KEY": env.get("BENCH_GLM_API_KEY", "fake-key"),
+        "AI_GRPC_ADDRESS": address,
+        "TRACING_EXPORTER": env.get("TRACING_EXPORTER", "none"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    cmd = [sys.executable, os.path.join(_BENCH_DIR, "run_ai_server.py"), "--retriever", args.retriever, *extra_args]
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+    channel = grpc.insecure_channel(address)
+    try:
+        grpc.channel_ready_future(channel).result(timeout=args.startup_timeout)
+    except grpc.FutureTimeoutError:
+        proc.kill()
+        raise RuntimeError(f"AI 服务启动超时，日志见 {log.name}")
+    finally:
+        channel.close()
+    return proc, address
+
+
+def run_level(stub, concurrency: int, requests: int, image_base64: str, stream: bool, server_pid: int) -> dict:
+    client_ms: List[float] = []
+    first_chunk_ms: List[float] = []
+    stage_ms: Dict[str, List[float]] = defaultdict(list)
+    outcomes: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+
+    def one(_):
+        request = pb2.AnalysisRequest(
+            patient_text_data=PATIENT_TEXT,
+            image_base64=image_base64,
+            stream=stream,
+            patient_department="呼吸内科"
+        )
+        start = time.perf_counter()
+        try:
+            if stream:
+                first = None
+                for chunk in stub.ProcessMedicalAnalysis(request, timeout=300):
+                    if first is None:
+                        first = (time.perf_counter() - start) * 1000
+                    if chunk.is_end:
+                        break
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    outcomes["STREAM_OK"] += 1
+                    client_ms.append(elapsed)
+                    if first is not None:
+                        first_chunk_ms.append(first)
+                return
+            report = stub.ProcessMedicalAnalysisSync(request, timeout=300)
+        except grpc.RpcError as e:
+            with lock:
+                outcomes[f"grpc:{e.code().name}"] += 1
+            return
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            outcomes[report.status] += 1
+            client_ms.append(elapsed)
+            if report.status == "SUCCESS" and report.HasField("timings"):
+                for field in STAGE_FIELDS:
+                    stage_ms[field].append(getattr(report.timings, field))
+
+    rss_start = _read_rss_kb(server_pid)
+    wall_start = time.perf_counter()
+    with RssSampler(server_pid) as sampler, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - wall_start
+
+    ok = outcomes.get("SUCCESS", 0) + outcomes.get("STREAM_OK", 0)
+    result = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "outcomes": dict(outcomes),
+        "throughput_rps": round(ok / wall, 2) if wall > 0 else 0.0,
+        "client_ms": _summary(client_ms),
+        "stages_ms": {field: _summary(values) for field, values in stage_ms.items()},
+        "rss_mb": {"start": round(rss_start / 1024, 1), "peak": round(sampler.peak_kb / 1024, 1)},
+    }
+    if first_chunk_ms:
+        result["first_chunk_ms"] = _summary(first_chunk_ms)
+    return result
+
+
+def _print_level(result: dict) -> None:
+    print(f"\n== 并发 {result['concurrency']} / 请求 {result['requests']} ==")
+    print(f"  结果: {result['outcomes']}  吞吐: {result['throughput_rps']} req/s")
+    print(f"  内存: 起始 {result['rss_mb']['start']} MB, 峰值 {result['rss_mb']['peak']} MB")
+    print(f"  {'指标':<18} {'p50':>9} {'p95':>9} {'p99':>9}")
+    rows = [("client_e2e_ms", result["client_ms"])]
+    if "first_chunk_ms" in result:
+        rows.append(("first_chunk_ms", result["first_chunk_ms"]))
+    rows.extend((field, result["stages_ms"][field]) for field in STAGE_FIELDS if field in result["stages_ms"])
+    for name, summary in rows:
+        print(f"  {name:<18} {summary['p50']:>9.1f} {summary['p95']:>9.1f} {summary['p99']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="三阶段分析流程离线压测")
+    parser.add_argument("--concurrency", default="1,4,8,16", help="逗号分隔的并发级别")
+    parser.add_argument("--requests", type=int, default=40, help="每个并发级别的请求数")
+    parser.add_argument("--stream", action="store_true", help="使用流式 RPC（只统计客户端延迟与首块延迟）")
+    parser.add_argument("--image-kb", type=int, default=100, help="请求中图片的大小（KB，随机字节）")
+    parser.add_argument("--retriever", choices=["chroma", "fake"], default="fake")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    # 假 LLM 服务参数
+    parser.add_argument("--llm-capacity", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--latency-dist", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--reply-tokens", type=int, default=0)
+    parser.add_argument("--tail-prob", type=float, default=0.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    image_base64 = base64.b64encode(os.urandom(args.image_kb * 1024)).decode("ascii")
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    log = tempfile.NamedTemporaryFile("w", prefix="medimeow-bench-", suffix=".log", delete=False)
+    print(f"服务日志: {log.name}")
+    llm_proc, llm_port = _start_fake_llm(args, log)
+    ai_proc = None
+    try:
+        ai_proc, address = _start_ai_server(args, llm_port, log)
+        print(f"假 LLM 服务: 127.0.0.1:{llm_port}  AI 服务: {address} (pid {ai_proc.pid}, 检索器 {args.retriever})")
+
+        channel = grpc.insecure_channel(
+            address,
+            options=[("grpc.max_send_message_length", 64 * 1024 * 1024)]
+        )
+        stub = pb2_grpc.MedicalAIServiceStub(channel)
+        # 预热一次，排除首次调用的初始化开销
+        run_level(stub, 1, 1, image_base64, args.stream, ai_proc.pid)
+
+        results = []
+        for level in levels:
+            result = run_level(stub, level, args.requests, image_base64, args.stream, ai_proc.pid)
+            _print_level(result)
+            results.append(result)
+        channel.close()
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "levels": results}, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已写入 {args.json}")
+    finally:
+        for proc in (ai_proc, llm_proc):
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
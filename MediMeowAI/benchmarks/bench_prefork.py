@@ -0,0 +1,183 @@
+"""
+多进程模式（AI_WORKERS）的 CPU 密集负载吞吐对比
+
+依次以 --workers 中的工作进程数启动 AI 服务（假检索器 + --search-cpu-ms 模拟查询向量计算等持有 GIL 的
+CPU 开销，假 LLM 延迟很短），每个客户端线程使用独立的 gRPC 连接（SO_REUSEPORT 按连接分配工作进程），
+比较：
+- 吞吐与客户端端到端延迟 p50/p95；
+- 服务端 CPU 占用（父进程与全部工作进程的 utime + stime / 墙钟时间，即平均占用的核数）；
+- 服务端内存：各进程 RSS 之和，以及按共享页均摊的 PSS 之和（写时复制共享的页只计一份）。
+
+--kill-worker 在最后一轮负载进行到三分之一时 SIGKILL 一个工作进程，验证监督进程重启工作进程，
+输出该轮的失败请求数与重启后的工作进程数。工作进程数超过 CPU 核数时吞吐不会继续提升。
+
+运行:
+    python benchmarks/bench_prefork.py --workers 1,2,4 --concurrency 16 --requests 320 --search-cpu-ms 20
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _BENCH_DIR)
+
+import grpc
+from bench_pipeline import PATIENT_TEXT, _start_fake_llm, _start_ai_server, _read_rss_kb, _summary, pb2, pb2_grpc
+from bench_stream_coalescing import _read_cpu_seconds
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _read_pss_kb(pid: int) -> int:
+    """进程按比例分摊的内存（KB）：与其他进程共享的页按共享进程数均摊，仅支持 Linux"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def run_workers(args, workers: int, llm_port: int, log, kill_worker: bool) -> Dict:
+    os.environ["AI_WORKERS"] = str(workers)
+    ai_proc, address = _start_ai_server(args, llm_port, log, ["--search-cpu-ms", str(args.search_cpu_ms)])
+    try:
+        deadline = time.monotonic() + args.startup_timeout
+        while len(_children(ai_proc.pid)) < workers and workers > 1 and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        local = threading.local()
+        channels = []
+        lock = threading.Lock()
+        client_ms: List[float] = []
+        outcomes: Dict[str, int] = defaultdict(int)
+
+        def stub():
+            if not hasattr(local, "stub"):
+                # 不共享子通道：每个线程一条连接，由内核分配到不同的工作进程
+                channel = grpc.insecure_channel(address, options=[("grpc.use_local_subchannel_pool", 1)])
+                with lock:
+                    channels.append(channel)
+                local.stub = pb2_grpc.MedicalAIServiceStub(channel)
+            return local.stub
+
+        def one(_):
+            request = pb2.AnalysisRequest(patient_text_data=PATIENT_TEXT, patient_department="呼吸内科")
+            start = time.perf_counter()
+            try:
+                report = stub().ProcessMedicalAnalysisSync(request, timeout=300)
+                status = report.status
+            except grpc.RpcError as e:
+                status = f"grpc:{e.code().name}"
+            with lock:
+                outcomes[status] += 1
+                if status == "SUCCESS":
+                    client_ms.append((time.perf_counter() - start) * 1000)
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            # 预热：每个线程建立连接并完成一次请求
+            list(pool.map(one, range(args.concurrency)))
+            outcomes.clear()
+            client_ms.clear()
+
+            pids = [ai_proc.pid] + _children(ai_proc.pid)
+            cpu_start = sum(_read_cpu_seconds(pid) for pid in pids)
+            wall_start = time.perf_counter()
+            killed = None
+            if kill_worker and workers > 1:
+                first = list(pool.map(one, range(args.requests // 3)))
+                killed = _children(ai_proc.pid)[0]
+                os.kill(killed, signal.SIGKILL)
+                list(pool.map(one, range(args.requests - len(first))))
+            else:
+                list(pool.map(one, range(args.requests)))
+            wall = time.perf_counter() - wall_start
+            # 被杀掉的工作进程的 CPU 时间无法再读取，kill 轮次的 CPU 占用偏低
+            cpu = sum(_read_cpu_seconds(pid) for pid in [ai_proc.pid] + _children(ai_proc.pid)) - cpu_start
+
+        for channel in channels:
+            channel.close()
+        alive = _children(ai_proc.pid)
+        pids = [ai_proc.pid] + alive
+        return {
+            "workers": workers,
+            "outcomes": dict(outcomes),
+            "throughput_rps": round(outcomes.get("SUCCESS", 0) / wall, 2),
+            "client_ms": _summary(client_ms),
+            "cpu_cores": round(cpu / wall, 2),
+            "rss_mb": round(sum(_read_rss_kb(pid) for pid in pids) / 1024, 1),
+            "pss_mb": round(sum(_read_pss_kb(pid) for pid in pids) / 1024, 1),
+            "killed": killed,
+            "alive": len(alive),
+        }
+    finally:
+        ai_proc.terminate()
+        try:
+            ai_proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            ai_proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程模式的 CPU 密集负载吞吐对比")
+    parser.add_argument("--workers", default="1,2,4", help="逗号分隔的工作进程数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=320, help="每轮的请求数")
+    parser.add_argument("--search-cpu-ms", type=float, default=20.0, help="每次检索占用的 CPU 时间")
+    parser.add_argument("--kill-worker", action="store_true", help="最后一轮中途杀掉一个工作进程")
+    parser.add_argument("--retriever", choices=["fake"], default="fake")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    # 假 LLM 服务参数（与 bench_pipeline.py 相同，默认延迟很短，使 CPU 成为瓶颈）
+    parser.add_argument("--llm-capacity", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=10)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--latency-dist", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--reply-tokens", type=int, default=0)
+    parser.add_argument("--tail-prob", type=float, default=0.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    levels = [int(w) for w in args.workers.split(",") if w.strip()]
+    os.environ["CHROMA_VERSIONS_DIR"] = tempfile.mkdtemp(prefix="medimeow-kb-")
+    log = tempfile.NamedTemporaryFile("w", prefix="medimeow-bench-", suffix=".log", delete=False)
+    print(f"服务日志: {log.name}  CPU 核数: {os.cpu_count()}  每次检索 CPU {args.search_cpu_ms:g}ms，"
+          f"假 LLM {args.latency_ms:g}ms，并发 {args.concurrency}，每轮 {args.requests} 个请求")
+    llm_proc, llm_port = _start_fake_llm(args, log)
+    try:
+        print(f"\n{'工作进程':<6} {'结果':<40} {'吞吐':>8} {'p50':>8} {'p95':>8} {'CPU核':>6} {'RSS MB':>8} {'PSS MB':>8}")
+        for i, workers in enumerate(levels):
+            result = run_workers(args, workers, llm_port, log, args.kill_worker and i == len(levels) - 1)
+            print(f"{workers:<6} {str(result['outcomes']):<40} {result['throughput_rps']:>8.2f} "
+                  f"{result['client_ms']['p50']:>8.1f} {result['client_ms']['p95']:>8.1f} {result['cpu_cores']:>6.2f} "
+                  f"{result['rss_mb']:>8.1f} {result['pss_mb']:>8.1f}")
+            if result["killed"]:
+                print(f"       已 SIGKILL 工作进程 {result['killed']}，结束时存活工作进程 {result['alive']}/{workers}")
+    finally:
+        llm_proc.terminate()
+        try:
+            llm_proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            llm_proc.kill()
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+科室预分诊精确率 / 召回率评估
+
+用分诊问卷和 medical_docs 构造带标注的提交，离线评估 utils/pretriage.py 在不同阈值下的表现：
+- 每篇文档对应一名患者，真实科室按 DOC_DEPARTMENT_RANGES 确定，既往病史一栏填写文档中的
+  "主要表现为……" 一句；
+- 正确科室的提交：在真实科室的问卷中选择若干有效选项；
+- 错误科室的提交：随机选择另一个科室，在该科室问卷中多数题目选择 "无……" 类选项，
+  少数题目（--noise）随机选择一个有效选项，模拟患者勉强作答。
+评估时从质心中剔除当前文档（留一法），避免文档本身参与比较。
+
+--embedding bge 使用服务实际加载的 bge 模型（需下载模型）；--embedding hashing 使用字符一、二元组
+哈希向量作为离线替代，只用于验证流程，结果不代表 bge 的效果。
+
+运行:
+    python benchmarks/bench_pretriage.py --embedding bge --seed 7
+"""
+import os
+import re
+import sys
+import time
+import zlib
+import random
+import argparse
+from typing import Dict, List
+
+import numpy as np
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "zhipuGLM"))
+
+import config.config as config  # noqa: E402
+import rag.rag_core as rag_core  # noqa: E402
+import utils.pretriage as pretriage  # noqa: E402
+
+# 阈值组合：(所选科室最低排名, 相似度差距)
+THRESHOLDS = [(2, 0.0), (3, 0.03), (4, 0.05), (5, 0.08), (6, 0.10)]
+# 每个被拦截的请求省去的 LLM 调用（阶段1、关键词提取、阶段3；不含多图片的逐张描述）
+LLM_CALLS_PER_REQUEST = 3
+
+_QUESTION_PATTERN = re.compile(r"C --> (\w+)\[问题\d+: (.+?)\]")
+_SYMPTOM_PATTERN = re.compile(r"主要表现为([^。]+)")
+
+
+class HashingEmbeddings:
+    """字符一元组 + 二元组哈希到固定维度的词袋向量（离线替代）"""
+
+    def __init__(self, dims: int = 4096):
+        self.dims = dims
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+            for gram in grams:
+                vectors[row, zlib.crc32(gram.encode("utf-8")) % self.dims] += 1.0
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings:
+    """按文本缓存向量，留一法反复构建质心时每段文本只计算一次"""
+
+    def __init__(self, embeddings):
+        self._embeddings = embeddings
+        self._cache: Dict[str, List[float]] = {}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = [text for text in dict.fromkeys(texts) if text not in self._cache]
+        if missing:
+            for text, vector in zip(missing, self._embeddings.embed_documents(missing)):
+                self._cache[text] = vector
+        return [self._cache[text] for text in texts]
+
+
+def _load_questionnaires(questionnaire_dir: str) -> Dict[str, List[tuple]]:
+    """科室 -> [(题目, [选项...])]"""
+    questionnaires = {}
+    for name in sorted(os.listdir(questionnaire_dir)):
+        if not name.endswith(".md"):
+            continue
+        with open(os.path.join(questionnaire_dir, name), encoding="utf-8") as f:
+            content = f.read()
+        questions = []
+        for question_id, label in _QUESTION_PATTERN.findall(content):
+            options = re.findall(rf"{question_id} --> {question_id}[a-z]\[([A-Z]\. .+?)\]", content)
+            if options:
+                questions.append((label, options))
+        questionnaires[name[:-3]] = questions
+    return questionnaires
+
+
+def _patient_text(department: str, answers: List[tuple], history: str) -> str:
+    """与后端 AIService._construct_patient_text_data 相同的格式"""
+    lines = ["**患者基本信息**", "姓名：测试患者", "性别：女", "年龄：35岁", f"就诊科室：{department}", "",
+             "**问卷回答**"]
+    lines.extend(f"{label}：{answer}" for label, answer in answers)
+    lines.append(f"既往病史（选填）：{history}")
+    lines.extend(["", "**主诉**", "患者描述了相关症状，请查看问卷详情"])
+    return "\n".join(lines)
+
+
+def _answer(questions: List[tuple], rng: random.Random, informative: float) -> List[tuple]:
+    answers = []
+    for label, options in questions:
+        negative = [option for option in options if pretriage._is_negative(pretriage._option_text(option))]
+        positive = [option for option in options if option not in negative]
+        use_positive = positive and (not negative or rng.random() < informative)
+        answers.append((label, rng.choice(positive if use_positive else negative)))
+    return answers
+
+
+def _build_cases(questionnaires, docs, rng: random.Random, noise: float) -> List[dict]:
+    cases = []
+    departments = sorted(questionnaires)
+    for path, department, text in docs:
+        match = _SYMPTOM_PATTERN.search(text)
+        history = match.group(1) if match else text[:60]
+        if department in questionnaires:
+            cases.append({"doc": path, "selected": department, "mismatch": False,
+                          "text": _patient_text(department, _answer(questionnaires[department], rng, 0.7), history)})
+        wrong = rng.choice([d for d in departments if d != department])
+        cases.append({"doc": path, "selected": wrong, "mismatch": True,
+                      "text": _patient_text(wrong, _answer(questionnaires[wrong], rng, noise), history)})
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="科室预分诊精确率 / 召回率评估")
+    parser.add_argument("--embedding", choices=["bge", "hashing"], default="bge")
+    parser.add_argument("--noise", type=float, default=0.3, help="错误科室提交中选择有效选项的题目比例")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.embedding == "bge":
+        import utils.utils as utils
+        embeddings = CachedEmbeddings(utils.get_bge_embedding_model())
+    else:
+        embeddings = CachedEmbeddings(HashingEmbeddings())
+
+    rng = random.Random(args.seed)
+    questionnaires = _load_questionnaires(config.QUESTIONNAIRE_DIRECTORY)
+    questionnaire_samples = pretriage.load_questionnaire_samples(config.QUESTIONNAIRE_DIRECTORY)
+    docs = []
+    for name in sorted(os.listdir(config.DOCS_DIRECTORY)):
+        department = rag_core.doc_department(name)
+        if department is None:
+            continue
+        with open(os.path.join(config.DOCS_DIRECTORY, name), encoding="utf-8") as f:
+            docs.append((name, department, f.read().strip()))
+    cases = _build_cases(questionnaires, docs, rng, args.noise)
+
+    # 留一法：每篇文档的提交使用剔除该文档后的质心
+    rankings = []
+    classify_ms = []
+    start = time.perf_counter()
+    for path, _, _ in docs:
+        samples = {department: list(texts) for department, texts in questionnaire_samples.items()}
+        for other_path, department, text in docs:
+            if other_path != path:
+                samples.setdefault(department, []).append(text)
+        triage = pretriage.DepartmentPreTriage(embeddings, samples)
+        for case in cases:
+            if case["doc"] != path:
+                continue
+            case_start = time.perf_counter()
+            result = triage.classify(case["text"], case["selected"])
+            classify_ms.append((time.perf_counter() - case_start) * 1000)
+            if result is not None:
+                rankings.append((case, result.ranking))
+    print(f"\n嵌入: {args.embedding}，提交 {len(cases)} 份（错误科室 {sum(c['mismatch'] for c in cases)} 份），"
+          f"可评估 {len(rankings)} 份，总耗时 {time.perf_counter() - start:.1f}s")
+    print(f"单次预分诊耗时（含患者描述嵌入）p50 {np.percentile(classify_ms, 50):.2f}ms / "
+          f"p95 {np.percentile(classify_ms, 95):.2f}ms")
+
+    print(f"\n{'最低排名':>8} {'差距':>6} {'拦截':>6} {'精确率':>8} {'召回率':>8} {'误拦率':>8} {'省去LLM调用':>12}")
+    for min_rank, margin in THRESHOLDS:
+        tp = fp = fn = tn = 0
+        for case, ranking in rankings:
+            scores = dict(ranking)
+            selected_rank = [department for department, _ in ranking].index(case["selected"]) + 1
+            flagged = selected_rank >= min_rank and ranking[0][1] - scores[case["selected"]] >= margin
+            if flagged and case["mismatch"]:
+                tp += 1
+            elif flagged:
+                fp += 1
+            elif case["mismatch"]:
+                fn += 1
+            else:
+                tn += 1
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        false_positive_rate = fp / (fp + tn) if fp + tn else 0.0
+        print(f"{min_rank:>8} {margin:>6.2f} {tp + fp:>6} {precision:>8.1%} {recall:>8.1%} "
+              f"{false_positive_rate:>8.1%} {tp * LLM_CALLS_PER_REQUEST:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+AIMD 限流器收敛测试
+
+启动一个并发上限为 --capacity 的假 LLM 服务，用 --workers 个线程持续发起调用，
+每秒打印一次限流器的并发上限、成功吞吐和 429 次数，观察并发上限是否收敛到服务商容量附近。
+加 --no-limiter 可对比不做限流时的 429 比例。
+
+--mixed-stages 不启动假服务：各线程轮流发起 keyword / stage1 / stage3 调用（耗时分别为 --latency-ms 的
+1 / 5 / 15 倍，全部成功），检查生成长度不同的阶段混合时并发上限不会被误判为延迟突增而下降，下降时退出码为 1。
+
+运行:
+    python benchmarks/bench_provider_limiter.py --capacity 8 --workers 32 --duration 30
+    python benchmarks/bench_provider_limiter.py --mixed-stages --workers 4 --requests 5 --latency-ms 10
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "zhipuGLM"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import utils.provider_limiter as provider_limiter
+import utils.scheduler as scheduler
+from fake_llm_server import start_fake_server
+
+# --mixed-stages 中各阶段的耗时倍数
+MIXED_STAGE_SCALES = {"keyword": 1, "stage1": 5, "stage3": 15}
+
+
+def run_mixed_stages(args) -> int:
+    limiter = provider_limiter.AdaptiveLimiter(
+        "bench",
+        initial_limit=args.workers,
+        min_limit=1,
+        max_limit=args.workers,
+        backoff_ratio=0.5,
+        latency_spike_factor=3.0,
+        max_retries=3,
+        acquire_timeout=60,
+        default_retry_after=0.5,
+    )
+    initial = limiter.limit
+
+    def worker():
+        for _ in range(args.requests):
+            for stage, scale in MIXED_STAGE_SCALES.items():
+                limiter.call(lambda: time.sleep(args.latency_ms * scale / 1000), stage=stage)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = limiter.stats()
+    print(f"[混合阶段] 线程数={args.workers} 每线程 {args.requests} 轮 keyword/stage1/stage3，无错误")
+    print(f"  并发上限: {initial:.2f} -> {limiter.limit:.2f}  回退次数: {stats['decreases']}")
+    print(f"  延迟基线(ms): {stats['latency_baseline_ms']}")
+    if stats["decreases"] or limiter.limit < initial:
+        print("  失败：无错误的混合阶段负载使并发上限下降")
+        return 1
+    print("  通过：并发上限保持不变")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AIMD 限流器收敛测试")
+    parser.add_argument("--capacity", type=int, default=8, help="假服务商的并发上限")
+    parser.add_argument("--workers", type=int, default=32, help="并发调用线程数")
+    parser.add_argument("--duration", type=float, default=30, help="测试时长（秒）")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--initial-limit", type=float, default=2)
+    parser.add_argument("--no-limiter", action="store_true", help="不经过限流器直接调用（对照组）")
+    parser.add_argument("--mixed-stages", action="store_true", help="检查无错误的混合阶段负载不会使并发上限下降")
+    parser.add_argument("--requests", type=int, default=5, help="--mixed-stages 时每个线程的轮数")
+    args = parser.parse_args()
+
+    if args.mixed_stages:
+        sys.exit(run_mixed_stages(args))
+
+    server = start_fake_server(capacity=args.capacity, latency_ms=args.latency_ms, retry_after=0.5)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v4/"
+    client = OpenAI(base_url=base_url, api_key="fake", max_retries=0)
+
+    limiter = provider_limiter.AdaptiveLimiter(
+        "bench",
+        initial_limit=args.initial_limit,
+        min_limit=1,
+        max_limit=args.workers,
+        backoff_ratio=0.5,
+        latency_spike_factor=3.0,
+        max_retries=3,
+        acquire_timeout=60,
+        default_retry_after=0.5,
+    )
+
+    counters = {"ok": 0, "failed": 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.duration
+
+    def call_once():
+        return client.chat.completions.create(
+            model="fake", messages=[{"role": "user", "content": "ping"}]
+        )
+
+    def worker():
+        while time.monotonic() < stop_at:
+            try:
+                if args.no_limiter:
+                    call_once()
+                else:
+                    limiter.call(call_once)
+                key = "ok"
+            except (scheduler.SchedulerRejected, Exception):
+                key = "failed"
+            with lock:
+                counters[key] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.workers)]
+    for t in threads:
+        t.start()
+
+    mode = "无限流" if args.no_limiter else "AIMD"
+    print(f"[{mode}] 服务商容量={args.capacity} 线程数={args.workers} 单次延迟≈{args.latency_ms:.0f}ms")
+    print(f"{'秒':>4} {'并发上限':>8} {'成功/秒':>8} {'429/秒':>8} {'服务端在途峰值':>14}")
+    last_ok, last_429 = 0, 0
+    second = 0
+    while time.monotonic() < stop_at:
+        time.sleep(1)
+        second += 1
+        snap = server.snapshot()
+        with lock:
+            ok = counters["ok"]
+        limit = "-" if args.no_limiter else f"{limiter.limit:.2f}"
+        print(f"{second:>4} {limit:>8} {ok - last_ok:>8} {snap['throttled'] - last_429:>8} {snap['max_inflight']:>14}")
+        last_ok, last_429 = ok, snap["throttled"]
+
+    for t in threads:
+        t.join(timeout=5)
+
+    snap = server.snapshot()
+    ideal = args.capacity / (args.latency_ms / 1000)
+    print("\n汇总:")
+    print(f"  成功调用: {counters['ok']}  失败: {counters['failed']}  服务端 429: {snap['throttled']}")
+    print(f"  平均吞吐: {counters['ok'] / args.duration:.1f}/s（容量上限约 {ideal:.1f}/s）")
+    if not args.no_limiter:
+        print(f"  限流器状态: {limiter.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+流式输出合并对比测试
+
+分别以逐 token 发送（STREAM_COALESCE_BYTES=0, STREAM_COALESCE_WINDOW_MS=0）和合并发送
+两种配置启动 AI 服务，通过流式 RPC 发起相同的请求，比较：
+- 每份报告的 gRPC 消息数；
+- AI 服务进程 CPU 时间（/proc/<pid>/stat 的 utime + stime，仅 Linux）；
+- 客户端观察到的相邻消息间隔（p50/p95/max）与首块延迟，即输出是否平滑。
+
+逐 token 模式下服务端不再逐块打印日志，因此 CPU 对比不含原先每个 token 一次 print 的开销。
+
+运行:
+    python benchmarks/bench_stream_coalescing.py --requests 20 --concurrency 4 --tokens-per-sec 80 --reply-tokens 600
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import grpc
+from bench_pipeline import PATIENT_TEXT, _start_fake_llm, _start_ai_server, _summary, pb2, pb2_grpc
+
+
+def _read_cpu_seconds(pid: int) -> float:
+    """进程累计 CPU 时间（秒），仅支持 Linux"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # 进程名可能包含空格，从最后一个 ')' 之后开始解析
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return 0.0
+
+
+def run_mode(args, name: str, coalesce_bytes: int, window_ms: float, image_base64: str, log) -> Dict:
+    os.environ["STREAM_COALESCE_BYTES"] = str(coalesce_bytes)
+    os.environ["STREAM_COALESCE_WINDOW_MS"] = str(window_ms)
+    llm_proc, llm_port = _start_fake_llm(args, log)
+    ai_proc = None
+    try:
+        ai_proc, address = _start_ai_server(args, llm_port, log)
+        channel = grpc.insecure_channel(address)
+        stub = pb2_grpc.MedicalAIServiceStub(channel)
+
+        messages: List[int] = []
+        gaps_ms: List[float] = []
+        first_ms: List[float] = []
+        report_bytes: List[int] = []
+        statuses: Dict[str, int] = {}
+        lock = threading.Lock()
+
+        def one(_):
+            request = pb2.AnalysisRequest(
+                patient_text_data=PATIENT_TEXT,
+                image_base64=image_base64,
+                stream=True,
+                patient_department="呼吸内科"
+            )
+            start = time.perf_counter()
+            arrivals = []
+            size = 0
+            status = "NO_END"
+            for chunk in stub.ProcessMedicalAnalysis(request, timeout=300):
+                if chunk.is_end:
+                    status = chunk.report.status if chunk.HasField("report") else "NO_REPORT"
+                    break
+                arrivals.append(time.perf_counter())
+                size += len(chunk.chunk_data)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                messages.append(len(arrivals))
+                report_bytes.append(size)
+                if arrivals:
+                    first_ms.append((arrivals[0] - start) * 1000)
+                gaps_ms.extend((b - a) * 1000 for a, b in zip(arrivals, arrivals[1:]))
+
+        # 预热一次，排除首次调用的初始化开销
+        one(None)
+        for collected in (messages, gaps_ms, first_ms, report_bytes):
+            collected.clear()
+        statuses.clear()
+
+        cpu_start = _read_cpu_seconds(ai_proc.pid)
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, range(args.requests)))
+        wall = time.perf_counter() - wall_start
+        cpu = _read_cpu_seconds(ai_proc.pid) - cpu_start
+        channel.close()
+    finally:
+        for proc in (ai_proc, llm_proc):
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    gaps_sorted = sorted(gaps_ms)
+    return {
+        "mode": name,
+        "statuses": statuses,
+        "messages_per_report": round(sum(messages) / max(len(messages), 1), 1),
+        "bytes_per_report": round(sum(report_bytes) / max(len(report_bytes), 1)),
+        "server_cpu_ms_per_report": round(cpu * 1000 / max(args.requests, 1), 1),
+        "wall_s": round(wall, 2),
+        "gap_ms": {**_summary(gaps_ms), "max": round(gaps_sorted[-1], 1) if gaps_sorted else 0.0},
+        "first_chunk_ms": _summary(first_ms),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式输出合并对比测试")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--coalesce-bytes", type=int, default=512)
+    parser.add_argument("--coalesce-window-ms", type=float, default=50)
+    parser.add_argument("--image-kb", type=int, default=20)
+    parser.add_argument("--retriever", choices=["chroma", "fake"], default="fake")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    # 假 LLM 服务参数
+    parser.add_argument("--llm-capacity", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--latency-dist", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=80)
+    parser.add_argument("--reply-tokens", type=int, default=600)
+    parser.add_argument("--tail-prob", type=float, default=0.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    image_base64 = base64.b64encode(os.urandom(args.image_kb * 1024)).decode("ascii")
+    log = tempfile.NamedTemporaryFile("w", prefix="medimeow-bench-stream-", suffix=".log", delete=False)
+    print(f"服务日志: {log.name}")
+    modes = [
+        ("逐 token", 0, 0),
+        (f"合并 {args.coalesce_bytes}B/{args.coalesce_window_ms:g}ms", args.coalesce_bytes, args.coalesce_window_ms),
+    ]
+    try:
+        results = [run_mode(args, name, size, window, image_base64, log) for name, size, window in modes]
+    finally:
+        log.close()
+
+    print(f"\n请求 {args.requests}，并发 {args.concurrency}，生成速度 {args.tokens_per_sec:g} token/s，"
+          f"回复 {args.reply_tokens} token")
+    header = f"{'模式':<22} {'消息/报告':>9} {'CPU ms/报告':>11} {'间隔p50':>8} {'间隔p95':>8} {'间隔max':>8} {'首块p50':>8}"
+    print(header)
+    for r in results:
+        print(f"{r['mode']:<22} {r['messages_per_report']:>9} {r['server_cpu_ms_per_report']:>11} "
+              f"{r['gap_ms']['p50']:>8} {r['gap_ms']['p95']:>8} {r['gap_ms']['max']:>8} {r['first_chunk_ms']['p50']:>8}")
+        print(f"{'':<22} 状态 {r['statuses']}，{r['bytes_per_report']} 字节/报告，耗时 {r['wall_s']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+本地假 LLM 服务（OpenAI 兼容 /chat/completions 接口）
+
+用于在不消耗真实额度的情况下压测 AI 服务的限流、重试与调度逻辑：
+- --capacity：服务商同时处理的请求上限，超出部分立即返回 429（携带 Retry-After）；
+- --latency-ms / --jitter-ms：首个 token 之前的耗时（uniform 分布为 ±jitter，lognormal 分布以 latency 为中位数）；
+- --tokens-per-sec / --reply-tokens：生成速度与回复长度，流式输出按该速度逐 token 推送；
+- --prefill-chars-per-sec：提示词处理速度，首个 token 之前额外等待 提示词字符数 / 该速度；
+- --tail-prob / --tail-ms：以一定概率额外卡顿（重尾延迟），用于测试对冲请求；
+- --error-rate：随机返回 503 的比例；
+- 支持 stream=True 的 SSE 流式输出。
+
+运行:
+    python benchmarks/fake_llm_server.py --port 18080 --capacity 8
+然后将 GLM_API_BASE 指向 http://127.0.0.1:18080/v4/
+"""
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+DEFAULT_REPLY = (
+    "【多模态描述】患者自述症状与舌象描述（假数据）。\n"
+    "【诊断建议】建议结合线下检查进一步明确诊断（假数据）。"
+)
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, capacity: int, latency_ms: float, jitter_ms: float,
+                 retry_after: float, error_rate: float, tail_prob: float = 0.0, tail_ms: float = 0.0,
+                 reply: str = DEFAULT_REPLY, latency_dist: str = "uniform", sigma: float = 0.5,
+                 tokens_per_sec: float = 0.0, reply_tokens: int = 0, prefill_chars_per_sec: float = 0.0):
+        super().__init__(address, _Handler)
+        self.capacity = capacity
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.tail_prob = tail_prob
+        self.tail_ms = tail_ms
+        self.latency_dist = latency_dist
+        self.sigma = sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.prefill_chars_per_sec = prefill_chars_per_sec
+        # 每个 token 按 2 个字符近似；reply_tokens 为 0 时使用原始回复
+        if reply_tokens:
+            reply = (reply * (reply_tokens * 2 // len(reply) + 1))[:reply_tokens * 2]
+        self.reply = reply
+        self.tokens = [reply[i:i + 2] for i in range(0, len(reply), 2)]
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.counters: Dict[str, int] = {
+            "ok": 0, "throttled": 0, "server_error": 0, "client_closed": 0, "tail_delays": 0, "max_inflight": 0
+        }
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self._inflight >= self.capacity:
+                self.counters["throttled"] += 1
+                return False
+            self._inflight += 1
+            self.counters["max_inflight"] = max(self.counters["max_inflight"], self._inflight)
+            return True
+
+    def leave(self, outcome: str) -> None:
+        with self._lock:
+            self._inflight -= 1
+            self.counters[outcome] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, "inflight": self._inflight}
+
+    def sample_latency(self) -> float:
+        if self.latency_dist == "lognormal":
+            latency_ms = random.lognormvariate(math.log(max(self.latency_ms, 1.0)), self.sigma)
+        else:
+            latency_ms = max(self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0.0)
+        if self.tail_prob and random.random() < self.tail_prob:
+            with self._lock:
+                self.counters["tail_delays"] += 1
+            latency_ms += self.tail_ms
+        return latency_ms / 1000
+
+    def prefill_delay(self, body: dict) -> float:
+        """按提示词长度计算的处理耗时（秒）；消息内容为多模态列表时只统计文本部分"""
+        if self.prefill_chars_per_sec <= 0:
+            return 0.0
+        chars = 0
+        for message in body.get("messages", []):
+            content = message.get("content") or ""
+            if isinstance(content, list):
+                content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            chars += len(content)
+        return chars / self.prefill_chars_per_sec
+
+    def token_interval(self) -> float:
+        return 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeLLMServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        if not self.server.try_enter():
+            self._send_json(
+                429,
+                {"error": {"code": "1302", "message": "并发数过高，请降低并发"}},
+                {"Retry-After": f"{self.server.retry_after:g}"}
+            )
+            return
+
+        outcome = "ok"
+        try:
+            time.sleep(self.server.sample_latency() + self.server.prefill_delay(body))
+            if random.random() < self.server.error_rate:
+                outcome = "server_error"
+                self._send_json(503, {"error": {"message": "service unavailable"}})
+                return
+            if body.get("stream"):
+                try:
+                    self._stream_reply(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端中途关闭连接（如对冲请求落败被取消）
+                    outcome = "client_closed"
+            else:
+                # 非流式响应需等待全部 token 生成完毕
+                time.sleep(self.server.token_interval() * len(self.server.tokens))
+                self._send_json(200, self._completion(body))
+        finally:
+            self.server.leave(outcome)
+
+    def _completion(self, body: dict) -> dict:
+        return {
+            "id": f"chatcmpl-fake-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.server.reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def _stream_reply(self, body: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        pieces = self.server.tokens
+        interval = self.server.token_interval()
+        for index, piece in enumerate(pieces):
+            if interval:
+                time.sleep(interval)
+            last = index == len(pieces) - 1
+            event = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": piece},
+                    "finish_reason": "stop" if last else None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def start_fake_server(port: int = 0, capacity: int = 8, latency_ms: float = 200, jitter_ms: float = 50,
+                      retry_after: float = 0.5, error_rate: float = 0.0,
+                      tail_prob: float = 0.0, tail_ms: float = 0.0, latency_dist: str = "uniform",
+                      sigma: float = 0.5, tokens_per_sec: float = 0.0, reply_tokens: int = 0,
+                      prefill_chars_per_sec: float = 0.0) -> FakeLLMServer:
+    """在后台线程启动假服务；port=0 时自动分配端口（server.server_address[1]）"""
+    server = FakeLLMServer(
+        ("127.0.0.1", port), capacity, latency_ms, jitter_ms, retry_after, error_rate, tail_prob, tail_ms,
+        latency_dist=latency_dist, sigma=sigma, tokens_per_sec=tokens_per_sec, reply_tokens=reply_tokens,
+        prefill_chars_per_sec=prefill_chars_per_sec
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地假 LLM 服务")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--capacity", type=int, default=8, help="同时处理的请求上限，超出返回 429")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--retry-after", type=float, default=0.5, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 503 的比例")
+    parser.add_argument("--tail-prob", type=float, default=0.0, help="请求额外卡顿的概率")
+    parser.add_argument("--tail-ms", type=float, default=0.0, help="卡顿请求额外增加的耗时")
+    parser.add_argument("--latency-dist", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal 分布的 sigma")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="生成速度，0 表示立即返回全部内容")
+    parser.add_argument("--reply-tokens", type=int, default=0, help="回复长度（token 数），0 使用默认回复")
+    parser.add_argument("--prefill-chars-per-sec", type=float, default=0.0,
+                        help="提示词处理速度（字符/秒），0 表示首 token 延迟与提示词长度无关")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(
+        ("127.0.0.1", args.port), args.capacity, args.latency_ms,
+        args.jitter_ms, args.retry_after, args.error_rate, args.tail_prob, args.tail_ms,
+        latency_dist=args.latency_dist, sigma=args.sigma,
+        tokens_per_sec=args.tokens_per_sec, reply_tokens=args.reply_tokens,
+        prefill_chars_per_sec=args.prefill_chars_per_sec
+    )
+    print(f"假 LLM 服务已启动: http://127.0.0.1:{args.port}/v4/ (capacity={args.capacity})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
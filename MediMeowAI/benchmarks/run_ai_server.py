@@ -0,0 +1,120 @@
+"""
+压测用 AI 服务启动脚本
+
+与 connect/server.py 相同地启动 MedicalAIService，额外支持 --retriever fake：
+用基于字符二元组重叠度的内存检索替代 Chroma + bge 向量库，
+使压测不依赖嵌入模型下载，只关注 gRPC、调度与 LLM 调用路径。
+--search-cpu-ms 在每次检索中执行纯 Python 计算（持有 GIL），模拟查询向量计算、分词等 CPU 开销。
+
+LLM 地址、监听端口等通过环境变量传入（GLM_API_BASE / AI_GRPC_ADDRESS 等），
+通常由 bench_pipeline.py 负责启动，无需手动运行。
+"""
+import os
+import sys
+import glob
+import time
+import heapq
+import argparse
+from typing import List, Optional
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "connect"))
+sys.path.insert(0, _ROOT)
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _burn_cpu(ms: float) -> None:
+    """占用约 ms 毫秒的 CPU 时间（按线程 CPU 时间计，多线程争用 GIL 时墙钟时间更长）"""
+    deadline = time.thread_time() + ms / 1000
+    value = 0
+    while time.thread_time() < deadline:
+        for i in range(1000):
+            value += i * i
+
+
+class KeywordVectorStore:
+    """按字符二元组重叠度检索 medical_docs，接口与 Chroma 的检索用法一致
+
+    相关度为查询二元组被文档块覆盖的比例（0~1），支持按元数据等值过滤（如 {"department": "眼科"}）。
+    """
+
+    def __init__(self, docs_dir: str, chunk_size: int = 1000, cpu_ms: float = 0.0):
+        from langchain_core.documents import Document
+        import rag.rag_core as rag_core
+
+        self._cpu_ms = cpu_ms
+        self._chunks = []
+        for path in sorted(glob.glob(os.path.join(docs_dir, "**", "*.txt"), recursive=True)):
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            for start in range(0, len(text), chunk_size):
+                content = text[start:start + chunk_size]
+                doc = Document(page_content=content, metadata={"source": path, **rag_core.chunk_metadata(path)})
+                self._chunks.append((doc, _bigrams(content)))
+        print(f"--- 假检索器已加载 {len(self._chunks)} 个文档块 ---")
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def as_retriever(self, search_kwargs=None):
+        return _KeywordRetriever(self, (search_kwargs or {}).get("k", 4))
+
+    def search(self, query: str, k: int) -> List:
+        return [doc for doc, _ in self.similarity_search_with_relevance_scores(query, k)]
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List:
+        if self._cpu_ms > 0:
+            _burn_cpu(self._cpu_ms)
+        query_grams = _bigrams(query)
+        scored = (
+            (len(query_grams & grams) / max(len(query_grams), 1), index)
+            for index, (doc, grams) in enumerate(self._chunks)
+            if not filter or all(doc.metadata.get(key) == value for key, value in filter.items())
+        )
+        return [(self._chunks[index][0], score) for score, index in heapq.nlargest(k, scored)]
+
+
+class _KeywordRetriever:
+    def __init__(self, store: KeywordVectorStore, k: int):
+        self._store = store
+        self._k = k
+
+    def invoke(self, query: str):
+        return self._store.search(query, self._k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测用 AI 服务")
+    parser.add_argument("--retriever", choices=["chroma", "fake"], default="fake",
+                        help="chroma 使用真实向量库（需 bge 模型），fake 使用内存关键词检索")
+    parser.add_argument("--search-cpu-ms", type=float, default=0.0, help="假检索器每次检索额外占用的 CPU 时间")
+    args = parser.parse_args()
+
+    import server
+    import config.config as ai_config
+    import rag.rag_core as rag_core
+    import utils.context_assembler as context_assembler
+
+    if args.retriever == "fake":
+        def fake_store(*_args, **_kwargs):
+            return KeywordVectorStore(ai_config.DOCS_DIRECTORY, cpu_ms=args.search_cpu_ms)
+
+        def fake_build(persist_dir, embeddings=None):
+            # 只创建版本目录（多进程模式下其他工作进程据此跟随切换），不写入向量数据
+            os.makedirs(persist_dir, exist_ok=True)
+            return fake_store()
+
+        rag_core.build_or_load_rag_index = fake_store
+        rag_core.build_rag_index = fake_build
+        rag_core.load_rag_index = fake_store
+        # 多进程模式下父进程不加载 bge 模型
+        server.preload_shared_resources = context_assembler.preload
+
+    server.run_server()
+
+
+if __name__ == "__main__":
+    main()
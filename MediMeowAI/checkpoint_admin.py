@@ -0,0 +1,113 @@
+"""
+阶段检查点管理工具
+
+查看、删除或清理 AI 服务保存的分析阶段检查点（与服务共用 CHECKPOINT_DB_PATH）：
+
+    python checkpoint_admin.py list [--limit 20]
+    python checkpoint_admin.py show <request_id> [--full]
+    python checkpoint_admin.py delete <request_id>
+    python checkpoint_admin.py purge
+    python checkpoint_admin.py stats
+"""
+import sys
+import os
+import argparse
+from datetime import datetime
+
+# 添加 zhipuGLM 目录到路径（与 service 模块相同的导入方式）
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(project_root, "zhipuGLM"))
+
+import config.config as config
+import utils.checkpoint as checkpoint
+
+# show 默认每个字段最多显示的字符数
+PREVIEW_CHARS = 200
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _preview(value, full: bool) -> str:
+    text = str(value)
+    if full or len(text) <= PREVIEW_CHARS:
+        return text
+    return f"{text[:PREVIEW_CHARS]}...（共 {len(text)} 字符）"
+
+
+def cmd_list(store: checkpoint.CheckpointStore, args) -> None:
+    rows = store.list_requests(args.limit)
+    if not rows:
+        print("没有检查点")
+        return
+    print(f"{'request_id':<40} {'更新时间':<20} 已完成阶段")
+    for row in rows:
+        print(f"{row['request_id']:<40} {_format_time(row['updated_at']):<20} {', '.join(row['stages'])}")
+
+
+def cmd_show(store: checkpoint.CheckpointStore, args) -> None:
+    entries = store.get(args.request_id)
+    if not entries:
+        print(f"未找到请求 {args.request_id} 的检查点")
+        return
+    print(f"请求 {args.request_id}（输入指纹 {entries[0]['fingerprint'][:16]}）")
+    for entry in entries:
+        print(f"\n[{entry['stage']}] {_format_time(entry['created_at'])}")
+        for key, value in entry["payload"].items():
+            if key == "chunks":
+                print(f"  chunks: {len(value)} 个")
+                for chunk in value:
+                    print(f"    - id={chunk.get('id')} source={chunk.get('source')} "
+                          f"department={chunk.get('department')} score={chunk.get('score')}")
+            else:
+                print(f"  {key}: {_preview(value, args.full)}")
+
+
+def cmd_delete(store: checkpoint.CheckpointStore, args) -> None:
+    deleted = store.delete(args.request_id)
+    print(f"已删除 {deleted} 条检查点")
+
+
+def cmd_purge(store: checkpoint.CheckpointStore, args) -> None:
+    purged = store.purge_expired()
+    print(f"已清理 {purged} 条过期检查点（保留 {config.CHECKPOINT_TTL_SECONDS:.0f} 秒内的记录）")
+
+
+def cmd_stats(store: checkpoint.CheckpointStore, args) -> None:
+    print(f"数据库: {store.db_path}")
+    print(f"请求数: {store.stats()['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI 分析阶段检查点管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("list", help="列出最近的检查点")
+    p.add_argument("--limit", type=int, default=20)
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("show", help="查看某个请求的检查点内容")
+    p.add_argument("request_id")
+    p.add_argument("--full", action="store_true", help="显示完整内容")
+    p.set_defaults(func=cmd_show)
+
+    p = sub.add_parser("delete", help="删除某个请求的检查点（下次重试从头开始）")
+    p.add_argument("request_id")
+    p.set_defaults(func=cmd_delete)
+
+    p = sub.add_parser("purge", help="清理过期检查点")
+    p.set_defaults(func=cmd_purge)
+
+    p = sub.add_parser("stats", help="检查点数量")
+    p.set_defaults(func=cmd_stats)
+
+    args = parser.parse_args()
+    if not os.path.exists(config.CHECKPOINT_DB_PATH):
+        print(f"检查点数据库不存在: {config.CHECKPOINT_DB_PATH}")
+        return
+    args.func(checkpoint.CheckpointStore.from_config(), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -79,6 +79,8 @@ def stream_call(patient_dept: str):
             chunk_str = response_chunk.chunk_data.decode('utf-8')
             if chunk_str == "[STREAM_END]":
                 print("\n流式接收完毕（收到结束标记）")
+                if response_chunk.HasField("report"):
+                    print(f"   状态: {response_chunk.report.status}, 总耗时: {response_chunk.report.timings.total_ms:.0f}ms")
                 break
             print(f"[流式chunk] {chunk_str}", end="")
             if not response_chunk.is_end:
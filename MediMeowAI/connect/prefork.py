@@ -0,0 +1,145 @@
+"""
+多进程模式的工作进程监督（AI_WORKERS > 1，仅 Linux）
+
+单个 Python 进程中，嵌入计算、分词、JSON / protobuf 序列化等 CPU 工作受 GIL 限制只能用满一个核。多进程模式：
+1. 父进程加载只读的共享资源（bge 模型、tiktoken 编码、文档块向量文件），不创建 gRPC 对象、不启动后台线程；
+2. 父进程以 SO_REUSEPORT 绑定监听地址占住端口，fork 出 AI_WORKERS 个工作进程，
+   每个工作进程各自初始化服务并在同一端口上启动 gRPC 服务端，由内核在工作进程间分配新连接；
+   fork 前加载的模型权重等内存页以写时复制方式共享；
+3. 父进程监督工作进程：异常退出时按退避时间重启；收到 SIGTERM / SIGINT 时通知工作进程退出并等待。
+
+连接建立后固定由一个工作进程处理：客户端复用同一条连接时，请求不会分散到多个工作进程。
+"""
+import os
+import time
+import signal
+import socket
+import logging
+from typing import Callable, Dict, Tuple
+
+import config.config as ai_config
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_port(address: str) -> Tuple[socket.socket, str]:
+    """以 SO_REUSEPORT 绑定监听地址并保持打开，返回 (套接字, 实际地址)
+
+    父进程持有该套接字但不 listen，不会分到连接；工作进程全部重启期间端口也不会被其他程序占用。
+    端口为 0 时返回实际分配的端口，供工作进程监听。
+    """
+    host, port = address.rsplit(":", 1)
+    host = host.strip("[]")
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, int(port)))
+    bound = sock.getsockname()[1]
+    return sock, f"[{host}]:{bound}" if family == socket.AF_INET6 else f"{host}:{bound}"
+
+
+def _describe_status(status: int) -> str:
+    code = os.waitstatus_to_exitcode(status)
+    return f"signal {signal.Signals(-code).name}" if code < 0 else f"exit {code}"
+
+
+class WorkerSupervisor:
+    """fork 出 workers 个工作进程执行 worker_main(编号)，并在其退出时重启
+
+    连续快速退出（运行不足 AI_WORKER_STABLE_SECONDS）时重启等待从 AI_WORKER_RESTART_BACKOFF_SECONDS
+    开始翻倍，最长 AI_WORKER_RESTART_MAX_BACKOFF_SECONDS，避免启动即崩溃时反复 fork。
+    """
+
+    def __init__(self, workers: int, worker_main: Callable[[int], None]):
+        self.workers = workers
+        self._worker_main = worker_main
+        self._pids: Dict[int, int] = {}          # pid -> 工作进程编号
+        self._started_at: Dict[int, float] = {}  # 编号 -> 启动时间
+        self._backoff: Dict[int, float] = {}     # 编号 -> 上次的重启等待
+        self._restart_at: Dict[int, float] = {}  # 编号 -> 计划重启时间
+        self._stopping = False
+        self.restarts = 0
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # 工作进程：恢复默认信号处理，执行完毕后直接退出，不返回父进程的监督循环
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            code = 0
+            try:
+                self._worker_main(index)
+            except BaseException:
+                logger.exception("工作进程 %d 异常退出", index)
+                code = 1
+            finally:
+                os._exit(code)
+        self._pids[pid] = index
+        self._started_at[index] = time.monotonic()
+        logger.info("工作进程已启动", extra={"worker": index, "pid": pid})
+
+    def _request_stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _reap(self) -> None:
+        """回收已退出的工作进程；未在停止过程中时安排重启"""
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self._pids.pop(pid, None)
+            if index is None or self._stopping:
+                continue
+            uptime = time.monotonic() - self._started_at[index]
+            previous = self._backoff.get(index)
+            if previous is None or uptime >= ai_config.AI_WORKER_STABLE_SECONDS:
+                delay = ai_config.AI_WORKER_RESTART_BACKOFF_SECONDS
+            else:
+                delay = min(previous * 2, ai_config.AI_WORKER_RESTART_MAX_BACKOFF_SECONDS)
+            self._backoff[index] = delay
+            self._restart_at[index] = time.monotonic() + delay
+            logger.warning("工作进程异常退出，%.1f 秒后重启", delay, extra={
+                "worker": index, "pid": pid, "status": _describe_status(status), "uptime_s": round(uptime, 1),
+            })
+
+    def run(self) -> None:
+        """启动全部工作进程并监督，直到收到 SIGTERM / SIGINT 后停止全部工作进程"""
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for index in range(self.workers):
+            self._spawn(index)
+        while not self._stopping:
+            self._reap()
+            now = time.monotonic()
+            for index, due in list(self._restart_at.items()):
+                if now >= due and not self._stopping:
+                    del self._restart_at[index]
+                    self.restarts += 1
+                    self._spawn(index)
+            time.sleep(0.2)
+        self._shutdown()
+
+    def _shutdown(self) -> None:
+        logger.info("正在停止 %d 个工作进程...", len(self._pids))
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + ai_config.AI_WORKER_STOP_TIMEOUT_SECONDS
+        while self._pids and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self._pids):
+            logger.warning("工作进程未在 %.0f 秒内退出，强制结束", ai_config.AI_WORKER_STOP_TIMEOUT_SECONDS,
+                           extra={"pid": pid})
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self._pids.pop(pid, None)
@@ -5,6 +5,13 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))  # 添加 connect 
 import grpc
 from concurrent import futures
 import time
+import signal
+import functools
+import json
+import inspect
+import logging
+from typing import Optional
+from opentelemetry.trace import SpanKind
 import medical_ai_pb2 as pb2
 import medical_ai_pb2_grpc as pb2_grpc
 
@@ -12,53 +19,192 @@ import medical_ai_pb2_grpc as pb2_grpc
 from zhipuGLM.service import (
     process_medical_analysis,
     initialize_service,
+    preload_shared_resources,
+    get_service_stats,
+    reload_knowledge_base,
     AnalysisRequest as ServiceRequest,
     AnalysisReport as ServiceReport
 )
+import config.config as ai_config  # zhipuGLM 目录已由 service 模块加入路径
+import utils.tracing as tracing
+import utils.scheduler as scheduler
+import utils.cancellation as cancellation
+import utils.stream_coalescer as stream_coalescer
+import utils.image_codec as image_codec
+from utils.log import setup_logging, shutdown_logging, reinit_after_fork, log_context
+import prefork
+
+logger = logging.getLogger(__name__)
+
+
+def _traced_rpc(method_name: str):
+    """为 RPC 方法创建服务端 span（父上下文取自客户端通过 metadata 传递的 traceparent），
+    并将方法名与后端提交ID附加到该 RPC 产生的所有日志"""
+    span_name = f"medical_ai.MedicalAIService/{method_name}"
+
+    def _start_span(request, context):
+        return tracing.get_tracer().start_as_current_span(
+            span_name,
+            context=tracing.extract_context(context.invocation_metadata()),
+            kind=SpanKind.SERVER,
+            attributes={
+                "rpc.system": "grpc",
+                "rpc.method": method_name,
+                "analysis.department": request.patient_department,
+                "analysis.stream": request.stream,
+            }
+        )
+
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(self, request, context):
+                with log_context(rpc=method_name, request_id=request.request_id or None), \
+                        _start_span(request, context):
+                    yield from func(self, request, context)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, request, context):
+            with log_context(rpc=method_name, request_id=request.request_id or None), \
+                    _start_span(request, context) as span:
+                response = func(self, request, context)
+                span.set_attribute("analysis.status", response.status)
+                return response
+        return wrapper
+    return decorator
+
+
+def _service_deadline(context) -> Optional[float]:
+    """将 gRPC 截止时间换算为 time.monotonic 时间戳；客户端未设置时返回 None"""
+    remaining = context.time_remaining()
+    if remaining is None:
+        return None
+    return time.monotonic() + remaining
+
+
+def _cancel_token(context) -> cancellation.CancelToken:
+    """创建与 RPC 生命周期绑定的取消凭证：客户端取消或超时后，进行中的分析尽快停止"""
+    token = cancellation.CancelToken(_service_deadline(context))
+
+    def on_rpc_done():
+        # RPC 正常结束时也会触发，此时分析已完成，置位不影响结果
+        remaining = context.time_remaining()
+        expired = remaining is not None and remaining <= 0
+        token.cancel(cancellation.REASON_DEADLINE if expired else cancellation.REASON_CANCELLED)
+
+    context.add_callback(on_rpc_done)
+    return token
+
+
+def _abort_cancelled(context, error: cancellation.AnalysisAborted):
+    """请求已取消或超时：客户端通常已不再等待，仅记录并结束 RPC"""
+    logger.warning("分析已中止", extra={"stage": error.stage, "reason": error.reason})
+    if error.reason == cancellation.REASON_DEADLINE:
+        context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, f"AI分析超时（{error.stage}）")
+    context.abort(grpc.StatusCode.CANCELLED, f"AI分析已取消（{error.stage}）")
+
+
+def _reject_overloaded(context, error: scheduler.SchedulerRejected):
+    """调度器拒绝请求时快速失败，让后端立即走降级逻辑"""
+    logger.warning("请求被准入控制拒绝", extra={"stage": error.stage, "reason": error.reason})
+    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, f"AI服务繁忙（{error.stage}: {error.reason}），请稍后重试")
+
+
+def _request_images(request) -> list:
+    """请求中的图片列表（data URL）；超过 STAGE1_MAX_IMAGES 的部分忽略"""
+    count = _image_count(request)
+    if count > ai_config.STAGE1_MAX_IMAGES:
+        logger.warning("图片数量超过上限，多余图片不参与分析", extra={
+            "images": count, "max_images": ai_config.STAGE1_MAX_IMAGES
+        })
+    if request.images:
+        # 原始字节只在此处编码一次，超出上限的图片不编码
+        return [
+            image_codec.to_data_url(image.data, image.mime_type)
+            for image in request.images[:ai_config.STAGE1_MAX_IMAGES]
+        ]
+    images = list(request.images_base64) or ([request.image_base64] if request.image_base64 else [])
+    return images[:ai_config.STAGE1_MAX_IMAGES]
+
+
+def _image_count(request) -> int:
+    return len(request.images) or len(request.images_base64) or int(bool(request.image_base64))
+
+
+def _build_report(result: ServiceReport, message: str) -> pb2.AnalysisReport:
+    """将服务层结果转换为 AnalysisReport，附带各阶段耗时与模型标识"""
+    if result.shared:
+        message = f"{message}（与同一请求ID的进行中分析合并）"
+    elif result.resumed_stages:
+        message = f"{message}（从检查点恢复: {', '.join(result.resumed_stages)}）"
+    return pb2.AnalysisReport(
+        structured_report=result.structured_report,
+        status=result.status,
+        message=message,
+        timings=pb2.StageTimings(**result.timings),
+        key_info=pb2.KeyInfo(**result.key_info) if result.key_info else None,
+        model_info=pb2.ModelInfo(
+            llm_model=ai_config.LLM_MODEL_NAME,
+            embedding_model=ai_config.BGE_EMBEDDING_MODEL_NAME,
+            service_version=ai_config.SERVICE_VERSION
+        )
+    )
 
 class MedicalAIService(pb2_grpc.MedicalAIServiceServicer):
+    @_traced_rpc("ProcessMedicalAnalysisSync")
     def ProcessMedicalAnalysisSync(self, request, context):
         """非流式（同步）RPC 方法 - 推荐使用"""
+        received_at = time.perf_counter()
         patient_dept = request.patient_department
-        print(f"[同步RPC] 收到分析请求：科室={patient_dept}, 文本长度={len(request.patient_text_data)}, 图片Base64长度={len(request.image_base64)}")
+        logger.info("收到分析请求", extra={
+            "department": patient_dept,
+            "text_len": len(request.patient_text_data),
+            "images": _image_count(request),
+        })
 
         try:
-            print("正在调用AI分析服务（同步模式）...")
             # 构建服务请求，强制同步模式
             service_request = ServiceRequest(
                 patient_text_data=request.patient_text_data,
                 image_base64=request.image_base64,
-                stream=False  # 强制非流式
+                stream=False,  # 强制非流式
+                received_at=received_at,
+                priority=request.priority,
+                deadline=_service_deadline(context),
+                cancel_token=_cancel_token(context),
+                request_id=request.request_id,
+                images_base64=_request_images(request),
+                patient_department=request.patient_department
             )
             
             # 调用AI分析服务
             result = process_medical_analysis(service_request)
-            print("AI分析服务调用完成")
             
             # 返回同步结果
             if isinstance(result, ServiceReport):
-                print(f"报告状态: {result.status}, 报告长度: {len(result.structured_report)}")
-                return pb2.AnalysisReport(
-                    structured_report=result.structured_report,
-                    status=result.status,
-                    message="AI分析完成"
-                )
+                logger.info("AI分析完成", extra={
+                    "status": result.status,
+                    "report_len": len(result.structured_report),
+                    "total_ms": round(result.timings.get("total_ms", 0)),
+                })
+                return _build_report(result, "AI分析完成")
             else:
                 # 服务返回类型异常
-                print("AI服务返回类型异常")
+                logger.error("AI服务返回类型异常: %s", type(result).__name__)
                 return pb2.AnalysisReport(
                     structured_report="",
                     status="INTERNAL_ERROR",
                     message="AI服务返回类型异常"
                 )
                 
+        except cancellation.AnalysisAborted as e:
+            _abort_cancelled(context, e)
+        except scheduler.SchedulerRejected as e:
+            _reject_overloaded(context, e)
         except Exception as e:
             # 处理异常
-            error_msg = f"AI服务调用失败: {str(e)}"
-            print(f"错误: {error_msg}")
-            print(f"异常类型: {type(e).__name__}")
-            import traceback
-            print(f"堆栈跟踪:\n{traceback.format_exc()}")
+            logger.exception("AI服务调用失败: %s", e)
             short_error_msg = str(e)[:200] + "..." if len(str(e)) > 200 else str(e)
             return pb2.AnalysisReport(
                 structured_report="",
@@ -66,42 +212,52 @@ class MedicalAIService(pb2_grpc.MedicalAIServiceServicer):
                 message=f"AI分析失败: {short_error_msg}"
             )
     
+    @_traced_rpc("ProcessMedicalAnalysis")
     def ProcessMedicalAnalysis(self, request, context):
+        received_at = time.perf_counter()
         patient_dept = request.patient_department
-        print(f"收到分析请求：科室={patient_dept}, 流式={request.stream}, 文本长度={len(request.patient_text_data)}, 图片Base64长度={len(request.image_base64)}")
+        logger.info("收到分析请求", extra={
+            "department": patient_dept,
+            "stream": request.stream,
+            "text_len": len(request.patient_text_data),
+            "images": _image_count(request),
+        })
 
         # 调用真实的AI服务
         try:
-            print("正在调用AI分析服务...")
             # 构建服务请求
             service_request = ServiceRequest(
                 patient_text_data=request.patient_text_data,
                 image_base64=request.image_base64,
-                stream=request.stream
+                stream=request.stream,
+                received_at=received_at,
+                priority=request.priority,
+                deadline=_service_deadline(context),
+                cancel_token=_cancel_token(context),
+                request_id=request.request_id,
+                images_base64=_request_images(request),
+                patient_department=request.patient_department
             )
             
             # 调用AI分析服务
             result = process_medical_analysis(service_request)
-            print("AI分析服务调用完成")
             
             # 3. 同步/流式返回（均用bytes）
             if not request.stream:
-                print("返回同步结果")
                 # 同步模式：返回完整报告
                 if isinstance(result, ServiceReport):
-                    print(f"报告状态: {result.status}, 报告长度: {len(result.structured_report)}")
-                    sync_response = pb2.AnalysisReport(
-                        structured_report=result.structured_report,
-                        status=result.status,
-                        message="AI分析完成"
-                    )
+                    logger.info("AI分析完成", extra={
+                        "status": result.status,
+                        "report_len": len(result.structured_report),
+                    })
+                    sync_response = _build_report(result, "AI分析完成")
                     yield pb2.StreamChunk(
                         chunk_data=sync_response.SerializeToString(),
                         is_end=True
                     )
                 else:
                     # 服务返回错误
-                    print("AI服务返回类型异常")
+                    logger.error("AI服务返回类型异常: %s", type(result).__name__)
                     error_response = pb2.AnalysisReport(
                         structured_report="",
                         status="INTERNAL_ERROR",
@@ -112,34 +268,47 @@ class MedicalAIService(pb2_grpc.MedicalAIServiceServicer):
                         is_end=True
                     )
             else:
-                print("开始流式传输")
-                # 流式模式：逐块传输
-                chunk_count = 0
-                for chunk in result:
-                    chunk_count += 1
-                    if chunk == "[STREAM_END]":
-                        print(f"流式传输结束，总块数: {chunk_count}")
-                        # 结束标记
-                        yield pb2.StreamChunk(
-                            chunk_data=chunk.encode('utf-8'),
-                            is_end=True
-                        )
-                        break
-                    else:
-                        # 正常数据块
-                        print(f"发送数据块 {chunk_count}: {len(chunk)} 字符")
-                        yield pb2.StreamChunk(
-                            chunk_data=chunk.encode('utf-8'),
-                            is_end=False
-                        )
+                # 流式模式：LLM 增量按字节数/时间窗口合并后发送，避免每个 token 一条消息
+                coalescer = stream_coalescer.ChunkCoalescer.from_config()
+                # 服务未就绪或出错时直接返回 AnalysisReport，按结束消息发送
+                items = [result] if isinstance(result, ServiceReport) else result
+                try:
+                    for chunk in items:
+                        if isinstance(chunk, ServiceReport):
+                            pending = coalescer.flush()
+                            if pending:
+                                yield pb2.StreamChunk(chunk_data=pending.encode('utf-8'), is_end=False)
+                            logger.info("流式传输结束", extra={
+                                "status": chunk.status,
+                                "report_len": len(chunk.structured_report),
+                                "deltas": coalescer.deltas,
+                                "messages": coalescer.messages,
+                            })
+                            # 结束标记，附带最终状态；报告正文已逐块发送时不再重复
+                            final_report = _build_report(chunk, "AI分析完成")
+                            if coalescer.deltas:
+                                final_report.structured_report = ""
+                            yield pb2.StreamChunk(
+                                chunk_data="[STREAM_END]".encode('utf-8'),
+                                is_end=True,
+                                report=final_report
+                            )
+                            break
+                        text = coalescer.add(chunk)
+                        if text:
+                            yield pb2.StreamChunk(chunk_data=text.encode('utf-8'), is_end=False)
+                finally:
+                    # 客户端取消后 gRPC 不再迭代，显式关闭生成器以释放 LLM 连接和调度名额
+                    if not isinstance(result, ServiceReport):
+                        result.close()
                         
+        except cancellation.AnalysisAborted as e:
+            _abort_cancelled(context, e)
+        except scheduler.SchedulerRejected as e:
+            _reject_overloaded(context, e)
         except Exception as e:
             # 处理异常
-            error_msg = f"AI服务调用失败: {str(e)}"
-            print(f"错误: {error_msg}")
-            print(f"异常类型: {type(e).__name__}")
-            import traceback
-            print(f"堆栈跟踪:\n{traceback.format_exc()}")
+            logger.exception("AI服务调用失败: %s", e)
             # 截取错误消息的前200个字符，避免消息过长
             short_error_msg = str(e)[:200] + "..." if len(str(e)) > 200 else str(e)
             error_response = pb2.AnalysisReport(
@@ -152,24 +321,98 @@ class MedicalAIService(pb2_grpc.MedicalAIServiceServicer):
                 is_end=True
             )
 
+    def GetServiceStats(self, request, context):
+        """调度、限流、对冲、取消/超时、检查点与去重统计"""
+        return pb2.ServiceStats(stats_json=json.dumps(get_service_stats(), ensure_ascii=False))
+
+    def ReloadKnowledgeBase(self, request, context):
+        """后台重建知识库；wait=true 时等待切换完成（重建耗时较长，调用方应设置足够的截止时间）"""
+        ok, message = reload_knowledge_base(request.reason or "ReloadKnowledgeBase RPC", request.wait)
+        logger.info("知识库重建请求", extra={"ok": ok, "wait": request.wait, "detail": message})
+        status = get_service_stats().get("knowledge_base")
+        return pb2.ReloadKnowledgeBaseResponse(
+            ok=ok, message=message, status_json=json.dumps(status, ensure_ascii=False)
+        )
+
+def _create_server(options=None) -> grpc.Server:
+    # 并发 RPC 数与线程数一致：超出的请求由 gRPC 直接以 RESOURCE_EXHAUSTED 拒绝，不在线程池中无限排队
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=ai_config.GRPC_MAX_WORKERS),
+        maximum_concurrent_rpcs=ai_config.GRPC_MAX_WORKERS,
+        options=options
+    )
+    pb2_grpc.add_MedicalAIServiceServicer_to_server(MedicalAIService(), server)
+    return server
+
+def _serve_worker(index: int, address: str, parent_pid: int) -> None:
+    """多进程模式的工作进程：重新配置日志与追踪，初始化服务后在共享端口上启动 gRPC 服务端"""
+    reinit_after_fork("medimeow-ai", worker=index)
+    tracing.init_tracing("medimeow-ai")
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        # 各工作进程平分 CPU 核，避免 torch 线程数 × 进程数超过核数
+        torch.set_num_threads(max((os.cpu_count() or 1) // ai_config.AI_WORKERS, 1))
+    initialize_service(worker_index=index)
+    server = _create_server(options=[("grpc.so_reuseport", 1)])
+    server.add_insecure_port(address)
+    server.start()
+    logger.info("工作进程的 gRPC 服务端已启动：%s", address)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        # 父进程被强制结束时随之退出
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.stop(0)
+    logger.info("工作进程已停止")
+    shutdown_logging()
+
+def _run_prefork():
+    """多进程模式：父进程预加载共享资源并占住端口，fork 出工作进程并监督"""
+    logger.info("多进程模式：正在预加载共享资源（%d 个工作进程）...", ai_config.AI_WORKERS)
+    try:
+        preload_shared_resources()
+    except Exception:
+        logger.exception("共享资源预加载失败，由各工作进程自行加载")
+    sock, address = prefork.reserve_port(ai_config.GRPC_LISTEN_ADDRESS)
+    parent_pid = os.getpid()
+    supervisor = prefork.WorkerSupervisor(
+        ai_config.AI_WORKERS, lambda index: _serve_worker(index, address, parent_pid)
+    )
+    logger.info("gRPC服务端已启动：%s（%d 个工作进程），等待客户端连接...", address, ai_config.AI_WORKERS)
+    try:
+        supervisor.run()
+    finally:
+        sock.close()
+        logger.info("服务器已停止", extra={"worker_restarts": supervisor.restarts})
+        shutdown_logging()
+
 def run_server():
     # 初始化AI服务（加载模型和向量数据库）
-    print("正在初始化AI服务（加载LLM和RAG索引）...")
+    setup_logging("medimeow-ai")
+    if ai_config.AI_WORKERS > 1:
+        _run_prefork()
+        return
+    logger.info("正在初始化AI服务（加载LLM和RAG索引）...")
+    tracing.init_tracing("medimeow-ai")
     initialize_service()
-    print("AI服务初始化完成")
+    logger.info("AI服务初始化完成")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    pb2_grpc.add_MedicalAIServiceServicer_to_server(MedicalAIService(), server)
-    server.add_insecure_port('127.0.0.1:50051')
+    server = _create_server()
+    server.add_insecure_port(ai_config.GRPC_LISTEN_ADDRESS)
     server.start()
-    print(f"gRPC服务端已启动：本地回环（127.0.0.1:50051），等待客户端连接...")
+    logger.info("gRPC服务端已启动：%s，等待客户端连接...", ai_config.GRPC_LISTEN_ADDRESS)
+    # SIGTERM 与 Ctrl+C 同样正常停止，确保日志队列中剩余的记录写出
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
         while True:
             time.sleep(86400)
     except KeyboardInterrupt:
-        print("收到中断信号，正在停止服务器...")
+        logger.info("收到中断信号，正在停止服务器...")
         server.stop(0)
-        print("服务器已停止")
+        logger.info("服务器已停止")
+        shutdown_logging()
 
 if __name__ == "__main__":
-    run_server()
\ No newline at end of file
+    run_server()
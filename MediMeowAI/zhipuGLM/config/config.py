@@ -11,8 +11,12 @@ load_dotenv(dotenv_path=dotenv_path)
 # API 配置
 # =========================================================
 
-# GLM-4.1V-Thinking-Flash 配置
-GLM_API_BASE = "https://open.bigmodel.cn/api/paas/v4/"
+# GLM-4.1V-Thinking-Flash 配置（可通过环境变量指向本地假服务做离线压测）
+GLM_API_BASE = os.getenv("GLM_API_BASE", "https://open.bigmodel.cn/api/paas/v4/")
+LLM_MODEL_NAME = "glm-4.1v-thinking-flash"
+
+# AI 服务版本（随分析结果返回，便于按版本追踪耗时回归）
+SERVICE_VERSION = "v1.1"
 
 # --- 词嵌入模型配置 ---
 BGE_EMBEDDING_MODEL_NAME = "BAAI/bge-small-zh"
@@ -30,9 +34,265 @@ DOCS_DIRECTORY = os.path.join(_MODULE_DIR, "medical_docs")
 # 向量数据库存储路径
 CHROMA_PERSIST_DIR = os.path.join(_MODULE_DIR, "chroma_db_medical")
 
+# 热更新构建的知识库版本目录；CURRENT 文件记录当前使用的版本（不存在时使用 CHROMA_PERSIST_DIR）
+CHROMA_VERSIONS_DIR = os.getenv("CHROMA_VERSIONS_DIR", CHROMA_PERSIST_DIR + "_versions")
+
+# 各科室分诊问卷（Markdown，文件名即科室名称，与后端 create_departments.py 一致）
+QUESTIONNAIRE_DIRECTORY = os.getenv(
+    "QUESTIONNAIRE_DIRECTORY", os.path.join(os.path.dirname(os.path.dirname(_MODULE_DIR)), "docs", "questionnaire")
+)
+
+# medical_docs 文档编号区间 -> 所属科室（文件名以三位编号开头，如 001_急性感染性疾病.txt）
+DOC_DEPARTMENT_RANGES = [
+    (1, 10, "儿科"),
+    (11, 18, "眼科"),
+    (19, 26, "口腔科"),
+    (27, 34, "呼吸内科"),
+    (35, 42, "心内科"),
+    (43, 50, "血液科"),
+    (51, 61, "神经内科"),
+    (62, 68, "骨科"),
+    (69, 76, "消化内科"),
+    (77, 85, "妇科"),
+    (86, 90, "泌尿外科"),
+    (91, 99, "皮肤科"),
+    (100, 100, "肿瘤科"),
+]
+
 # 默认测试图片路径
 DEFAULT_IMAGE_PATH = os.path.join(_MODULE_DIR, "pic", "tongue_sample.png")
 
 # LLM 参数
 MAX_TOKENS = 2048
 TEMPERATURE = 0.0
+
+# 检索返回的文档块数
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+
+# 检索先限定在所选科室的文档分区内：相关度（0~1）不低于 RAG_PARTITION_MIN_SCORE 的文档块
+# 少于 RAG_PARTITION_MIN_HITS 个时再扩大到全库
+RAG_PARTITION_MIN_SCORE = float(os.getenv("RAG_PARTITION_MIN_SCORE", "0.4"))
+RAG_PARTITION_MIN_HITS = int(os.getenv("RAG_PARTITION_MIN_HITS", "3"))
+
+# 检索模式：fixed 固定取 RAG_TOP_K 个文档块；adaptive 从候选池中按相似度阈值筛选后以 MMR 重排，
+# 块数随查询在 [RAG_ADAPTIVE_MIN_K, RAG_ADAPTIVE_MAX_K] 内变化（需要 Chroma 向量库，其他检索器回退到 fixed）
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "fixed").lower()
+RAG_CANDIDATE_POOL = int(os.getenv("RAG_CANDIDATE_POOL", "20"))
+RAG_ADAPTIVE_MIN_K = int(os.getenv("RAG_ADAPTIVE_MIN_K", "2"))
+RAG_ADAPTIVE_MAX_K = int(os.getenv("RAG_ADAPTIVE_MAX_K", "8"))
+# 候选的余弦相似度不低于 RAG_ADAPTIVE_MIN_SCORE，且不低于最高相似度 × RAG_ADAPTIVE_RELATIVE_SCORE
+RAG_ADAPTIVE_MIN_SCORE = float(os.getenv("RAG_ADAPTIVE_MIN_SCORE", "0.5"))
+RAG_ADAPTIVE_RELATIVE_SCORE = float(os.getenv("RAG_ADAPTIVE_RELATIVE_SCORE", "0.75"))
+# MMR 中相关度的权重（1 只看相关度，0 只看多样性）
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+
+# 阶段3 上下文组装：合并重叠/相邻文档块、去除近似重复后按相关度装入 token 预算（<= 0 不限制）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# 计数使用的 tiktoken 编码；编码文件无法加载时按字符估算
+CONTEXT_TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base")
+# 字符三元组 Jaccard 相似度不低于该值的文档块视为近似重复
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# 旧索引没有 start_index 时，首尾重合不少于该字符数的同源文档块视为重叠
+CONTEXT_MIN_OVERLAP = int(os.getenv("CONTEXT_MIN_OVERLAP", "20"))
+
+# ==========================
+# 链路追踪配置 (OpenTelemetry)
+# ==========================
+
+# 导出方式：file（写入本地 JSON Lines 文件）/ otlp（发送到 OTLP Collector）/ console / none
+# 默认不导出：file 方式持续追加、不轮转也不限制大小，只适合本地短时排查
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+
+# file 导出时的文件路径
+TRACING_FILE = os.getenv("TRACING_FILE", os.path.join(_MODULE_DIR, "traces", "ai-spans.jsonl"))
+
+# otlp 导出时的 Collector 地址
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://127.0.0.1:4317")
+
+# ==========================
+# 日志配置
+# ==========================
+
+# 全局日志级别；LOG_LEVELS 按模块覆盖，如 "utils.scheduler=DEBUG,httpx=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+
+# 日志格式：json（每行一条 JSON）/ text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# 日志文件路径，为空时输出到 stdout
+LOG_FILE = os.getenv("LOG_FILE", "")
+
+# 日志队列容量（队列满时丢弃新记录）与 DEBUG 日志采样比例
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+# ==========================
+# 准入控制与调度配置
+# ==========================
+
+# 各阶段同时进行的 LLM 调用上限
+SCHEDULER_STAGE_CONCURRENCY = {
+    "stage1": int(os.getenv("SCHEDULER_STAGE1_CONCURRENCY", "4")),
+    "keyword": int(os.getenv("SCHEDULER_KEYWORD_CONCURRENCY", "4")),
+    "stage3": int(os.getenv("SCHEDULER_STAGE3_CONCURRENCY", "4")),
+}
+
+# 单个请求在同一阶段并行发起多次调用（多图片的 stage1）时，最多同时占用该阶段并发上限的比例（至少 1 个）
+SCHEDULER_REQUEST_STAGE_SHARE = float(os.getenv("SCHEDULER_REQUEST_STAGE_SHARE", "0.5"))
+
+# 每个阶段的等待队列长度上限（超过即以 RESOURCE_EXHAUSTED 拒绝）
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "16"))
+
+# 批量任务最多占用的队列比例，保证交互式请求始终有排队空间
+SCHEDULER_BATCH_QUEUE_SHARE = float(os.getenv("SCHEDULER_BATCH_QUEUE_SHARE", "0.5"))
+
+# 各优先级在单个阶段的最长排队时间（秒），请求自带的 gRPC 截止时间更早时以其为准
+SCHEDULER_MAX_WAIT_SECONDS = {
+    "interactive": float(os.getenv("SCHEDULER_INTERACTIVE_MAX_WAIT", "20")),
+    "batch": float(os.getenv("SCHEDULER_BATCH_MAX_WAIT", "120")),
+}
+
+# gRPC 服务端监听地址
+GRPC_LISTEN_ADDRESS = os.getenv("AI_GRPC_ADDRESS", "127.0.0.1:50051")
+
+# gRPC 服务端工作线程数（同时也是并发 RPC 上限，超出的请求由 gRPC 直接拒绝）
+GRPC_MAX_WORKERS = int(os.getenv("GRPC_MAX_WORKERS", "64"))
+
+# 单个请求最多分析的图片数（超出部分忽略）
+STAGE1_MAX_IMAGES = int(os.getenv("STAGE1_MAX_IMAGES", "6"))
+
+# 多图片请求中并行生成图片描述的线程数（各调用仍受 stage1 并发名额约束）
+STAGE1_IMAGE_WORKERS = int(os.getenv("STAGE1_IMAGE_WORKERS", str(GRPC_MAX_WORKERS * 2)))
+
+# ==========================
+# 模型服务商自适应限流配置 (AIMD)
+# ==========================
+
+# 同时进行的服务商调用数：初始值 / 下限 / 上限
+PROVIDER_LIMIT_INITIAL = float(os.getenv("PROVIDER_LIMIT_INITIAL", "4"))
+PROVIDER_LIMIT_MIN = float(os.getenv("PROVIDER_LIMIT_MIN", "1"))
+PROVIDER_LIMIT_MAX = float(os.getenv("PROVIDER_LIMIT_MAX", "32"))
+
+# 遇到 429 / 5xx / 延迟突增时并发上限的缩减比例
+PROVIDER_BACKOFF_RATIO = float(os.getenv("PROVIDER_BACKOFF_RATIO", "0.5"))
+
+# 单次调用延迟超过基线（EWMA）的倍数即视为延迟突增
+PROVIDER_LATENCY_SPIKE_FACTOR = float(os.getenv("PROVIDER_LATENCY_SPIKE_FACTOR", "3.0"))
+
+# 429 / 5xx 的最大重试次数
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "3"))
+
+# 等待服务商调用名额的最长时间（秒），超时以 RESOURCE_EXHAUSTED 拒绝
+PROVIDER_ACQUIRE_TIMEOUT = float(os.getenv("PROVIDER_ACQUIRE_TIMEOUT", "30"))
+
+# 响应未携带 Retry-After 时的默认退避时间（秒）
+PROVIDER_DEFAULT_RETRY_AFTER = float(os.getenv("PROVIDER_DEFAULT_RETRY_AFTER", "1.0"))
+
+# ==========================
+# 请求对冲配置 (Hedged Requests)
+# ==========================
+
+# 是否为 temperature=0 的阶段调用启用对冲（TEMPERATURE 非 0 时始终关闭）
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").lower() == "true"
+
+# 主请求超过该阶段近期延迟的该百分位仍未返回时发起对冲
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+
+# 对冲延迟下限，以及样本不足时使用的默认延迟（秒）
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "1.0"))
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "15.0"))
+
+# 对冲请求数占主请求数的比例上限
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+
+# 延迟统计窗口（最近调用次数）及开始按百分位计算前的最少样本数
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# 执行主请求与对冲请求的线程数
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", str(GRPC_MAX_WORKERS * 2)))
+
+# ==========================
+# 截止时间与取消配置
+# ==========================
+
+# 开始下一阶段所需的最少剩余时间（秒），不足时直接放弃，不再发起注定超时的 LLM 调用
+DEADLINE_MIN_STAGE_SECONDS = float(os.getenv("DEADLINE_MIN_STAGE_SECONDS", "1.0"))
+
+# ==========================
+# 阶段检查点配置
+# ==========================
+
+# 是否按 request_id 保存各阶段中间结果，失败重试时从最后完成的阶段继续
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+
+# 检查点数据库路径（SQLite）
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", os.path.join(_MODULE_DIR, "checkpoints", "checkpoints.db"))
+
+# 检查点保留时间（秒）
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+
+# 同步分析时，相同 request_id 的并发请求只执行一次分析流程，其余请求共享结果
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+
+# ==========================
+# 流式输出合并配置
+# ==========================
+
+# 流式 RPC 将 LLM 增量合并后发送：累计字节数达到阈值或超过时间窗口时发送一条消息
+# 两者均设为 0 时每个增量单独发送
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "512"))
+STREAM_COALESCE_WINDOW_MS = float(os.getenv("STREAM_COALESCE_WINDOW_MS", "50"))
+
+# ==========================
+# 科室预分诊配置
+# ==========================
+
+# 调用 LLM 前用 bge 向量比较患者描述与各科室质心，明显不匹配时直接返回 DEPARTMENT_ERROR
+# enforce：拦截明显不匹配的请求；shadow：只记录判断结果并与 LLM 结论比对，不拦截；off：关闭
+# 默认 shadow：阈值需先用 bge 模型校准（GetServiceStats 中的 precision / recall 记录到 benchmarks/README.md）后再改为 enforce
+PRETRIAGE_MODE = os.getenv("PRETRIAGE_MODE", "shadow")
+
+# 判定为明显不匹配的条件：所选科室的相似度排名不在前 PRETRIAGE_MIN_RANK - 1 名，
+# 且最相似科室的相似度比所选科室高出至少 PRETRIAGE_MARGIN
+PRETRIAGE_MIN_RANK = int(os.getenv("PRETRIAGE_MIN_RANK", "4"))
+PRETRIAGE_MARGIN = float(os.getenv("PRETRIAGE_MARGIN", "0.05"))
+
+# ==========================
+# 知识库热更新配置
+# ==========================
+
+# medical_docs 变更检查间隔（秒），检测到变更后在后台重建并切换知识库；0 表示只通过 ReloadKnowledgeBase RPC 触发
+RAG_RELOAD_WATCH_SECONDS = float(os.getenv("RAG_RELOAD_WATCH_SECONDS", "0"))
+
+# 新版本的校验条件：文档块数不少于当前版本的 RAG_RELOAD_MIN_CHUNK_RATIO 倍；
+# 抽取 RAG_RELOAD_PROBES 篇文档，以其开头文字检索，命中原文档的比例不低于 RAG_RELOAD_MIN_PROBE_HIT
+RAG_RELOAD_MIN_CHUNK_RATIO = float(os.getenv("RAG_RELOAD_MIN_CHUNK_RATIO", "0.5"))
+RAG_RELOAD_PROBES = int(os.getenv("RAG_RELOAD_PROBES", "20"))
+RAG_RELOAD_MIN_PROBE_HIT = float(os.getenv("RAG_RELOAD_MIN_PROBE_HIT", "0.8"))
+
+# 保留的历史版本目录数（不含当前版本），旧版本释放后删除更早的目录
+RAG_RELOAD_KEEP_VERSIONS = int(os.getenv("RAG_RELOAD_KEEP_VERSIONS", "1"))
+
+# ==========================
+# 多进程模式配置
+# ==========================
+
+# 工作进程数；大于 1 时父进程预加载 bge 模型与文档块向量文件后 fork 出工作进程，
+# 各工作进程以 SO_REUSEPORT 监听同一 gRPC 端口（仅 Linux）。
+# 调度队列、LLM 并发名额、服务商限流等上限在每个工作进程内独立生效
+AI_WORKERS = int(os.getenv("AI_WORKERS", "1"))
+
+# 工作进程异常退出后的重启等待（秒）；连续快速退出时翻倍，最长 AI_WORKER_RESTART_MAX_BACKOFF_SECONDS
+AI_WORKER_RESTART_BACKOFF_SECONDS = float(os.getenv("AI_WORKER_RESTART_BACKOFF_SECONDS", "1"))
+AI_WORKER_RESTART_MAX_BACKOFF_SECONDS = float(os.getenv("AI_WORKER_RESTART_MAX_BACKOFF_SECONDS", "60"))
+
+# 工作进程运行超过该时长（秒）后退出视为偶发故障，重启等待恢复为初始值
+AI_WORKER_STABLE_SECONDS = float(os.getenv("AI_WORKER_STABLE_SECONDS", "30"))
+
+# 停止服务时等待工作进程退出的时长（秒），超时后强制结束
+AI_WORKER_STOP_TIMEOUT_SECONDS = float(os.getenv("AI_WORKER_STOP_TIMEOUT_SECONDS", "30"))
+
+# 工作进程检查 CURRENT 指针的间隔（秒）：其他工作进程完成知识库热更新后，据此加载同一版本
+AI_WORKER_FOLLOW_SECONDS = float(os.getenv("AI_WORKER_FOLLOW_SECONDS", "5"))
@@ -5,6 +5,7 @@ import os
 sys.path.insert(0, os.path.dirname(__file__))
 
 import os
+import logging
 from typing import List
 from operator import itemgetter
 
@@ -77,6 +78,9 @@ def run_three_stage_rag(patient_text_data: str, image_path: str, vector_store):
     return final_report
 
 if __name__ == "__main__":
+    # 命令行演示直接输出可读日志（gRPC 服务使用 utils.log 的结构化日志）
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     print("\n" + "="*80)
     print("启动医疗 RAG 辅助系统")
     print("="*80)
@@ -17,6 +17,22 @@ STAGE1_PROMPT_TEMPLATE = """
 请严格按照上述格式，仅输出四个段落的内容，不要输出任何解释性文字。
 """
 
+# --- 阶段 1（多图片）: 单张图片的视觉描述，结果合并到 [影像观察] 段落 ---
+STAGE1_IMAGE_PROMPT_TEMPLATE = """
+**角色设定**：你是一个高精度的医疗辅助多模态AI引擎，专注于结构化预处理。患者共上传了 {image_count} 张图片，当前是第 {image_index} 张。
+**患者信息（仅用于理解图像背景）**：
+{text_input}
+**核心约束**：
+1. **纯文本输出**：禁止包含Markdown标题或符号。
+2. **仅描述当前这张图片**。
+3. **禁止诊断或推断**。
+
+**输出格式**：
+[图像主体识别]；[视觉特征精细描述]
+
+请严格按照上述格式，仅输出一行内容，不要输出任何解释性文字。
+"""
+
 # --- 阶段 2: RAG 检索关键词提取 ---
 RAG_RETRIEVAL_PROMPT = """
 基于这份初步的结构化报告，请提炼出最关键的症状、体征（如BMI超重）和影像观察（特别是异常发现）作为检索关键词。
@@ -69,4 +85,8 @@ FINAL_REPORT_PROMPT = """
 
 ### 5. 【医疗建议 (Plan)】
 * **由医生填写**：(留白)
+
+### 6. 【分诊信息 (Triage)】
+* **风险等级**：[低/中/高，三选一]
+* **建议科室**：[最适合就诊的一个科室名称，如 呼吸内科]
 """
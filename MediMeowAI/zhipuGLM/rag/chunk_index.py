@@ -0,0 +1,170 @@
+"""
+自适应检索
+
+固定取 RAG_TOP_K 个文档块时，简单的查询会带上不相关的文档块，症状复杂的查询又可能不够。
+自适应模式（RAG_RETRIEVAL_MODE=adaptive）：
+1. 取相似度最高的 RAG_CANDIDATE_POOL 个候选；
+2. 只保留相似度不低于 RAG_ADAPTIVE_MIN_SCORE、且不低于最高相似度 × RAG_ADAPTIVE_RELATIVE_SCORE 的候选；
+3. 以最大边际相关性（MMR）重排，兼顾相关度与多样性，返回块数限制在 [RAG_ADAPTIVE_MIN_K, RAG_ADAPTIVE_MAX_K]。
+
+文档块向量在加载时从 Chroma 读出一次，归一化后缓存为矩阵，检索时只计算查询向量，
+相似度与 MMR 均为 NumPy 矩阵运算。相似度为余弦相似度（bge 向量已归一化）。
+
+指定 cache_dir（向量库目录）时，归一化后的矩阵另存为 chunk_vectors.npy 并以只读内存映射方式打开：
+多进程模式下各工作进程映射同一文件，共享页缓存中的同一份数据，之后加载也不必再从 Chroma 读出向量。
+"""
+import os
+import json
+import time
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+import config.config as config
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "chunk_vectors.npy"
+# 与矩阵各行对应的文档块 ID，用于判断缓存文件与向量库是否一致
+IDS_FILE = "chunk_vectors.ids.json"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _load_cached_vectors(cache_dir: str, ids: List[str]) -> Optional[np.ndarray]:
+    """读取与 ids 一致的向量缓存（内存映射）；不存在或不一致时返回 None"""
+    try:
+        with open(os.path.join(cache_dir, IDS_FILE), encoding="utf-8") as f:
+            if json.load(f) != ids:
+                return None
+        vectors = np.load(os.path.join(cache_dir, VECTORS_FILE), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    return vectors if vectors.ndim == 2 and vectors.shape[0] == len(ids) else None
+
+
+def _save_vectors(cache_dir: str, ids: List[str], vectors: np.ndarray) -> np.ndarray:
+    """写入向量缓存并返回其内存映射；先写临时文件再替换，多个进程同时写入时读到的总是完整文件"""
+    suffix = f".{os.getpid()}.tmp"
+    vectors_path = os.path.join(cache_dir, VECTORS_FILE)
+    ids_path = os.path.join(cache_dir, IDS_FILE)
+    np.save(vectors_path + suffix + ".npy", vectors)
+    os.replace(vectors_path + suffix + ".npy", vectors_path)
+    with open(ids_path + suffix, "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    os.replace(ids_path + suffix, ids_path)
+    return np.load(vectors_path, mmap_mode="r")
+
+
+def mmr_select(query_scores: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """最大边际相关性：依次选取 lambda × 查询相似度 - (1 - lambda) × 与已选块的最大相似度 最高的候选
+
+    query_scores: (n,) 候选与查询的相似度；vectors: (n, d) 归一化后的候选向量。返回选中候选的下标。
+    """
+    n = len(query_scores)
+    if n == 0 or k <= 0:
+        return []
+    pairwise = vectors @ vectors.T
+    selected = [int(np.argmax(query_scores))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, n):
+        marginal = lambda_mult * query_scores - (1 - lambda_mult) * redundancy
+        marginal[~available] = -np.inf
+        index = int(np.argmax(marginal))
+        selected.append(index)
+        available[index] = False
+        np.maximum(redundancy, pairwise[index], out=redundancy)
+    return selected
+
+
+class ChunkIndex:
+    """缓存全部文档块向量的内存索引
+
+    documents: 文档块（metadata 中含 department）；vectors: (n, d) 对应的向量，normalized=True 时
+    视为已归一化并直接使用（不复制，可以是内存映射）；embeddings: 提供 embed_query 的词嵌入模型（与向量库共用）。
+    """
+
+    def __init__(self, documents: Sequence[Document], vectors, embeddings, normalized: bool = False):
+        self.documents = list(documents)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(self.documents), -1)
+        self._vectors = vectors if normalized else _normalize(vectors)
+        self._embeddings = embeddings
+        self._departments = np.array([doc.metadata.get("department", "") for doc in self.documents])
+
+    @classmethod
+    def from_vector_store(cls, vector_store, cache_dir: Optional[str] = None) -> "ChunkIndex":
+        """从 Chroma 读出全部文档块及其向量（不重新计算向量）；cache_dir 中有一致的向量缓存时直接映射"""
+        start = time.perf_counter()
+        collection = vector_store._collection
+        vectors = None
+        if cache_dir:
+            data = collection.get(include=["documents", "metadatas"])
+            vectors = _load_cached_vectors(cache_dir, data["ids"])
+        if vectors is None:
+            data = collection.get(include=["embeddings", "documents", "metadatas"])
+            vectors = _normalize(np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1))
+            if cache_dir:
+                try:
+                    vectors = _save_vectors(cache_dir, list(data["ids"]), vectors)
+                except OSError:
+                    logger.warning("文档块向量缓存文件写入失败，使用进程内矩阵", exc_info=True)
+        documents = [
+            Document(page_content=text or "", metadata=metadata or {}, id=chunk_id)
+            for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+        index = cls(documents, vectors, vector_store.embeddings, normalized=True)
+        logger.info("文档块向量已缓存", extra={
+            "chunks": len(documents),
+            "dims": index._vectors.shape[1] if len(documents) else 0,
+            "mmap": isinstance(vectors, np.memmap),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+        return index
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def scores(self, query: str) -> np.ndarray:
+        """查询与全部文档块的余弦相似度"""
+        vector = _normalize(np.asarray(self._embeddings.embed_query(query), dtype=np.float32))
+        return self._vectors @ vector
+
+    def _select(self, scores: np.ndarray, mask: Optional[np.ndarray]) -> List[Tuple[Document, float]]:
+        candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(scores))
+        if len(candidates) == 0:
+            return []
+        pool = candidates[np.argsort(-scores[candidates])[:config.RAG_CANDIDATE_POOL]]
+        pool_scores = scores[pool]
+        cutoff = max(config.RAG_ADAPTIVE_MIN_SCORE, float(pool_scores[0]) * config.RAG_ADAPTIVE_RELATIVE_SCORE)
+        passing = int(np.count_nonzero(pool_scores >= cutoff))
+        # 候选按相似度降序排列，通过阈值的恰好是前 passing 个；不足 MIN_K 时按相似度补足
+        k = min(max(passing, config.RAG_ADAPTIVE_MIN_K), config.RAG_ADAPTIVE_MAX_K, len(pool))
+        keep = pool[:max(passing, k)]
+        order = mmr_select(scores[keep], self._vectors[keep], k, config.RAG_MMR_LAMBDA)
+        return [(self.documents[keep[i]], float(scores[keep[i]])) for i in order]
+
+    def search(self, query: str, department: str = "") -> Tuple[List[Tuple[Document, float]], str, bool]:
+        """自适应检索，分区逻辑与 rag_core.search_partitioned 一致
+
+        所选科室分区内相似度不低于 RAG_ADAPTIVE_MIN_SCORE 的文档块少于 RAG_PARTITION_MIN_HITS 个时，
+        在全库候选中重新选择。
+
+        Returns:
+            ([(文档块, 余弦相似度)], 检索的分区（全库为空字符串）, 是否扩大到全库)
+        """
+        scores = self.scores(query)
+        mask = self._departments == department if department else None
+        if mask is None or not mask.any():
+            return self._select(scores, None), "", False
+
+        strong = int(np.count_nonzero(scores[mask] >= config.RAG_ADAPTIVE_MIN_SCORE))
+        if strong >= min(config.RAG_PARTITION_MIN_HITS, int(np.count_nonzero(mask))):
+            return self._select(scores, mask), department, False
+        return self._select(scores, None), department, True
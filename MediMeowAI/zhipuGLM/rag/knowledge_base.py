@@ -0,0 +1,317 @@
+"""
+知识库热更新
+
+原先更新 medical_docs 后只能重启 AI 服务：重新加载词嵌入模型和 Chroma，进行中的请求全部中断。
+热更新流程：
+1. 在后台线程中把新版本构建到 CHROMA_VERSIONS_DIR 下的独立目录（沿用已加载的词嵌入模型）；
+2. 校验新版本（文档块数、抽样检索命中率），不通过时丢弃，继续使用当前版本；
+3. 在锁内原子切换当前版本并更新 CURRENT 指针，新请求立即使用新版本；
+4. 旧版本等进行中的检索（lease）全部结束后释放，并删除多余的历史版本目录。
+
+触发方式：ReloadKnowledgeBase RPC，或 RAG_RELOAD_WATCH_SECONDS > 0 时定期检查文档指纹。
+多进程模式下只有收到请求（或检查文档指纹）的工作进程重建，其余工作进程定期读取 CURRENT 指针，
+加载已通过校验的同一版本（follow）。
+"""
+import gc
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import config.config as config
+import rag.rag_core as rag_core
+
+logger = logging.getLogger(__name__)
+
+
+class IndexVerificationError(Exception):
+    """新版本未通过校验"""
+
+
+class IndexVersion:
+    """一个知识库版本：向量库及依赖文档内容的派生数据（文档块向量缓存、科室质心）"""
+
+    def __init__(self, version: str, vector_store, persist_dir: str, fingerprint: Optional[str],
+                 chunk_index=None, pretriage=None):
+        self.version = version
+        self.vector_store = vector_store
+        self.persist_dir = persist_dir
+        self.fingerprint = fingerprint
+        self.chunk_index = chunk_index
+        self.pretriage = pretriage
+        self.chunks = _count_chunks(vector_store)
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+        self._leases = 0
+        self._retired = False
+        self.released = False
+
+    def acquire(self) -> None:
+        with self._lock:
+            self._leases += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self._leases -= 1
+            done = self._retired and self._leases == 0
+        if done:
+            self._release_resources()
+
+    def retire(self) -> None:
+        """不再分配给新请求；没有进行中的检索时立即释放"""
+        with self._lock:
+            self._retired = True
+            done = self._leases == 0
+        if done:
+            self._release_resources()
+
+    @property
+    def leases(self) -> int:
+        with self._lock:
+            return self._leases
+
+    def _release_resources(self) -> None:
+        with self._lock:
+            if self.released:
+                return
+            self.released = True
+        close_vector_store(self.vector_store)
+        self.vector_store = None
+        self.chunk_index = None
+        self.pretriage = None
+        gc.collect()
+        logger.info("旧知识库版本已释放", extra={"version": self.version})
+
+    def info(self) -> Dict[str, object]:
+        return {
+            "version": self.version,
+            "persist_dir": self.persist_dir,
+            "chunks": self.chunks,
+            "fingerprint": (self.fingerprint or "")[:12],
+            "created_at": round(self.created_at, 3),
+            "leases": self.leases,
+        }
+
+
+def _count_chunks(vector_store) -> int:
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        return collection.count()
+    # 其他检索器（如压测用的内存检索）需实现 __len__
+    return len(vector_store) if hasattr(vector_store, "__len__") else 0
+
+
+def close_vector_store(vector_store) -> None:
+    """释放 Chroma 客户端：chromadb 按目录缓存客户端系统，仅丢弃引用不会释放 SQLite 连接与 HNSW 索引"""
+    client = getattr(vector_store, "_client", None)
+    if client is None:
+        return
+    try:
+        from chromadb.api.client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+        if system is not None:
+            system.stop()
+    except Exception:
+        logger.warning("关闭旧版本 Chroma 客户端失败", exc_info=True)
+
+
+def verify_version(candidate: IndexVersion, current: Optional[IndexVersion]) -> List[str]:
+    """返回新版本未通过的校验项；为空表示通过"""
+    problems = []
+    if candidate.vector_store is None or candidate.chunks == 0:
+        return ["新版本没有文档块"]
+    if current is not None and current.chunks and candidate.chunks < current.chunks * config.RAG_RELOAD_MIN_CHUNK_RATIO:
+        problems.append(f"文档块数 {candidate.chunks} 少于当前版本 {current.chunks} 的 {config.RAG_RELOAD_MIN_CHUNK_RATIO:.0%}")
+
+    # 抽样检索：以文档开头文字检索，结果中应包含该文档
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(config.DOCS_DIRECTORY) for name in names if name.endswith(".txt")
+    )
+    step = max(len(paths) // max(config.RAG_RELOAD_PROBES, 1), 1)
+    probes = paths[::step][:config.RAG_RELOAD_PROBES]
+    hits = 0
+    for path in probes:
+        with open(path, encoding="utf-8") as f:
+            query = f.read(200).strip()[:60]
+        results = candidate.vector_store.similarity_search_with_relevance_scores(query, k=config.RAG_TOP_K)
+        sources = {os.path.abspath(doc.metadata.get("source", "")) for doc, _ in results}
+        hits += os.path.abspath(path) in sources
+    if probes and hits / len(probes) < config.RAG_RELOAD_MIN_PROBE_HIT:
+        problems.append(f"抽样检索命中率 {hits}/{len(probes)} 低于 {config.RAG_RELOAD_MIN_PROBE_HIT:.0%}")
+    return problems
+
+
+class KnowledgeBase:
+    """当前知识库版本的持有者，负责后台重建、校验与原子切换
+
+    builder(persist_dir, fingerprint) 构建一个新版本；on_swap(version) 在切换后调用（更新服务的全局引用）。
+    """
+
+    def __init__(self, initial: IndexVersion, builder: Callable[[str, str], IndexVersion],
+                 on_swap: Optional[Callable[[IndexVersion], None]] = None,
+                 loader: Optional[Callable[[str, Optional[str]], IndexVersion]] = None):
+        self._current = initial
+        self._builder = builder
+        self._on_swap = on_swap
+        # loader(persist_dir, fingerprint) 加载其他进程已构建的版本；为空时不跟随 CURRENT 指针
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._building = False
+        # 校验失败的文档指纹，文档再次变更前不重复重建
+        self._rejected_fingerprint: Optional[str] = None
+        # 加载失败的 CURRENT 指针目标，指针再次变更前不重复加载
+        self._rejected_pointer: Optional[str] = None
+        self._retired: List[IndexVersion] = []
+        self._stats: Dict[str, object] = {
+            "reloads": 0, "failed": 0, "followed": 0, "last_reason": None, "last_error": None, "last_build_ms": None,
+        }
+        self._watch_stop = threading.Event()
+
+    @property
+    def current(self) -> IndexVersion:
+        return self._current
+
+    @contextmanager
+    def lease(self) -> Iterator[IndexVersion]:
+        """取得当前版本并在使用期间阻止其释放；切换发生后，持有旧版本的检索照常完成"""
+        with self._lock:
+            version = self._current
+            version.acquire()
+        try:
+            yield version
+        finally:
+            version.release()
+
+    def reload(self, reason: str, wait: bool = False) -> Tuple[bool, str]:
+        """在后台重建知识库；已有重建任务时不重复触发。wait=True 时等待重建结束"""
+        with self._lock:
+            if self._building:
+                return False, "已有重建任务在进行"
+            self._building = True
+        thread = threading.Thread(target=self._reload, args=(reason,), name="knowledge-reload", daemon=True)
+        thread.start()
+        if not wait:
+            return True, "已开始重建"
+        thread.join()
+        with self._lock:
+            error = self._stats["last_error"]
+        return error is None, error or f"已切换到版本 {self._current.version}"
+
+    def _reload(self, reason: str) -> None:
+        start = time.perf_counter()
+        candidate: Optional[IndexVersion] = None
+        fingerprint = None
+        try:
+            fingerprint = rag_core.docs_fingerprint(config.DOCS_DIRECTORY)
+            now = time.time()
+            # 同一秒内可能重建多次（文档未变时指纹相同），版本号精确到毫秒以免写入已有目录
+            version = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}-{fingerprint[:8]}"
+            persist_dir = os.path.join(config.CHROMA_VERSIONS_DIR, version)
+            logger.info("开始重建知识库", extra={"reason": reason, "version": version})
+            candidate = self._builder(persist_dir, fingerprint)
+            problems = verify_version(candidate, self._current)
+            if problems:
+                raise IndexVerificationError("；".join(problems))
+            self._swap(candidate)
+            rag_core.write_active_index(persist_dir, fingerprint)
+            elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+            with self._lock:
+                self._stats.update(reloads=self._stats["reloads"] + 1, last_reason=reason, last_error=None,
+                                   last_build_ms=elapsed_ms)
+            logger.info("知识库已切换", extra={"version": version, "chunks": candidate.chunks, "elapsed_ms": elapsed_ms})
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            with self._lock:
+                self._stats.update(failed=self._stats["failed"] + 1, last_reason=reason, last_error=error)
+                self._rejected_fingerprint = fingerprint
+            logger.exception("知识库重建失败，继续使用版本 %s", self._current.version)
+            if candidate is not None and candidate is not self._current:
+                candidate.retire()
+        finally:
+            with self._lock:
+                self._building = False
+            self._prune()
+
+    def follow(self) -> bool:
+        """CURRENT 指针指向其他进程构建并校验过的版本时加载并切换（不重建、不再校验），返回是否切换"""
+        if self._loader is None:
+            return False
+        persist_dir, fingerprint = rag_core.read_active_index()
+        with self._lock:
+            if (self._building or persist_dir == self._current.persist_dir
+                    or persist_dir == self._rejected_pointer or not os.path.isdir(persist_dir)):
+                return False
+            self._building = True
+        try:
+            candidate = self._loader(persist_dir, fingerprint)
+            self._swap(candidate)
+            with self._lock:
+                self._stats["followed"] += 1
+            logger.info("已加载其他工作进程构建的知识库版本", extra={"version": candidate.version, "chunks": candidate.chunks})
+            return True
+        except Exception:
+            with self._lock:
+                self._rejected_pointer = persist_dir
+            logger.exception("加载知识库版本 %s 失败，继续使用版本 %s", persist_dir, self._current.version)
+            return False
+        finally:
+            with self._lock:
+                self._building = False
+
+    def _swap(self, candidate: IndexVersion) -> None:
+        with self._lock:
+            old, self._current = self._current, candidate
+            self._retired.append(old)
+        if self._on_swap is not None:
+            self._on_swap(candidate)
+        old.retire()
+
+    def _prune(self) -> None:
+        """删除已释放版本之外、超出保留数量的历史版本目录"""
+        with self._lock:
+            self._retired = [version for version in self._retired if not version.released]
+            in_use = {self._current.persist_dir, *(version.persist_dir for version in self._retired)}
+        removed = rag_core.prune_index_versions(config.RAG_RELOAD_KEEP_VERSIONS, in_use)
+        if removed:
+            logger.info("已删除 %d 个历史知识库版本目录", len(removed))
+
+    def start_watch(self, interval: float, rebuild: bool = True) -> None:
+        """定期检查：设置了 loader 时跟随 CURRENT 指针；rebuild=True 时比较文档指纹，
+        连续两次检查结果一致（文件已写完）且与当前版本不同时触发重建"""
+        def _watch():
+            previous = None
+            while not self._watch_stop.wait(interval):
+                self.follow()
+                if not rebuild:
+                    self._prune()
+                    continue
+                try:
+                    fingerprint = rag_core.docs_fingerprint(config.DOCS_DIRECTORY)
+                except OSError:
+                    logger.warning("读取文档目录失败", exc_info=True)
+                    continue
+                if (fingerprint == previous and fingerprint != self._current.fingerprint
+                        and fingerprint != self._rejected_fingerprint):
+                    self.reload("文档变更")
+                previous = fingerprint
+                self._prune()
+
+        threading.Thread(target=_watch, name="knowledge-watch", daemon=True).start()
+        logger.info("已启动知识库版本检查", extra={
+            "interval_s": interval, "rebuild": rebuild, "follow": self._loader is not None,
+        })
+
+    def stop_watch(self) -> None:
+        self._watch_stop.set()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["building"] = self._building
+            retired = [version.info() for version in self._retired if not version.released]
+        stats["current"] = self._current.info()
+        stats["retired"] = retired
+        return stats
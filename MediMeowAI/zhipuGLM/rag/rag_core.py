@@ -1,26 +1,119 @@
 import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import logging
+from typing import Dict, List, Optional, Set, Tuple
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 import config.config as config
 import utils.utils as utils
 
-def build_or_load_rag_index():
-    """加载或从文档构建向量数据库"""
-    bge_embeddings = utils.get_bge_embedding_model()
-    
-    # 1. 尝试加载现有数据库
-    if os.path.exists(config.CHROMA_PERSIST_DIR):
-        print("--- 正在加载现有 Chroma 数据库... ---")
-        return Chroma(persist_directory=config.CHROMA_PERSIST_DIR, embedding_function=bge_embeddings)
+logger = logging.getLogger(__name__)
+
+def doc_department(path: str) -> Optional[str]:
+    """按文件名的三位编号查找文档所属科室；编号不在 DOC_DEPARTMENT_RANGES 内时返回 None"""
+    prefix = os.path.basename(path).split("_", 1)[0]
+    if not prefix.isdigit():
+        return None
+    number = int(prefix)
+    for first, last, department in config.DOC_DEPARTMENT_RANGES:
+        if first <= number <= last:
+            return department
+    return None
+
+def chunk_metadata(source: str) -> Dict[str, object]:
+    """文档块的科室与病种元数据（Chroma 的元数据值不能为 None，未知时为空字符串 / 0）
+
+    文件名形如 "001_急性感染性疾病.txt"：编号决定所属科室，其余部分为病种名称。
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    prefix, _, condition = stem.partition("_")
+    return {
+        "department": doc_department(source) or "",
+        "condition": condition or stem,
+        "doc_id": int(prefix) if prefix.isdigit() else 0,
+    }
+
+def _backfill_metadata(vectorstore: Chroma) -> None:
+    """为旧版本构建、缺少科室元数据的文档块补写元数据（只更新元数据，不重新计算向量）"""
+    collection = vectorstore._collection
+    existing = collection.get(include=["metadatas"])
+    ids, metadatas = [], []
+    for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+        metadata = metadata or {}
+        if "department" not in metadata:
+            ids.append(chunk_id)
+            metadatas.append({**metadata, **chunk_metadata(metadata.get("source", ""))})
+    if ids:
+        collection.update(ids=ids, metadatas=metadatas)
+        logger.info("已为 %d 个文档块补写科室元数据", len(ids))
+
+def docs_fingerprint(docs_dir: str) -> str:
+    """medical_docs 中全部 TXT 文件的路径、大小与修改时间的摘要，用于判断文档是否变更"""
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(docs_dir, "**", "*.txt"), recursive=True)):
+        stat = os.stat(path)
+        digest.update(f"{os.path.relpath(path, docs_dir)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def _pointer_path() -> str:
+    return os.path.join(config.CHROMA_VERSIONS_DIR, "CURRENT")
+
+def read_active_index() -> Tuple[str, Optional[str]]:
+    """当前使用的知识库目录及构建时的文档指纹；未热更新过时为 (CHROMA_PERSIST_DIR, None)"""
+    try:
+        with open(_pointer_path(), encoding="utf-8") as f:
+            pointer = json.load(f)
+        if os.path.isdir(pointer["path"]):
+            return pointer["path"], pointer.get("fingerprint")
+        logger.warning("知识库版本目录 %s 不存在，使用 %s", pointer["path"], config.CHROMA_PERSIST_DIR)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("知识库版本指针读取失败，使用 %s: %s", config.CHROMA_PERSIST_DIR, e)
+    return config.CHROMA_PERSIST_DIR, None
+
+def write_active_index(path: str, fingerprint: str) -> None:
+    """原子地更新版本指针（先写临时文件再替换），重启后加载该版本"""
+    os.makedirs(config.CHROMA_VERSIONS_DIR, exist_ok=True)
+    tmp_path = _pointer_path() + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"path": path, "fingerprint": fingerprint, "updated_at": time.time()}, f)
+    os.replace(tmp_path, _pointer_path())
+
+def prune_index_versions(keep: int, in_use: Set[str]) -> List[str]:
+    """删除 CHROMA_VERSIONS_DIR 中较早的版本目录，保留最近 keep 个以及仍在使用的目录"""
+    if not os.path.isdir(config.CHROMA_VERSIONS_DIR):
+        return []
+    versions = sorted(
+        (entry.path for entry in os.scandir(config.CHROMA_VERSIONS_DIR) if entry.is_dir()),
+        key=os.path.getmtime, reverse=True
+    )
+    removed = []
+    for path in [p for p in versions if p not in in_use][keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+    return removed
 
-    # 2. 检查文档目录
+def load_rag_index(persist_dir: str, embeddings=None) -> Chroma:
+    """加载 persist_dir 中已构建的向量数据库；embeddings 为空时加载 bge 模型"""
+    vectorstore = Chroma(persist_directory=persist_dir, embedding_function=embeddings or utils.get_bge_embedding_model())
+    _backfill_metadata(vectorstore)
+    return vectorstore
+
+def build_rag_index(persist_dir: str, embeddings=None) -> Optional[Chroma]:
+    """从 medical_docs 构建向量数据库到 persist_dir；文档目录不存在时返回 None。embeddings 为空时加载 bge 模型"""
+    # 检查文档目录
     if not os.path.exists(config.DOCS_DIRECTORY):
-        print(f"--- 错误：请创建 {config.DOCS_DIRECTORY} 文件夹，并放入您的医疗TXT文件 ---")
+        logger.error("请创建 %s 文件夹，并放入您的医疗TXT文件", config.DOCS_DIRECTORY)
         return None
     
-    # 3. 构建新数据库
-    print("--- 正在加载文档并构建向量数据库... ---")
+    # 构建新数据库
+    logger.info("正在加载文档并构建向量数据库...")
     loader = DirectoryLoader(
         config.DOCS_DIRECTORY, 
         glob="**/*.txt", 
@@ -30,14 +123,56 @@ def build_or_load_rag_index():
     documents = loader.load()
     
     # 分块
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    # start_index 记录文档块在原文中的位置，供上下文组装合并重叠的文档块
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000, chunk_overlap=200, length_function=len, add_start_index=True
+    )
     chunks = text_splitter.split_documents(documents)
+    for chunk in chunks:
+        chunk.metadata.update(chunk_metadata(chunk.metadata.get("source", "")))
     
     # 存入 Chroma
     vectorstore = Chroma.from_documents(
         documents=chunks, 
-        embedding=bge_embeddings, 
-        persist_directory=config.CHROMA_PERSIST_DIR
+        embedding=embeddings or utils.get_bge_embedding_model(), 
+        persist_directory=persist_dir
     )
-    print(f"--- 数据库构建完成！文档块数量: {len(chunks)} ---")
+    logger.info("数据库构建完成！文档块数量: %d", len(chunks))
     return vectorstore
+
+def build_or_load_rag_index():
+    """加载或从文档构建向量数据库（热更新过时加载 CURRENT 指向的版本）"""
+    bge_embeddings = utils.get_bge_embedding_model()
+    persist_dir, _ = read_active_index()
+    
+    if os.path.exists(persist_dir):
+        logger.info("正在加载现有 Chroma 数据库: %s", persist_dir)
+        return load_rag_index(persist_dir, bge_embeddings)
+    return build_rag_index(persist_dir, bge_embeddings)
+
+def search_partitioned(vector_store, query: str, department: str, k: int) -> Tuple[List[Tuple[object, float]], str, bool]:
+    """先在所选科室的分区内检索，命中不足时扩大到全库
+
+    分区内相关度不低于 RAG_PARTITION_MIN_SCORE 的文档块少于 RAG_PARTITION_MIN_HITS 个时，
+    再检索全库并与分区结果合并，按相关度取前 k 个。科室没有对应文档时直接检索全库。
+
+    Returns:
+        ([(文档块, 相关度)], 检索的分区（全库为空字符串）, 是否扩大到全库)
+    """
+    partitions = {name for _, _, name in config.DOC_DEPARTMENT_RANGES}
+    if department not in partitions:
+        return vector_store.similarity_search_with_relevance_scores(query, k=k), "", False
+
+    results = vector_store.similarity_search_with_relevance_scores(query, k=k, filter={"department": department})
+    strong = sum(1 for _, score in results if score >= config.RAG_PARTITION_MIN_SCORE)
+    if strong >= min(config.RAG_PARTITION_MIN_HITS, k):
+        return results, department, False
+
+    merged = {}
+    for doc, score in results + vector_store.similarity_search_with_relevance_scores(query, k=k):
+        key = (doc.metadata.get("source"), doc.page_content)
+        if key not in merged or score > merged[key][1]:
+            merged[key] = (doc, score)
+    ranked = sorted(merged.values(), key=lambda item: item[1], reverse=True)[:k]
+    return ranked, department, True
+
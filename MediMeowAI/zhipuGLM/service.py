@@ -6,7 +6,13 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 import os
 import json
-from typing import List, Generator, Union, Optional
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Generator, Union, Optional, Tuple
 from operator import itemgetter
 
 from zhipuai import ZhipuAI
@@ -19,27 +25,75 @@ from langchain_community.vectorstores import Chroma
 import config.config as config
 import prompts.prompts as prompts
 import utils.utils as utils
+import utils.tracing as tracing
+import utils.scheduler as scheduler
+import utils.provider_limiter as provider_limiter
+import utils.hedging as hedging
+import utils.cancellation as cancellation
+import utils.checkpoint as checkpoint
+import utils.singleflight as singleflight
+import utils.report_parser as report_parser
+import utils.pretriage as pretriage
+import utils.context_assembler as context_assembler
 import rag.rag_core as rag_core
+import rag.chunk_index as chunk_index
+import rag.knowledge_base as knowledge_base
+
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------
 # 1. Protobuf 消息结构模拟
 # -----------------------------------------------------------------
 
 class AnalysisRequest:
-    """模拟 Protobuf 输入消息结构。"""
-    def __init__(self, patient_text_data: str, image_base64: str, stream: bool = False):
+    """模拟 Protobuf 输入消息结构。
+
+    received_at: 服务端收到请求的时刻（time.perf_counter），用于计算排队等待耗时。
+    priority: 调度优先级（scheduler.PRIORITY_INTERACTIVE / PRIORITY_BATCH）。
+    deadline: 请求截止时间（time.monotonic 时间戳），排队等待不会超过该时间。
+    cancel_token: 取消凭证（RPC 层在客户端取消或超时时置位）；为 None 时按 deadline 新建。
+    request_id: 后端提供的请求ID；非空时保存各阶段检查点，同一ID的重试从已完成阶段继续。
+    images_base64: 多张图片（Base64 或 data URL）；非空时忽略 image_base64。
+    patient_department: 患者选择的科室；为空时从患者文本的 "就诊科室" 行读取（用于预分诊）。
+    """
+    def __init__(self, patient_text_data: str, image_base64: str, stream: bool = False,
+                 received_at: Optional[float] = None, priority: int = scheduler.PRIORITY_INTERACTIVE,
+                 deadline: Optional[float] = None, cancel_token: Optional[cancellation.CancelToken] = None,
+                 request_id: str = "", images_base64: Optional[List[str]] = None,
+                 patient_department: str = ""):
         self.patient_text_data = patient_text_data
         self.image_base64 = image_base64
+        self.images = [image for image in images_base64 if image] if images_base64 else \
+            ([image_base64] if image_base64 else [])
         self.stream = stream
+        self.received_at = received_at
+        self.priority = priority
+        self.deadline = deadline
+        self.cancel_token = cancel_token
+        self.request_id = request_id
+        self.patient_department = patient_department
 
 class AnalysisReport:
-    """模拟 Protobuf 输出消息结构"""
-    def __init__(self, structured_report: str, status: str = "SUCCESS"):
+    """模拟 Protobuf 输出消息结构
+
+    timings: 各阶段耗时（毫秒），键与 proto 中 StageTimings 字段一致；从检查点恢复的阶段不计时。
+    resumed_stages: 本次从检查点恢复、未重新调用 LLM 的阶段。
+    shared: 结果是否来自同一 request_id 的进行中分析（本请求未单独执行流程）。
+    key_info: 从报告中提取的关键信息（字段与 proto 中 KeyInfo 一致），SUCCESS 时提取；
+        预分诊判定科室不匹配时只包含 suggested_department。
+    """
+    def __init__(self, structured_report: str, status: str = "SUCCESS", timings: Optional[Dict[str, float]] = None,
+                 resumed_stages: Optional[List[str]] = None, shared: bool = False,
+                 key_info: Optional[Dict[str, str]] = None):
         self.structured_report = structured_report
         self.status = status
+        self.timings = timings or {}
+        self.resumed_stages = resumed_stages or []
+        self.shared = shared
+        self.key_info = key_info or {}
 
-# 流式传输的输出类型
-StreamReport = Generator[str, None, None]
+# 流式传输的输出类型：依次产出报告文本增量，最后产出一个 AnalysisReport（最终状态与耗时，structured_report 为完整报告）
+StreamReport = Generator[Union[str, AnalysisReport], None, None]
 
 # -----------------------------------------------------------------
 # 2. 全局依赖 
@@ -47,80 +101,455 @@ StreamReport = Generator[str, None, None]
 GLOBAL_VECTOR_STORE: Optional[Chroma] = None
 GLOBAL_LLM = None
 GLOBAL_ZHIPU_CLIENT: Optional[ZhipuAI] = None
+GLOBAL_SCHEDULER: Optional[scheduler.AdmissionScheduler] = None
+GLOBAL_PROVIDER_LIMITER: Optional[provider_limiter.AdaptiveLimiter] = None
+GLOBAL_HEDGER: Optional[hedging.Hedger] = None
+GLOBAL_CHECKPOINTS: Optional[checkpoint.CheckpointStore] = None
+GLOBAL_SINGLEFLIGHT: Optional[singleflight.SingleFlight] = None
+GLOBAL_IMAGE_EXECUTOR: Optional[ThreadPoolExecutor] = None
+GLOBAL_PRETRIAGE: Optional[pretriage.DepartmentPreTriage] = None
+# 知识库当前版本（向量库、文档块向量缓存、科室质心），热更新时整体切换；
+# GLOBAL_VECTOR_STORE / GLOBAL_PRETRIAGE 随切换更新，指向当前版本的对象
+GLOBAL_KNOWLEDGE: Optional[knowledge_base.KnowledgeBase] = None
+# 多进程模式下的工作进程编号（单进程模式为 None）
+GLOBAL_WORKER_INDEX: Optional[int] = None
+
+def preload_shared_resources() -> None:
+    """
+    多进程模式：在父进程中加载各工作进程共用的只读资源，fork 后以写时复制方式共享。
+    包括 bge 词嵌入模型、tiktoken 编码，以及自适应检索模式下当前版本的文档块向量文件
+    （写入向量库目录，工作进程以内存映射方式打开）。
+    不保留 Chroma 客户端、不启动后台线程：SQLite 连接与线程都不能跨 fork 使用。
+    """
+    embeddings = utils.get_bge_embedding_model()
+    context_assembler.preload()
+    if config.RAG_RETRIEVAL_MODE != "adaptive":
+        return
+    persist_dir, _ = rag_core.read_active_index()
+    if not os.path.exists(persist_dir):
+        return
+    vector_store = rag_core.load_rag_index(persist_dir, embeddings)
+    try:
+        chunk_index.ChunkIndex.from_vector_store(vector_store, cache_dir=persist_dir)
+    finally:
+        knowledge_base.close_vector_store(vector_store)
 
-def initialize_service():
+def initialize_service(worker_index: Optional[int] = None):
     """
     服务初始化函数：加载 LLM 实例、向量数据库和智谱客户端。
     此函数必须在服务（如 FastAPI 应用）启动时运行一次。
+    多进程模式下由每个工作进程调用，worker_index 为工作进程编号。
     """
     global GLOBAL_VECTOR_STORE
     global GLOBAL_LLM
     global GLOBAL_ZHIPU_CLIENT
+    global GLOBAL_SCHEDULER
+    global GLOBAL_PROVIDER_LIMITER
+    global GLOBAL_HEDGER
+    global GLOBAL_CHECKPOINTS
+    global GLOBAL_SINGLEFLIGHT
+    global GLOBAL_IMAGE_EXECUTOR
+    global GLOBAL_PRETRIAGE
+    global GLOBAL_KNOWLEDGE
+    global GLOBAL_WORKER_INDEX
     
+    GLOBAL_WORKER_INDEX = worker_index
     try:
         GLOBAL_VECTOR_STORE = rag_core.build_or_load_rag_index()
+        persist_dir, fingerprint = rag_core.read_active_index()
         GLOBAL_LLM = utils.get_glm4_llm()
-        GLOBAL_ZHIPU_CLIENT = ZhipuAI(api_key=os.environ["GLM_API_KEY"])
+        GLOBAL_ZHIPU_CLIENT = ZhipuAI(api_key=os.environ["GLM_API_KEY"], base_url=config.GLM_API_BASE, max_retries=0)
+        GLOBAL_SCHEDULER = scheduler.AdmissionScheduler.from_config()
+        GLOBAL_PROVIDER_LIMITER = provider_limiter.AdaptiveLimiter.from_config()
+        if config.HEDGING_ENABLED and config.TEMPERATURE == 0:
+            GLOBAL_HEDGER = hedging.Hedger.from_config()
+        if config.CHECKPOINT_ENABLED:
+            GLOBAL_CHECKPOINTS = checkpoint.CheckpointStore.from_config()
+            purged = GLOBAL_CHECKPOINTS.purge_expired()
+            if purged:
+                logger.info("已清理 %d 条过期检查点", purged)
+        if config.SINGLEFLIGHT_ENABLED:
+            GLOBAL_SINGLEFLIGHT = singleflight.SingleFlight()
+        GLOBAL_IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=config.STAGE1_IMAGE_WORKERS, thread_name_prefix="stage1-image")
+        GLOBAL_PRETRIAGE = _init_pretriage(GLOBAL_VECTOR_STORE)
+        # 未记录构建时的文档指纹（热更新之前构建的索引）时，视为与当前文档一致
+        initial = knowledge_base.IndexVersion(
+            "initial", GLOBAL_VECTOR_STORE, persist_dir,
+            fingerprint or rag_core.docs_fingerprint(config.DOCS_DIRECTORY),
+            chunk_index=_init_chunk_index(GLOBAL_VECTOR_STORE, persist_dir), pretriage=GLOBAL_PRETRIAGE
+        )
+        if worker_index is None:
+            GLOBAL_KNOWLEDGE = knowledge_base.KnowledgeBase(initial, _build_index_version, _on_index_swap)
+            if config.RAG_RELOAD_WATCH_SECONDS > 0:
+                GLOBAL_KNOWLEDGE.start_watch(config.RAG_RELOAD_WATCH_SECONDS)
+        else:
+            # 多进程模式：各工作进程跟随 CURRENT 指针加载其他进程重建的版本，文档变更检查只在 0 号工作进程中进行
+            GLOBAL_KNOWLEDGE = knowledge_base.KnowledgeBase(
+                initial, _build_index_version, _on_index_swap, loader=_load_index_version
+            )
+            GLOBAL_KNOWLEDGE.start_watch(
+                config.AI_WORKER_FOLLOW_SECONDS, rebuild=worker_index == 0 and config.RAG_RELOAD_WATCH_SECONDS > 0
+            )
+        # 启动时加载 tiktoken 编码，避免首个请求承担下载 / 加载耗时
+        context_assembler.preload()
     except Exception as e:
-        print(f"服务初始化失败: {e}")
+        logger.exception("服务初始化失败: %s", e)
         GLOBAL_VECTOR_STORE = None
+        GLOBAL_KNOWLEDGE = None
         GLOBAL_LLM = None
         GLOBAL_ZHIPU_CLIENT = None
         
-def _stage1_generate_description(llm, patient_text_data: str, image_base64: str) -> str:
-    messages_stage1 = [
+def _init_pretriage(vector_store) -> Optional[pretriage.DepartmentPreTriage]:
+    """与向量库共用 bge 模型构建科室质心；关闭或构建失败时不做预分诊，全部请求交由 LLM 判断"""
+    embeddings = getattr(vector_store, "embeddings", None)
+    if config.PRETRIAGE_MODE == "off" or embeddings is None:
+        logger.info("科室预分诊未启用", extra={"mode": config.PRETRIAGE_MODE})
+        return None
+    try:
+        return pretriage.DepartmentPreTriage.from_config(embeddings)
+    except Exception:
+        logger.exception("科室预分诊初始化失败，跳过预分诊")
+        return None
+
+def _init_chunk_index(vector_store, persist_dir: Optional[str] = None) -> Optional[chunk_index.ChunkIndex]:
+    """自适应检索模式下缓存文档块向量（persist_dir 中保存内存映射文件）；向量库不是 Chroma 或加载失败时回退到固定 top-k 检索"""
+    if config.RAG_RETRIEVAL_MODE != "adaptive":
+        return None
+    if not hasattr(vector_store, "_collection"):
+        logger.warning("向量库不支持读取文档块向量，使用固定 top-k 检索")
+        return None
+    try:
+        return chunk_index.ChunkIndex.from_vector_store(vector_store, cache_dir=persist_dir)
+    except Exception:
+        logger.exception("文档块向量缓存失败，使用固定 top-k 检索")
+        return None
+
+def _build_index_version(persist_dir: str, fingerprint: str) -> knowledge_base.IndexVersion:
+    """热更新：沿用已加载的词嵌入模型构建新版本向量库及其派生数据"""
+    vector_store = rag_core.build_rag_index(persist_dir, getattr(GLOBAL_VECTOR_STORE, "embeddings", None))
+    return knowledge_base.IndexVersion(
+        os.path.basename(persist_dir), vector_store, persist_dir, fingerprint,
+        chunk_index=_init_chunk_index(vector_store, persist_dir), pretriage=_init_pretriage(vector_store)
+    )
+
+def _load_index_version(persist_dir: str, fingerprint: Optional[str]) -> knowledge_base.IndexVersion:
+    """多进程模式：加载其他工作进程已构建并校验的版本"""
+    vector_store = rag_core.load_rag_index(persist_dir, getattr(GLOBAL_VECTOR_STORE, "embeddings", None))
+    return knowledge_base.IndexVersion(
+        os.path.basename(persist_dir), vector_store, persist_dir, fingerprint,
+        chunk_index=_init_chunk_index(vector_store, persist_dir), pretriage=_init_pretriage(vector_store)
+    )
+
+def _on_index_swap(version: knowledge_base.IndexVersion) -> None:
+    global GLOBAL_VECTOR_STORE
+    global GLOBAL_PRETRIAGE
+    GLOBAL_VECTOR_STORE = version.vector_store
+    GLOBAL_PRETRIAGE = version.pretriage
+
+def reload_knowledge_base(reason: str, wait: bool = False) -> Tuple[bool, str]:
+    """重建并切换知识库（供 ReloadKnowledgeBase RPC 使用）"""
+    if GLOBAL_KNOWLEDGE is None:
+        return False, "医疗分析服务未就绪"
+    return GLOBAL_KNOWLEDGE.reload(reason, wait)
+
+@contextmanager
+def _timed(timings: Optional[Dict[str, float]], key: str):
+    """记录代码块耗时（毫秒）到 timings[key]；timings 为 None 时不记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[key] = (time.perf_counter() - start) * 1000
+
+def _call_provider(fn, token: Optional[cancellation.CancelToken] = None, stage: str = "default"):
+    """经自适应限流器调用模型服务商；限流器未初始化时直接调用"""
+    if GLOBAL_PROVIDER_LIMITER is None:
+        return fn()
+    return GLOBAL_PROVIDER_LIMITER.call(fn, deadline=token.deadline if token is not None else None, stage=stage)
+
+def _provider_stream(create_fn, token: Optional[cancellation.CancelToken] = None, stage: str = "default"):
+    """创建流式响应，名额在读取完成前保持占用
+
+    限流器只记录建立连接的耗时，远短于同一阶段完整生成的耗时，因此使用单独的延迟基线（stage + "_stream"）。
+    """
+    if GLOBAL_PROVIDER_LIMITER is None:
+        return nullcontext(create_fn())
+    return GLOBAL_PROVIDER_LIMITER.stream(create_fn, deadline=token.deadline if token is not None else None,
+                                          stage=f"{stage}_stream")
+
+def _request_timeout(token: Optional[cancellation.CancelToken]) -> Dict[str, float]:
+    """HTTP 请求超时取请求剩余时间；无截止时间时沿用客户端默认值"""
+    remaining = token.remaining() if token is not None else None
+    return {"timeout": max(remaining, 0.1)} if remaining is not None else {}
+
+def _invoke_llm(llm, stage: str, messages, token: Optional[cancellation.CancelToken] = None) -> str:
+    """调用 LLM 并返回文本
+
+    有取消凭证或启用对冲时以流式读取：每收到一块检查一次，请求被取消、超时或对冲落败时
+    立即关闭 HTTP 连接，不再等待服务商生成完剩余内容。
+    """
+    if GLOBAL_HEDGER is None and token is None:
+        return _call_provider(lambda: llm.invoke(messages), stage=stage).content
+
+    def attempt(cancel):
+        def read_stream():
+            parts = []
+            for chunk in llm.stream(messages, **_request_timeout(token)):
+                if cancel.is_set():
+                    raise provider_limiter.CallCancelled()
+                if token is not None and token.aborted_reason() is not None:
+                    cancellation.ABORT_STATS.record_llm_call_aborted()
+                    raise provider_limiter.CallCancelled()
+                parts.append(chunk.content)
+            return "".join(parts)
+
+        if cancel.is_set():
+            raise provider_limiter.CallCancelled()
+        return _call_provider(read_stream, token, stage)
+
+    if GLOBAL_HEDGER is None:
+        return attempt(threading.Event())
+    return GLOBAL_HEDGER.run(stage, attempt)
+
+def _admit(ticket: Optional[scheduler.Ticket], stage: str):
+    """在调度器中为 stage 申请 LLM 调用名额；未启用调度时不做限制"""
+    return ticket.slot(stage) if ticket is not None else nullcontext()
+
+def _image_url(image_base64: str) -> str:
+    """后端传入的图片已带 data URL 前缀（含实际 MIME 类型）时原样使用，否则按 JPEG 补全"""
+    if image_base64.startswith("data:"):
+        return image_base64
+    return f"data:image/jpeg;base64,{image_base64}"
+
+def _stage1_messages(prompt_text: str, image_base64: Optional[str]) -> list:
+    content = [{"type": "text", "text": prompt_text}]
+    if image_base64:
+        content.append({"type": "image_url", "image_url": {"url": _image_url(image_base64)}})
+    return [
         SystemMessage(content="你是一位专业、客观的医疗助手，严格按照提供的格式输出。"),
-        HumanMessage(
-            content=[
-                {"type": "text", "text": prompts.STAGE1_PROMPT_TEMPLATE.format(text_input=patient_text_data)},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-            ]
-        )
+        HumanMessage(content=content)
     ]
-    response = llm.invoke(messages_stage1)
-    return response.content
 
-def _stage2_retrieve_context(llm, multimodal_description_block: str, vector_store: Chroma) -> str:
-    keyword_prompt = ChatPromptTemplate.from_template(prompts.RAG_RETRIEVAL_PROMPT)
-    keyword_chain = keyword_prompt | llm | (lambda x: x.content)
-    retrieval_keywords = keyword_chain.invoke({"report_fragment": multimodal_description_block})
+def _merge_image_observations(description: str, observations: List[str]) -> str:
+    """用逐张图片的观察结果替换文本描述中的 [影像观察] 段落；找不到该段落时追加到末尾"""
+    merged = "[影像观察]：" + "\n".join(
+        f"图片{index}：{observation.strip()}" for index, observation in enumerate(observations, 1)
+    )
+    lines = description.splitlines()
+    for i, line in enumerate(lines):
+        if line.strip().lstrip("*").startswith("[影像观察]"):
+            lines[i] = merged
+            return "\n".join(lines)
+    return f"{description.rstrip()}\n{merged}"
+
+def _submit(fn, *args) -> Future:
+    """提交到图片描述线程池；复制 contextvars，使线程中的调用仍挂在当前 trace 和日志上下文下"""
+    ctx = contextvars.copy_context()
+    return GLOBAL_IMAGE_EXECUTOR.submit(ctx.run, fn, *args)
+
+@tracing.traced("stage1.generate_description")
+def _stage1_generate_description(llm, patient_text_data: str, images: List[str],
+                                 timings: Optional[Dict[str, float]] = None,
+                                 ticket: Optional[scheduler.Ticket] = None,
+                                 token: Optional[cancellation.CancelToken] = None) -> str:
+    """生成多模态描述块
+
+    单张（或没有）图片时一次调用完成；多张图片时，文本描述与每张图片的视觉描述并行调用，
+    再将各图片的观察结果合并为一个 [影像观察] 段落。启用调度时本请求同时占用的 stage1 名额不超过
+    并发上限的 SCHEDULER_REQUEST_STAGE_SHARE，其余调用在线程池中等待本请求的名额。
+    """
+    text_prompt = prompts.STAGE1_PROMPT_TEMPLATE.format(text_input=patient_text_data)
+
+    def call(messages) -> str:
+        with _admit(ticket, "stage1"):
+            return _invoke_llm(llm, "stage1", messages, token)
 
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-    retrieved_docs: List[Document] = retriever.invoke(retrieval_keywords) 
-    retrieved_context = "\n---\n".join([doc.page_content for doc in retrieved_docs])
+    with _timed(timings, "stage1_ms"):
+        if len(images) <= 1 or GLOBAL_IMAGE_EXECUTOR is None:
+            if len(images) > 1:
+                logger.warning("图片描述线程池未初始化，仅分析第一张图片", extra={"images": len(images)})
+            return call(_stage1_messages(text_prompt, images[0] if images else None))
+
+        tracer = tracing.get_tracer()
+
+        with (ticket.parallel("stage1") if ticket is not None else nullcontext()) as group:
+            def parallel_call(messages) -> str:
+                with (group.slot() if group is not None else nullcontext()):
+                    return _invoke_llm(llm, "stage1", messages, token)
+
+            def describe_image(index: int, image_base64: str) -> str:
+                image_prompt = prompts.STAGE1_IMAGE_PROMPT_TEMPLATE.format(
+                    text_input=patient_text_data, image_index=index, image_count=len(images)
+                )
+                with tracer.start_as_current_span("stage1.describe_image", attributes={"stage1.image_index": index}):
+                    return parallel_call(_stage1_messages(image_prompt, image_base64))
+
+            text_future = _submit(parallel_call, _stage1_messages(text_prompt, None))
+            image_futures = [_submit(describe_image, index, image) for index, image in enumerate(images, 1)]
+            # 等待全部完成后再抛出异常，避免线程池中仍有调用引用本请求的调度名额
+            wait([text_future, *image_futures])
+        return _merge_image_observations(text_future.result(), [future.result() for future in image_futures])
+
+@tracing.traced("stage2.retrieve_context")
+def _stage2_retrieve_context(llm, multimodal_description_block: str, knowledge: knowledge_base.KnowledgeBase,
+                             timings: Optional[Dict[str, float]] = None,
+                             ticket: Optional[scheduler.Ticket] = None,
+                             token: Optional[cancellation.CancelToken] = None,
+                             checkpoints: Optional[checkpoint.RequestCheckpoints] = None,
+                             department: str = "") -> str:
+    """提取检索关键词并检索文档；先检索所选科室的文档分区，命中不足时扩大到全库
+
+    检索结果经 context_assembler 合并重叠块、去重并裁剪到 CONTEXT_TOKEN_BUDGET 后作为阶段3 的上下文。
+    """
+    checkpoints = checkpoints or checkpoint.RequestCheckpoints(None, "", "", "")
+    saved = checkpoints.get("retrieval")
+    if saved is not None:
+        return saved["context"]
+
+    tracer = tracing.get_tracer()
+    saved = checkpoints.get("keyword")
+    if saved is not None:
+        retrieval_keywords = saved["keywords"]
+    else:
+        keyword_prompt = ChatPromptTemplate.from_template(prompts.RAG_RETRIEVAL_PROMPT)
+        keyword_messages = keyword_prompt.format_messages(report_fragment=multimodal_description_block)
+        with tracer.start_as_current_span("stage2.extract_keywords"), _admit(ticket, "keyword"), _timed(timings, "keyword_ms"):
+            retrieval_keywords = _invoke_llm(llm, "keyword", keyword_messages, token)
+        checkpoints.save("keyword", {"keywords": retrieval_keywords})
+
+    # 检索期间持有当前知识库版本，热更新切换后本次检索仍在旧版本上完成
+    with tracer.start_as_current_span("stage2.vector_search") as span, _timed(timings, "vector_search_ms"), \
+            knowledge.lease() as index:
+        if index.chunk_index is not None:
+            results, partition, widened = index.chunk_index.search(retrieval_keywords, department)
+        else:
+            results, partition, widened = rag_core.search_partitioned(
+                index.vector_store, retrieval_keywords, department, config.RAG_TOP_K
+            )
+        retrieved_docs: List[Document] = [doc for doc, _ in results]
+        span.set_attribute("rag.retrieved_docs", len(retrieved_docs))
+        span.set_attribute("rag.adaptive", index.chunk_index is not None)
+        span.set_attribute("rag.index_version", index.version)
+        span.set_attribute("rag.partition", partition)
+        span.set_attribute("rag.widened", widened)
+    with tracer.start_as_current_span("stage2.assemble_context") as span:
+        assembled = context_assembler.assemble(results)
+        span.set_attribute("context.tokens_before", assembled.tokens_before)
+        span.set_attribute("context.tokens_after", assembled.tokens_after)
+        span.set_attribute("context.segments", len(assembled.segments))
+    retrieved_context = assembled.text
+    # 同时保存上下文文本，恢复时无需再按块 ID 回查向量库
+    checkpoints.save("retrieval", {
+        "chunks": [
+            {"id": getattr(doc, "id", None), "source": doc.metadata.get("source"),
+             "department": doc.metadata.get("department"), "score": round(score, 4)}
+            for doc, score in results
+        ],
+        "partition": partition,
+        "widened": widened,
+        "assembly": assembled.stats(),
+        "context": retrieved_context
+    })
     return retrieved_context
 
-def _stage3_sync_generate_final_report(llm, patient_text_data: str, multimodal_description_block: str, retrieved_context: str) -> str:
+@tracing.traced("stage3.generate_final_report")
+def _stage3_sync_generate_final_report(llm, patient_text_data: str, multimodal_description_block: str, retrieved_context: str,
+                                       timings: Optional[Dict[str, float]] = None,
+                                       ticket: Optional[scheduler.Ticket] = None,
+                                       token: Optional[cancellation.CancelToken] = None) -> str:
     final_prompt = ChatPromptTemplate.from_template(prompts.FINAL_REPORT_PROMPT)
-    final_chain = final_prompt | llm | (lambda x: x.content)
-    final_report = final_chain.invoke({
-        "original_text_data": patient_text_data,
-        "multimodal_description": multimodal_description_block, 
-        "retrieved_context": retrieved_context
-    })
-    return final_report
+    final_messages = final_prompt.format_messages(
+        original_text_data=patient_text_data,
+        multimodal_description=multimodal_description_block,
+        retrieved_context=retrieved_context
+    )
+    with _admit(ticket, "stage3"), _timed(timings, "stage3_ms"):
+        return _invoke_llm(llm, "stage3", final_messages, token)
+
+def _pretriage(request: AnalysisRequest, timings: Dict[str, float],
+               triager: Optional[pretriage.DepartmentPreTriage]) -> Optional[pretriage.TriageResult]:
+    """调用 LLM 前的科室预分诊；未启用、科室未知或没有可用描述时返回 None"""
+    if triager is None:
+        return None
+    with tracing.get_tracer().start_as_current_span("pretriage") as span, _timed(timings, "pretriage_ms"):
+        result = triager.classify(request.patient_text_data, request.patient_department)
+        if result is not None:
+            span.set_attribute("pretriage.selected_rank", result.selected_rank)
+            span.set_attribute("pretriage.suggested", result.suggested)
+            span.set_attribute("pretriage.mismatch", result.mismatch)
+    if result is not None and result.mismatch:
+        logger.info("预分诊判定科室不匹配", extra={
+            "department": result.selected,
+            "suggested": result.suggested,
+            "selected_rank": result.selected_rank,
+            "enforce": triager.enforce,
+        })
+    return result
 
-def _stage3_stream_generate_final_report(client: ZhipuAI, patient_text_data: str, multimodal_description_block: str, retrieved_context: str) -> StreamReport:
+def _pretriage_report(result: pretriage.TriageResult) -> str:
+    return (f"科室选择错误，请重新选择。\n根据问卷描述，症状与【{result.selected}】的典型表现差距较大，"
+            f"更符合【{result.suggested}】的就诊范围（本地预分诊判断，未调用大模型）。")
+
+def _report_status(final_report_text: str) -> str:
+    """根据最终报告内容判断状态（检测科室选择错误）"""
+    if "科室选择错误，请重新选择" in final_report_text or "科室选择错误" in final_report_text or len(final_report_text.strip()) < 50:
+        return "DEPARTMENT_ERROR"
+    return "SUCCESS"
+
+@tracing.traced("stage3.stream_final_report")
+def _stage3_stream_generate_final_report(client: ZhipuAI, patient_text_data: str, multimodal_description_block: str, retrieved_context: str,
+                                         finish: Callable[[str, str], AnalysisReport],
+                                         timings: Optional[Dict[str, float]] = None,
+                                         ticket: Optional[scheduler.Ticket] = None,
+                                         token: Optional[cancellation.CancelToken] = None) -> StreamReport:
     prompt_text = prompts.FINAL_REPORT_PROMPT.format(
         original_text_data=patient_text_data,
         multimodal_description=multimodal_description_block,
         retrieved_context=retrieved_context
     )
     
-    response = client.chat.completions.create(
-        model="glm-4.1v-thinking-flash",
-        messages=[{"role": "user", "content": prompt_text}],
-        temperature=config.TEMPERATURE,
-        max_tokens=config.MAX_TOKENS,
-        stream=True
-    )
-    
-    for chunk in response:
-        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
-            yield chunk.choices[0].delta.content
-        
-        if chunk.choices and chunk.choices[0].finish_reason:
-            yield "[STREAM_END]"
+    def create_stream():
+        return client.chat.completions.create(
+            model=config.LLM_MODEL_NAME,
+            messages=[{"role": "user", "content": prompt_text}],
+            temperature=config.TEMPERATURE,
+            max_tokens=config.MAX_TOKENS,
+            stream=True,
+            **_request_timeout(token)
+        )
+
+    parts: List[str] = []
+    # 名额在整个流式输出期间保持占用
+    with _admit(ticket, "stage3"), _timed(timings, "stage3_ms"), \
+            _provider_stream(create_stream, token, "stage3") as response:
+        try:
+            for chunk in response:
+                reason = token.aborted_reason() if token is not None else None
+                if reason is not None:
+                    cancellation.ABORT_STATS.record_llm_call_aborted()
+                    cancellation.ABORT_STATS.record_request(reason, "stage3")
+                    raise cancellation.AnalysisAborted(reason, "stage3")
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    break
+        except GeneratorExit:
+            # 消费方提前关闭生成器：客户端取消流式 RPC 时计入取消统计（正常结束时 token 尚未置位）
+            reason = token.aborted_reason() if token is not None else None
+            if reason is not None:
+                cancellation.ABORT_STATS.record_llm_call_aborted()
+                cancellation.ABORT_STATS.record_request(reason, "stage3")
+            raise
+        finally:
+            # zhipuai 的 StreamResponse 不会自动关闭连接；中止或客户端断开（生成器被关闭）时
+            # 主动关闭，服务商随即停止生成
+            response.response.close()
+
+    final_report_text = "".join(parts)
+    yield finish(final_report_text, _report_status(final_report_text))
 
 
 # -----------------------------------------------------------------
@@ -130,6 +559,8 @@ def _stage3_stream_generate_final_report(client: ZhipuAI, patient_text_data: str
 def process_medical_analysis(request: AnalysisRequest) -> Union[AnalysisReport, StreamReport]:
     """
     核心分析函数：兼容同步和流式传输。
+
+    同步模式下，携带相同 request_id 且输入相同的并发请求只执行一次分析流程，其余请求共享结果。
     
     Args:
         request: 包含原始文本和图片Base64编码的请求对象。
@@ -137,37 +568,149 @@ def process_medical_analysis(request: AnalysisRequest) -> Union[AnalysisReport,
     Returns:
         AnalysisReport (同步模式) 或 Generator[str] (流式模式)。
     """
-    
-    if GLOBAL_VECTOR_STORE is None or GLOBAL_LLM is None or GLOBAL_ZHIPU_CLIENT is None:
-        return AnalysisReport(structured_report="医疗分析服务未就绪，请检查初始化状态。", status="SERVICE_UNAVAILABLE")
+    if GLOBAL_SINGLEFLIGHT is None or request.stream or not request.request_id:
+        return _run_medical_analysis(request)
+
+    if request.cancel_token is None:
+        request.cancel_token = cancellation.CancelToken(request.deadline)
+    fingerprint = checkpoint.input_fingerprint(request.patient_text_data, "\n".join(request.images))
+    key = f"{request.request_id}:{fingerprint}"
+    report, shared = GLOBAL_SINGLEFLIGHT.do(key, lambda: _run_medical_analysis(request), request.cancel_token)
+    if not shared:
+        return report
+
+    # 共享结果：阶段耗时沿用执行方的数据，总耗时按本请求实际等待时间计算
+    timings = dict(report.timings)
+    if request.received_at is not None:
+        timings["total_ms"] = (time.perf_counter() - request.received_at) * 1000
+    return AnalysisReport(structured_report=report.structured_report, status=report.status, timings=timings,
+                          resumed_stages=report.resumed_stages, shared=True, key_info=report.key_info)
+
+
+def _run_medical_analysis(request: AnalysisRequest) -> Union[AnalysisReport, StreamReport]:
+    """执行一次完整的分析流程"""
+    start = time.perf_counter()
+    received_at = request.received_at if request.received_at is not None else start
+    timings: Dict[str, float] = {"queue_wait_ms": (start - received_at) * 1000}
+
+    token = request.cancel_token or cancellation.CancelToken(request.deadline)
+    checkpoints = checkpoint.RequestCheckpoints(
+        GLOBAL_CHECKPOINTS, request.request_id, request.patient_text_data, "\n".join(request.images)
+    )
 
+    # 各阶段在调度器中排队的时间计入 queue_wait_ms，不计入阶段耗时
+    ticket = GLOBAL_SCHEDULER.ticket(request.priority, token.deadline, token) if GLOBAL_SCHEDULER is not None else None
+
+    triage: Optional[pretriage.TriageResult] = None
+    # 整个请求使用同一个预分诊实例（知识库热更新会替换 GLOBAL_PRETRIAGE）
+    triager = GLOBAL_PRETRIAGE
+
+    def _finish(report_text: str, status: str, key_info: Optional[Dict[str, str]] = None) -> AnalysisReport:
+        timings["total_ms"] = (time.perf_counter() - received_at) * 1000
+        if ticket is not None:
+            timings["queue_wait_ms"] += ticket.waited_ms
+        logger.debug("阶段耗时", extra={"status": status, "timings": timings, "resumed": checkpoints.resumed})
+        if status == "SUCCESS":
+            key_info = report_parser.extract_key_info(report_text)
+        # 经过 LLM 判断的请求，以其结论检验预分诊结果
+        if triage is not None and status in ("SUCCESS", "DEPARTMENT_ERROR"):
+            triager.record_outcome(triage, status == "DEPARTMENT_ERROR")
+        return AnalysisReport(structured_report=report_text, status=status, timings=timings,
+                              resumed_stages=checkpoints.resumed, key_info=key_info)
+
+    if GLOBAL_KNOWLEDGE is None or GLOBAL_LLM is None or GLOBAL_ZHIPU_CLIENT is None:
+        return _finish("医疗分析服务未就绪，请检查初始化状态。", "SERVICE_UNAVAILABLE")
+
+    # 每个阶段开始前检查取消状态和剩余时间，避免为已放弃的请求继续调用 LLM
+    # 已完成阶段的结果从检查点读取（同一 request_id 的重试），不再重复调用 LLM
+    if not request.stream:
+        saved = checkpoints.get("stage3")
+        if saved is not None:
+            return _finish(saved["report"], saved["status"])
+
+    # 科室明显不匹配时直接返回，省去全部 LLM 调用
+    triage = _pretriage(request, timings, triager)
+    if triage is not None and triage.mismatch and triager.enforce:
+        # 省去的调用：阶段1（多图片时另有逐张图片描述）、关键词提取、阶段3
+        triager.record_short_circuit(3 + (len(request.images) if len(request.images) > 1 else 0))
+        flagged, triage = triage, None
+        return _finish(_pretriage_report(flagged), "DEPARTMENT_ERROR", {"suggested_department": flagged.suggested})
+
+    stage = "stage1"
     try:
         # 阶段 1 和 2 必须同步完成
-        multimodal_description_block = _stage1_generate_description(GLOBAL_LLM, request.patient_text_data, request.image_base64)
-        retrieved_context = _stage2_retrieve_context(GLOBAL_LLM, multimodal_description_block, GLOBAL_VECTOR_STORE)
+        saved = checkpoints.get("stage1")
+        if saved is not None:
+            multimodal_description_block = saved["description"]
+        else:
+            token.check(stage)
+            multimodal_description_block = _stage1_generate_description(
+                GLOBAL_LLM, request.patient_text_data, request.images, timings, ticket, token
+            )
+            checkpoints.save("stage1", {"description": multimodal_description_block})
+        stage = "stage2"
+        token.check(stage)
+        retrieved_context = _stage2_retrieve_context(
+            GLOBAL_LLM, multimodal_description_block, GLOBAL_KNOWLEDGE, timings, ticket, token, checkpoints,
+            request.patient_department or pretriage.selected_department(request.patient_text_data)
+        )
         
         # 阶段 3: 根据模式选择同步或流式生成
+        stage = "stage3"
+        token.check(stage)
         if request.stream:
             return _stage3_stream_generate_final_report(
                 GLOBAL_ZHIPU_CLIENT, 
                 request.patient_text_data, 
                 multimodal_description_block, 
-                retrieved_context
+                retrieved_context,
+                _finish,
+                timings,
+                ticket,
+                token
             )
         else:
             final_report_text = _stage3_sync_generate_final_report(
                 GLOBAL_LLM, 
                 request.patient_text_data, 
                 multimodal_description_block, 
-                retrieved_context
+                retrieved_context,
+                timings,
+                ticket,
+                token
             )
             
             # 检测科室选择错误
-            if "科室选择错误，请重新选择" in final_report_text or "科室选择错误" in final_report_text or len(final_report_text.strip()) < 50:
-                return AnalysisReport(structured_report=final_report_text, status="DEPARTMENT_ERROR")
-            else:
-                return AnalysisReport(structured_report=final_report_text, status="SUCCESS")
+            status = _report_status(final_report_text)
+            checkpoints.save("stage3", {"report": final_report_text, "status": status})
+            return _finish(final_report_text, status)
         
+    except cancellation.AnalysisAborted as e:
+        cancellation.ABORT_STATS.record_request(e.reason, e.stage)
+        raise
     except Exception as e:
+        # 取消或超时导致的失败（排队超时、连接被关闭等）统一交由 RPC 层按取消处理
+        reason = token.aborted_reason()
+        if reason is not None:
+            cancellation.ABORT_STATS.record_request(reason, stage)
+            raise cancellation.AnalysisAborted(reason, stage) from e
+        if isinstance(e, scheduler.SchedulerRejected):
+            # 过载拒绝交由 RPC 层转换为 RESOURCE_EXHAUSTED
+            raise
         error_msg = f"系统内部错误，无法完成分析。详情: {type(e).__name__}"
-        return AnalysisReport(structured_report=error_msg, status="INTERNAL_ERROR")
+        return _finish(error_msg, "INTERNAL_ERROR")
+
+
+def get_service_stats() -> Dict[str, object]:
+    """调度器、服务商限流、对冲、取消、检查点与去重统计（供 GetServiceStats RPC 使用）"""
+    return {
+        "scheduler": GLOBAL_SCHEDULER.stats() if GLOBAL_SCHEDULER is not None else None,
+        "provider": GLOBAL_PROVIDER_LIMITER.stats() if GLOBAL_PROVIDER_LIMITER is not None else None,
+        "hedging": GLOBAL_HEDGER.stats() if GLOBAL_HEDGER is not None else None,
+        "aborted": cancellation.ABORT_STATS.stats(),
+        "checkpoints": GLOBAL_CHECKPOINTS.stats() if GLOBAL_CHECKPOINTS is not None else None,
+        "singleflight": GLOBAL_SINGLEFLIGHT.stats() if GLOBAL_SINGLEFLIGHT is not None else None,
+        "pretriage": GLOBAL_PRETRIAGE.stats() if GLOBAL_PRETRIAGE is not None else None,
+        "knowledge_base": GLOBAL_KNOWLEDGE.stats() if GLOBAL_KNOWLEDGE is not None else None,
+        "worker": {"index": GLOBAL_WORKER_INDEX, "pid": os.getpid()},
+    }
@@ -0,0 +1,97 @@
+"""
+请求截止时间与取消传播
+
+每个 RPC 对应一个 CancelToken：
+- deadline 取自客户端设置的 gRPC 超时（time.monotonic 时间戳）；
+- 客户端取消或超时后，gRPC 回调会将 token 置为已取消。
+
+分析流程在阶段之间调用 token.check() 检查剩余时间；流式读取 LLM 响应时逐块检查，
+发现取消后立即关闭 HTTP 连接，不再为已放弃的请求占用线程和服务商名额。
+"""
+import time
+import threading
+from typing import Dict, Optional
+
+import config.config as config
+
+REASON_CANCELLED = "cancelled"
+REASON_DEADLINE = "deadline_exceeded"
+
+
+class AnalysisAborted(Exception):
+    """请求已被客户端取消，或剩余时间不足以继续"""
+
+    def __init__(self, reason: str, stage: str):
+        super().__init__(f"{stage}: {reason}")
+        self.reason = reason
+        self.stage = stage
+
+
+class CancelToken:
+    """单个请求的截止时间与取消状态"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self.event = threading.Event()
+
+    def cancel(self, reason: str = REASON_CANCELLED) -> None:
+        if not self.event.is_set():
+            self.reason = reason
+            self.event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """剩余时间（秒）；未设置截止时间时返回 None"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def aborted_reason(self, min_remaining: float = 0.0) -> Optional[str]:
+        if self.cancelled:
+            return self.reason
+        remaining = self.remaining()
+        if remaining is not None and remaining <= min_remaining:
+            return REASON_DEADLINE
+        return None
+
+    def check(self, stage: str, min_remaining: Optional[float] = None) -> None:
+        """开始 stage 之前调用：已取消或剩余时间不足 min_remaining 时抛出 AnalysisAborted"""
+        if min_remaining is None:
+            min_remaining = config.DEADLINE_MIN_STAGE_SECONDS
+        reason = self.aborted_reason(min_remaining)
+        if reason is not None:
+            raise AnalysisAborted(reason, stage)
+
+
+class AbortStats:
+    """按原因和阶段统计被取消 / 超时放弃的工作量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[str, Dict[str, int]] = {REASON_CANCELLED: {}, REASON_DEADLINE: {}}
+        self._llm_calls_aborted = 0
+
+    def record_request(self, reason: str, stage: str) -> None:
+        with self._lock:
+            by_stage = self._requests.setdefault(reason, {})
+            by_stage[stage] = by_stage.get(stage, 0) + 1
+
+    def record_llm_call_aborted(self) -> None:
+        with self._lock:
+            self._llm_calls_aborted += 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "cancelled": sum(self._requests[REASON_CANCELLED].values()),
+                "deadline_exceeded": sum(self._requests[REASON_DEADLINE].values()),
+                "by_stage": {reason: dict(by_stage) for reason, by_stage in self._requests.items()},
+                "llm_calls_aborted": self._llm_calls_aborted,
+            }
+
+
+ABORT_STATS = AbortStats()
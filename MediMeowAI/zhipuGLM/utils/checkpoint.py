@@ -0,0 +1,175 @@
+"""
+分析阶段检查点
+
+以后端传入的 request_id 为键，将已完成阶段的中间结果保存到本地 SQLite：
+- stage1:    多模态描述块（耗时最长的多模态调用）
+- keyword:   检索关键词
+- retrieval: 检索到的文档块 ID 与拼接后的上下文
+- stage3:    最终报告与状态
+
+同一 request_id 的重试从最后一个已完成阶段继续，不再重复调用 LLM。
+检查点同时记录输入指纹（文本 + 图片），输入变化时旧检查点作废。
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import config.config as config
+
+logger = logging.getLogger(__name__)
+
+# 阶段执行顺序
+STAGES = ["stage1", "keyword", "retrieval", "stage3"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    request_id  TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    PRIMARY KEY (request_id, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_checkpoints_created_at ON checkpoints (created_at);
+"""
+
+
+def input_fingerprint(patient_text_data: str, image_base64: str) -> str:
+    """请求输入的指纹，用于判断检查点是否仍然适用"""
+    digest = hashlib.sha256()
+    for part in (patient_text_data, image_base64):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """基于 SQLite 的检查点存储（单连接 + 锁，WAL 模式）"""
+
+    def __init__(self, db_path: str, ttl_seconds: float):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._stats = {"saved": 0, "resumed_requests": 0, "resumed_stages": 0, "stale_discarded": 0}
+
+    @classmethod
+    def from_config(cls) -> "CheckpointStore":
+        return cls(config.CHECKPOINT_DB_PATH, config.CHECKPOINT_TTL_SECONDS)
+
+    def load(self, request_id: str, fingerprint: str) -> Dict[str, Dict[str, Any]]:
+        """返回 {stage: payload}；输入指纹不一致或已过期的检查点会被删除"""
+        expire_before = time.time() - self.ttl_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, fingerprint, payload, created_at FROM checkpoints WHERE request_id = ?",
+                (request_id,)
+            ).fetchall()
+            if any(row[1] != fingerprint or row[3] < expire_before for row in rows):
+                self._conn.execute("DELETE FROM checkpoints WHERE request_id = ?", (request_id,))
+                self._stats["stale_discarded"] += 1
+                return {}
+            result = {stage: json.loads(payload) for stage, _, payload, _ in rows}
+            if result:
+                self._stats["resumed_requests"] += 1
+                self._stats["resumed_stages"] += len(result)
+            return result
+
+    def save(self, request_id: str, fingerprint: str, stage: str, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (request_id, stage, fingerprint, payload, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (request_id, stage, fingerprint, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            self._stats["saved"] += 1
+
+    def delete(self, request_id: str) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM checkpoints WHERE request_id = ?", (request_id,)).rowcount
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM checkpoints WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+
+    def get(self, request_id: str) -> List[Dict[str, Any]]:
+        """按阶段顺序返回某个请求的全部检查点"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, fingerprint, payload, created_at FROM checkpoints WHERE request_id = ?",
+                (request_id,)
+            ).fetchall()
+        rows.sort(key=lambda row: STAGES.index(row[0]) if row[0] in STAGES else len(STAGES))
+        return [
+            {"stage": stage, "fingerprint": fp, "payload": json.loads(payload), "created_at": created_at}
+            for stage, fp, payload, created_at in rows
+        ]
+
+    def list_requests(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近更新的请求及其已完成阶段"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT request_id, GROUP_CONCAT(stage), MAX(created_at) FROM checkpoints "
+                "GROUP BY request_id ORDER BY MAX(created_at) DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {
+                "request_id": request_id,
+                "stages": sorted(stages.split(","), key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)),
+                "updated_at": updated_at
+            }
+            for request_id, stages, updated_at in rows
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["requests"] = self._conn.execute("SELECT COUNT(DISTINCT request_id) FROM checkpoints").fetchone()[0]
+        return stats
+
+
+class RequestCheckpoints:
+    """单个请求的检查点读写；未启用检查点或请求未携带 request_id 时不做任何事"""
+
+    def __init__(self, store: Optional[CheckpointStore], request_id: str,
+                 patient_text_data: str, image_base64: str):
+        self.enabled = store is not None and bool(request_id)
+        self._store = store
+        self.request_id = request_id
+        self.fingerprint = input_fingerprint(patient_text_data, image_base64) if self.enabled else ""
+        self._completed: Dict[str, Dict[str, Any]] = {}
+        if self.enabled:
+            try:
+                self._completed = store.load(request_id, self.fingerprint)
+            except sqlite3.Error as e:
+                logger.warning("读取检查点失败: %s", e)
+        # 本次从检查点恢复、未重新执行的阶段
+        self.resumed: List[str] = []
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        """返回 stage 已保存的结果；没有时返回 None"""
+        payload = self._completed.get(stage)
+        if payload is not None:
+            self.resumed.append(stage)
+        return payload
+
+    def save(self, stage: str, payload: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._store.save(self.request_id, self.fingerprint, stage, payload)
+        except sqlite3.Error as e:
+            # 检查点只用于加速重试，写入失败不影响本次分析
+            logger.warning("保存检查点失败: %s", e, extra={"stage": stage})
@@ -0,0 +1,230 @@
+"""
+阶段3 检索上下文组装
+
+原先检索到的文档块直接以 "\\n---\\n" 拼接后填入 FINAL_REPORT_PROMPT：分块时相邻文档块有
+chunk_overlap 个字符的重叠，同一段文字常被重复发送，上下文长度也没有上限。组装步骤：
+1. 合并同一文档中重叠或相邻的文档块（按 start_index 定位；旧索引没有 start_index 时按文本首尾重叠判断）；
+2. 去除近似重复的文档块（字符三元组 Jaccard 相似度不低于阈值时保留相关度较高的一个）；
+3. 按相关度从高到低装入 token 预算，放不下的片段跳过，只有相关度最高的片段超出预算时截断。
+
+token 数用 tiktoken 计数（CONTEXT_TOKEN_ENCODING），只用于控制上下文规模，与 GLM 的实际计费
+token 数存在差异。编码文件无法加载（如离线环境）时按字符估算：中日韩字符计 1 个，其余字符计 1/4 个。
+"""
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import config.config as config
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = "\n---\n"
+
+_ENCODING_LOCK = threading.Lock()
+# None 表示尚未加载；False 表示加载失败，使用字符估算
+_ENCODING = None
+
+
+def _encoding():
+    global _ENCODING
+    if _ENCODING is None:
+        with _ENCODING_LOCK:
+            if _ENCODING is None:
+                try:
+                    import tiktoken
+                    _ENCODING = tiktoken.get_encoding(config.CONTEXT_TOKEN_ENCODING)
+                except Exception as e:
+                    logger.warning("tiktoken 编码 %s 加载失败，按字符估算 token 数: %s",
+                                   config.CONTEXT_TOKEN_ENCODING, e)
+                    _ENCODING = False
+    return _ENCODING or None
+
+
+def preload() -> bool:
+    """加载计数用的编码，返回是否使用 tiktoken"""
+    return _encoding() is not None
+
+
+def _char_tokens(ch: str) -> float:
+    code = ord(ch)
+    if 0x3000 <= code <= 0x9FFF or 0xAC00 <= code <= 0xD7AF or 0xF900 <= code <= 0xFAFF or 0xFF00 <= code <= 0xFFEF:
+        return 1.0
+    return 0.25
+
+
+def count_tokens(text: str) -> int:
+    """文本的 token 数"""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return int(sum(_char_tokens(ch) for ch in text) + 0.999)
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """截断到不超过 budget 个 token"""
+    encoding = _encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        # 截断点可能落在多字节字符中间，去掉解码产生的替换字符
+        return encoding.decode(tokens[:budget]).rstrip("�")
+    total = 0.0
+    for index, ch in enumerate(text):
+        total += _char_tokens(ch)
+        if total > budget:
+            return text[:index]
+    return text
+
+
+class Segment:
+    """待组装的上下文片段（一个或多个合并后的文档块）"""
+
+    def __init__(self, text: str, score: float, source: str = "", start: Optional[int] = None, chunks: int = 1):
+        self.text = text
+        self.score = score
+        self.source = source
+        self.start = start
+        self.chunks = chunks
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+
+class AssembledContext:
+    """组装结果与统计：tokens_before 为原拼接方式的 token 数"""
+
+    def __init__(self, text: str, segments: List[Segment], chunks: int, merged: int, duplicates: int,
+                 skipped: int, truncated: bool, tokens_before: int, tokens_after: int):
+        self.text = text
+        self.segments = segments
+        self.chunks = chunks
+        self.merged = merged
+        self.duplicates = duplicates
+        self.skipped = skipped
+        self.truncated = truncated
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "chunks": self.chunks, "segments": len(self.segments), "merged": self.merged,
+            "duplicates": self.duplicates, "skipped": self.skipped, "truncated": self.truncated,
+            "tokens_before": self.tokens_before, "tokens_after": self.tokens_after,
+        }
+
+
+def _text_overlap(left: str, right: str, min_overlap: int) -> int:
+    """left 的后缀与 right 的前缀重合的最大长度；小于 min_overlap 时返回 0"""
+    for size in range(min(len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _join(first: Segment, second: Segment, min_overlap: int) -> Optional[str]:
+    """两个同源片段可合并时返回合并后的文本（first 在前），否则返回 None"""
+    if first.start is not None and second.start is not None:
+        if second.start < first.start or second.start > first.end + 1:
+            return None
+        if second.end <= first.end:
+            return first.text
+        # 分块时会去掉块首尾的空白，重叠部分按位置截取；恰好相邻时以换行衔接
+        if second.start >= first.end:
+            return first.text + "\n" + second.text
+        return first.text + second.text[first.end - second.start:]
+    if second.text in first.text:
+        return first.text
+    size = _text_overlap(first.text, second.text, min_overlap)
+    return first.text + second.text[size:] if size else None
+
+
+def merge_segments(segments: List[Segment], min_overlap: int) -> Tuple[List[Segment], int]:
+    """合并同一文档中重叠、相邻或互相包含的片段，返回 (片段列表, 合并次数)"""
+    merged_count = 0
+    result: List[Segment] = []
+    by_source: Dict[str, List[Segment]] = {}
+    for segment in segments:
+        by_source.setdefault(segment.source, []).append(segment)
+    for source, group in by_source.items():
+        if not source:
+            result.extend(group)
+            continue
+        group = sorted(group, key=lambda s: -1 if s.start is None else s.start)
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(group)):
+                for j in range(len(group)):
+                    if i == j:
+                        continue
+                    text = _join(group[i], group[j], min_overlap)
+                    if text is None:
+                        continue
+                    first, second = group[i], group[j]
+                    group[i] = Segment(text, max(first.score, second.score), source, first.start,
+                                       first.chunks + second.chunks)
+                    del group[j]
+                    merged_count += 1
+                    changed = True
+                    break
+                if changed:
+                    break
+        result.extend(group)
+    return result, merged_count
+
+
+def _shingles(text: str) -> set:
+    text = "".join(text.split())
+    return {text[i:i + 3] for i in range(max(len(text) - 2, 1))}
+
+
+def drop_duplicates(segments: List[Segment], threshold: float) -> Tuple[List[Segment], int]:
+    """按相关度从高到低保留片段，与已保留片段的三元组 Jaccard 相似度不低于 threshold 的视为重复"""
+    kept: List[Tuple[Segment, set]] = []
+    for segment in sorted(segments, key=lambda s: s.score, reverse=True):
+        grams = _shingles(segment.text)
+        if any(len(grams & other) / max(len(grams | other), 1) >= threshold for _, other in kept):
+            continue
+        kept.append((segment, grams))
+    return [segment for segment, _ in kept], len(segments) - len(kept)
+
+
+def assemble(results: Sequence[Tuple[object, float]], budget: Optional[int] = None,
+             duplicate_threshold: Optional[float] = None, min_overlap: Optional[int] = None) -> AssembledContext:
+    """组装检索结果 [(文档块, 相关度)]；budget <= 0 时不限制 token 数"""
+    budget = config.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    duplicate_threshold = config.CONTEXT_DUPLICATE_THRESHOLD if duplicate_threshold is None else duplicate_threshold
+    min_overlap = config.CONTEXT_MIN_OVERLAP if min_overlap is None else min_overlap
+
+    segments = [
+        Segment(doc.page_content.strip(), score, doc.metadata.get("source", ""), doc.metadata.get("start_index"))
+        for doc, score in results if doc.page_content.strip()
+    ]
+    tokens_before = count_tokens(SEPARATOR.join(doc.page_content for doc, _ in results))
+    segments, merged = merge_segments(segments, min_overlap)
+    segments, duplicates = drop_duplicates(segments, duplicate_threshold)
+
+    packed: List[Segment] = []
+    used = 0
+    skipped = 0
+    truncated = False
+    separator_tokens = count_tokens(SEPARATOR)
+    for segment in segments:
+        cost = count_tokens(segment.text) + (separator_tokens if packed else 0)
+        if budget <= 0 or used + cost <= budget:
+            packed.append(segment)
+            used += cost
+        elif not packed:
+            # 相关度最高的片段本身超出预算时截断保留，保证上下文不为空
+            packed.append(Segment(truncate_tokens(segment.text, budget), segment.score, segment.source,
+                                  segment.start, segment.chunks))
+            used = budget
+            truncated = True
+        else:
+            skipped += 1
+
+    text = SEPARATOR.join(segment.text for segment in packed)
+    return AssembledContext(text, packed, len(results), merged, duplicates, skipped, truncated,
+                            tokens_before, count_tokens(text))
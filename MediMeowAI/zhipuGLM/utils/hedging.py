@@ -0,0 +1,159 @@
+"""
+LLM 请求对冲（hedged requests）
+
+针对 temperature=0 的幂等调用：主请求超过该阶段近期延迟的 p95 仍未返回时，
+再发起一个相同的请求，取先成功返回的结果，并通知另一个请求停止读取（关闭连接）。
+对冲请求数量受比例预算限制（默认不超过主请求数的 10%），避免成本失控。
+
+调用方提供的 attempt 函数接收一个 threading.Event，需在读取响应的过程中检查该事件，
+被置位时抛出 provider_limiter.CallCancelled。
+"""
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+from opentelemetry import trace
+
+import config.config as config
+
+
+class LatencyWindow:
+    """按阶段保存最近 N 次调用的延迟（秒），用于估算对冲延迟"""
+
+    def __init__(self, size: int, min_samples: int):
+        self.size = size
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, stage: str, pct: float) -> Optional[float]:
+        """样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+        return ordered[index]
+
+
+class HedgeBudget:
+    """对冲比例预算：最近窗口内对冲次数不超过主请求数 × max_ratio"""
+
+    def __init__(self, max_ratio: float, window: int):
+        self.max_ratio = max_ratio
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedges = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._requests += 1
+            if self._requests >= self.window:
+                # 周期性减半，使预算反映近期而非全部历史
+                self._requests //= 2
+                self._hedges //= 2
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._hedges + 1 > self.max_ratio * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+
+class Hedger:
+    """在线程池中执行主请求，超时未返回时按预算发起对冲请求"""
+
+    def __init__(self, max_workers: int, percentile: float, min_delay: float, default_delay: float,
+                 max_ratio: float, window: int, min_samples: int):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.latencies = LatencyWindow(window, min_samples)
+        self.budget = HedgeBudget(max_ratio, window)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0}
+
+    @classmethod
+    def from_config(cls) -> "Hedger":
+        return cls(
+            max_workers=config.HEDGE_MAX_WORKERS,
+            percentile=config.HEDGE_PERCENTILE,
+            min_delay=config.HEDGE_MIN_DELAY_SECONDS,
+            default_delay=config.HEDGE_DEFAULT_DELAY_SECONDS,
+            max_ratio=config.HEDGE_MAX_RATIO,
+            window=config.HEDGE_WINDOW,
+            min_samples=config.HEDGE_MIN_SAMPLES,
+        )
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def delay_for(self, stage: str) -> float:
+        observed = self.latencies.percentile(stage, self.percentile)
+        if observed is None:
+            return self.default_delay
+        return max(observed, self.min_delay)
+
+    def _launch(self, attempt: Callable[[threading.Event], Any]):
+        cancel = threading.Event()
+        # 复制 contextvars，使线程池中的调用仍挂在当前 trace 下
+        ctx = contextvars.copy_context()
+        return self._executor.submit(ctx.run, attempt, cancel), cancel
+
+    def run(self, stage: str, attempt: Callable[[threading.Event], Any]) -> Any:
+        """执行 attempt 并按需对冲，返回最先成功的结果；全部失败时抛出主请求的异常"""
+        self._count("calls")
+        self.budget.record_request()
+        start = time.monotonic()
+
+        primary, primary_cancel = self._launch(attempt)
+        attempts = {primary: primary_cancel}
+        done, _ = wait([primary], timeout=self.delay_for(stage))
+        if not done:
+            if self.budget.try_acquire():
+                self._count("hedged")
+                trace.get_current_span().set_attribute("llm.hedged", True)
+                hedge, hedge_cancel = self._launch(attempt)
+                attempts[hedge] = hedge_cancel
+            else:
+                self._count("budget_denied")
+
+        pending = set(attempts)
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = future
+                    break
+
+        for future, cancel in attempts.items():
+            if future is not winner:
+                cancel.set()
+                future.cancel()
+
+        if winner is None:
+            raise primary.exception()
+        if winner is not primary:
+            self._count("hedge_wins")
+        # 对冲获胜时主请求的真实延迟未知，记录已等待的时长作为下界
+        self.latencies.observe(stage, time.monotonic() - start)
+        return winner.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["hedge_rate"] = round(stats["hedged"] / stats["calls"], 4) if stats["calls"] else 0.0
+        return stats
@@ -0,0 +1,32 @@
+"""
+图片编码
+
+大模型接口要求图片以 data URL（data:<mime>;base64,<内容>）传入。后端通过 gRPC 传输原始字节，
+由此处一次性编码：按块写入预先分配的缓冲区，不产生完整大小的中间 Base64 副本，
+最终只生成一个 str（消息内容必须为字符串）。
+"""
+import binascii
+
+DEFAULT_MIME_TYPE = "image/jpeg"
+
+# 每块原始字节数，须为 3 的倍数，保证块与块之间无需填充
+_CHUNK_BYTES = 3 * 256 * 1024
+
+
+def encoded_length(size: int) -> int:
+    """size 字节编码后的 Base64 长度（含填充）"""
+    return (size + 2) // 3 * 4
+
+
+def to_data_url(data: bytes, mime_type: str = "") -> str:
+    """将图片原始字节编码为 data URL"""
+    prefix = f"data:{mime_type or DEFAULT_MIME_TYPE};base64,".encode("ascii")
+    view = memoryview(data)
+    buffer = bytearray(len(prefix) + encoded_length(len(view)))
+    buffer[:len(prefix)] = prefix
+    position = len(prefix)
+    for start in range(0, len(view), _CHUNK_BYTES):
+        chunk = binascii.b2a_base64(view[start:start + _CHUNK_BYTES], newline=False)
+        buffer[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    return buffer.decode("ascii")
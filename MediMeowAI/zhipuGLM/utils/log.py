@@ -0,0 +1,207 @@
+"""
+结构化日志
+
+- 每条日志输出为一行 JSON（LOG_FORMAT=text 时为可读文本），附带 request_id（后端提交ID）/ rpc / trace_id；
+- RPC 线程只把记录放入内存队列（QueueHandler），由 QueueListener 后台线程写 stdout 或文件，
+  队列满时丢弃并计数，不阻塞分析流程；
+- LOG_LEVEL 为全局级别，LOG_LEVELS 按模块覆盖（如 "utils.scheduler=DEBUG,httpx=WARNING"）；
+- DEBUG 记录按 LOG_DEBUG_SAMPLE_RATE 采样，单条记录可用 extra={"sample_rate": 1.0} 覆盖。
+"""
+import sys
+import copy
+import json
+import time
+import queue
+import random
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from opentelemetry import trace
+
+import config.config as config
+
+# 当前 RPC 的标识，由 RPC 方法设置，记录日志时自动附加
+_CONTEXT: Dict[str, ContextVar] = {
+    "request_id": ContextVar("request_id", default=None),
+    "rpc": ContextVar("rpc", default=None),
+}
+
+# LogRecord 的标准属性，其余属性视为 extra 字段输出
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+_QUEUE_HANDLER: Optional["DroppingQueueHandler"] = None
+# 进程级字段（如多进程模式下的工作进程编号），附加到本进程的全部日志
+_PROCESS_FIELDS: Dict[str, object] = {}
+
+# 在调用线程中格式化异常堆栈（traceback 对象不能留到后台线程再处理）
+_EXC_FORMATTER = logging.Formatter()
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程中附加上下文标识和 trace_id（进入队列之前）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, var in _CONTEXT.items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, var.get())
+        for key, value in _PROCESS_FIELDS.items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, value)
+        span_context = trace.get_current_span().get_span_context()
+        record.trace_id = format(span_context.trace_id, "032x") if span_context.is_valid else None
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """按比例采样 DEBUG 记录，避免高频调试事件淹没日志"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = getattr(record, "sample_rate", self.rate)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON"""
+
+    def __init__(self, service_name: str):
+        super().__init__()
+        self.service_name = service_name
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "service": self.service_name,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and value is not None:
+                entry[key] = value
+        # 异常与调用栈由 DroppingQueueHandler.prepare 在入队前格式化为文本
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """本地开发用的可读格式，上下文字段附在行尾"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RESERVED_ATTRS and value is not None
+        )
+        return f"{line} [{fields}]" if fields else line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录并计数，不阻塞调用线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """在调用线程中固定消息与异常文本，供后台线程格式化
+
+        标准库的 prepare 会把异常堆栈拼进 msg 并清空 exc_info，JSON 中无法单独取出堆栈；
+        这里只合并 args，堆栈文本保存在 exc_text 中，由格式化器输出为单独的字段。
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(service_name: str = "medimeow-ai") -> None:
+    """配置根日志器：RPC 线程 -> 队列 -> 后台线程输出；重复调用无副作用"""
+    global _LISTENER, _QUEUE_HANDLER
+    if _LISTENER is not None:
+        return
+
+    if config.LOG_FILE:
+        output = logging.FileHandler(config.LOG_FILE, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(service_name) if config.LOG_FORMAT == "json" else TextFormatter())
+
+    _QUEUE_HANDLER = DroppingQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_SIZE))
+    _QUEUE_HANDLER.addFilter(DebugSamplingFilter(config.LOG_DEBUG_SAMPLE_RATE))
+    _QUEUE_HANDLER.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [_QUEUE_HANDLER]
+    root.setLevel(config.LOG_LEVEL.upper())
+    for name, level in _parse_levels(config.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _LISTENER = logging.handlers.QueueListener(_QUEUE_HANDLER.queue, output, respect_handler_level=True)
+    _LISTENER.start()
+
+
+def shutdown_logging() -> None:
+    """停止后台线程并写出队列中剩余的记录"""
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+
+def reinit_after_fork(service_name: str = "medimeow-ai", **fields) -> None:
+    """在 fork 出的子进程中调用：父进程的输出线程不会复制到子进程，丢弃继承的监听器后重新配置，
+    fields 作为进程级字段附加到之后的每条日志"""
+    global _LISTENER
+    _LISTENER = None
+    _PROCESS_FIELDS.update(fields)
+    setup_logging(service_name)
+
+
+def dropped_records() -> int:
+    return _QUEUE_HANDLER.dropped if _QUEUE_HANDLER is not None else 0
+
+
+@contextmanager
+def log_context(**fields):
+    """在代码块内为日志附加上下文标识（如 RPC 的 request_id）"""
+    tokens = [(_CONTEXT[key], _CONTEXT[key].set(value)) for key, value in fields.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
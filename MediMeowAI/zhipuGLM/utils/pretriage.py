@@ -0,0 +1,239 @@
+"""
+科室预分诊
+
+科室选择错误原本要等三次 LLM 调用全部完成、在最终报告中发现"科室选择错误"后才能得知。
+预分诊在调用 LLM 之前，用 bge 向量比较患者描述与各科室质心（medical_docs 文档与分诊问卷
+选项的平均向量），所选科室明显不匹配时直接返回 DEPARTMENT_ERROR，只耗费一次本地向量计算。
+
+只拦截"明显"不匹配：所选科室的相似度排名靠后，且与最相似科室的差距超过阈值。
+其余请求照常进入 LLM 流程，并以 LLM 的结论统计预分诊的精确率与召回率。
+"""
+import os
+import re
+import glob
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import config.config as config
+import rag.rag_core as rag_core
+
+logger = logging.getLogger(__name__)
+
+# 问卷选项节点，如 "X1 --> X1a[A. 视力急剧下降+眼痛]"（与后端问卷导入使用的格式一致）
+_OPTION_PATTERN = re.compile(r"(\w+) --> \1[a-z]\[[A-Z]\.\s*(.+?)\]")
+# 问卷中的 "可能诊断" 条目，如 "- **眼部炎症**：急性结膜炎、角膜炎"
+_DIAGNOSIS_PATTERN = re.compile(r"^-\s*\*\*[^*]+\*\*\s*[：:]\s*(.+)$", re.MULTILINE)
+# 患者文本中的选项前缀，如 "A. "
+_OPTION_PREFIX = re.compile(r"^[A-Z][.．、]\s*")
+# 不提供分诊信息的回答
+_NEGATIVE_PREFIXES = ("无", "没有", "否", "不清楚", "不确定")
+# 患者文本中不参与比较的字段（科室名称本身会让描述偏向所选科室）
+_SKIPPED_FIELDS = {"就诊科室", "患者选择科室", "姓名", "性别", "年龄", "身高", "体重", "BMI", "BMI指数", "职业"}
+
+_DEPARTMENT_LINE = re.compile(r"就诊科室\s*[：:]\s*(\S+)")
+
+
+def _is_negative(answer: str) -> bool:
+    return answer.startswith(_NEGATIVE_PREFIXES) or "正常" in answer
+
+
+def _option_text(answer: str) -> str:
+    """去掉选项前缀，"+" 连接的症状组合改为顿号分隔"""
+    return _OPTION_PREFIX.sub("", answer.strip()).replace("+", "、")
+
+
+def selected_department(patient_text: str) -> str:
+    """从后端构造的患者文本中读取就诊科室（请求未携带 patient_department 时使用）"""
+    match = _DEPARTMENT_LINE.search(patient_text)
+    return match.group(1) if match else ""
+
+
+def complaint_text(patient_text: str) -> str:
+    """提取患者文本中可用于分诊的描述
+
+    跳过基本信息段落、题目文本（题目本身带有科室特征）和否定/正常的回答；
+    后端文本中 **主诉** 段落是问卷回答的摘录，有 **问卷回答** 段落时一并跳过。
+    """
+    has_answers = "**问卷回答**" in patient_text
+    section = ""
+    parts: List[str] = []
+    for raw_line in patient_text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith("**") and line.endswith("**"):
+            section = line.strip("*").strip()
+            continue
+        if section == "患者基本信息" or (has_answers and section == "主诉"):
+            continue
+        field, sep, value = line.partition("：")
+        if sep and field.strip() in _SKIPPED_FIELDS:
+            continue
+        answer = _option_text(value if sep else line)
+        if answer and not _is_negative(answer):
+            parts.append(answer)
+    return "\n".join(parts)
+
+
+def load_doc_samples(docs_dir: str) -> Dict[str, List[str]]:
+    """medical_docs 中按编号归属科室的文档全文"""
+    samples: Dict[str, List[str]] = {}
+    for path in sorted(glob.glob(os.path.join(docs_dir, "**", "*.txt"), recursive=True)):
+        department = rag_core.doc_department(path)
+        if department is None:
+            continue
+        with open(path, encoding="utf-8") as f:
+            text = f.read().strip()
+        if text:
+            samples.setdefault(department, []).append(text)
+    return samples
+
+
+def load_questionnaire_samples(questionnaire_dir: str) -> Dict[str, List[str]]:
+    """各科室分诊问卷中的有效选项与可能诊断"""
+    samples: Dict[str, List[str]] = {}
+    for path in sorted(glob.glob(os.path.join(questionnaire_dir, "*.md"))):
+        department = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        options = [_option_text(option) for _, option in _OPTION_PATTERN.findall(content)]
+        texts = [option for option in options if option and not _is_negative(option)]
+        texts.extend(match.strip() for match in _DIAGNOSIS_PATTERN.findall(content))
+        if texts:
+            samples[department] = texts
+    return samples
+
+
+class TriageResult:
+    """单次预分诊结果
+
+    ranking: [(科室, 余弦相似度)]，按相似度降序。
+    mismatch: 所选科室是否明显不匹配。
+    """
+
+    def __init__(self, selected: str, ranking: List[tuple], mismatch: bool, elapsed_ms: float):
+        self.selected = selected
+        self.ranking = ranking
+        self.mismatch = mismatch
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def suggested(self) -> str:
+        return self.ranking[0][0]
+
+    @property
+    def selected_rank(self) -> int:
+        return next(rank for rank, (department, _) in enumerate(self.ranking, 1) if department == self.selected)
+
+
+class DepartmentPreTriage:
+    """科室质心分类器
+
+    embeddings: 提供 embed_documents 的词嵌入模型（与向量库共用 bge 模型）。
+    samples: 科室 -> 样本文本列表，每个科室的质心为其样本向量的平均（再归一化）。
+    mode: enforce 拦截明显不匹配的请求；shadow 只记录，全部请求照常调用 LLM。
+    """
+
+    def __init__(self, embeddings, samples: Dict[str, List[str]], min_rank: int = 4, margin: float = 0.05,
+                 mode: str = "shadow"):
+        self._embeddings = embeddings
+        self.enforce = mode == "enforce"
+        self.min_rank = min_rank
+        self.margin = margin
+        self.departments = sorted(department for department, texts in samples.items() if texts)
+        texts = [text for department in self.departments for text in samples[department]]
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        centroids = []
+        offset = 0
+        for department in self.departments:
+            count = len(samples[department])
+            centroids.append(vectors[offset:offset + count].mean(axis=0))
+            offset += count
+        self._centroids = self._normalize(np.vstack(centroids))
+        self._lock = threading.Lock()
+        self._stats = {
+            "checked": 0, "skipped": 0, "flagged": 0, "llm_calls_saved": 0,
+            # 与 LLM 结论的比对：flagged_* 仅在 shadow 模式下产生（enforce 模式拦截的请求不再调用 LLM）
+            "flagged_llm_error": 0, "flagged_llm_success": 0,
+            "passed_llm_error": 0, "passed_llm_success": 0,
+        }
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+
+    @classmethod
+    def from_config(cls, embeddings) -> "DepartmentPreTriage":
+        samples = load_questionnaire_samples(config.QUESTIONNAIRE_DIRECTORY)
+        for department, texts in load_doc_samples(config.DOCS_DIRECTORY).items():
+            samples.setdefault(department, []).extend(texts)
+        triage = cls(embeddings, samples, min_rank=config.PRETRIAGE_MIN_RANK, margin=config.PRETRIAGE_MARGIN,
+                     mode=config.PRETRIAGE_MODE)
+        logger.info("科室预分诊已加载", extra={
+            "departments": len(triage.departments),
+            "samples": sum(len(texts) for texts in samples.values()),
+        })
+        return triage
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def rank(self, text: str) -> List[tuple]:
+        """文本与各科室质心的余弦相似度，按相似度降序"""
+        vector = self._normalize(np.asarray(self._embeddings.embed_documents([text])[0], dtype=np.float32))
+        scores = self._centroids @ vector
+        order = np.argsort(-scores)
+        return [(self.departments[i], float(scores[i])) for i in order]
+
+    def classify(self, patient_text: str, department: str = "") -> Optional[TriageResult]:
+        """判断所选科室是否明显不匹配；科室未知或没有可用描述时返回 None（交由 LLM 判断）"""
+        start = time.perf_counter()
+        department = department or selected_department(patient_text)
+        text = complaint_text(patient_text)
+        if department not in self.departments or not text:
+            with self._lock:
+                self._stats["skipped"] += 1
+            return None
+
+        ranking = self.rank(text)
+        result = TriageResult(department, ranking, False, 0.0)
+        selected_score = dict(ranking)[department]
+        result.mismatch = (result.selected_rank >= self.min_rank
+                           and ranking[0][1] - selected_score >= self.margin)
+        result.elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["checked"] += 1
+            self._stats["flagged"] += int(result.mismatch)
+            self._total_ms += result.elapsed_ms
+            self._max_ms = max(self._max_ms, result.elapsed_ms)
+        return result
+
+    def record_short_circuit(self, llm_calls: int) -> None:
+        """enforce 模式下拦截请求，记录省去的 LLM 调用次数"""
+        with self._lock:
+            self._stats["llm_calls_saved"] += llm_calls
+
+    def record_outcome(self, result: TriageResult, llm_department_error: bool) -> None:
+        """记录进入 LLM 流程的请求的最终结论，用于估计精确率与召回率"""
+        key = ("flagged" if result.mismatch else "passed") + ("_llm_error" if llm_department_error else "_llm_success")
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats: Dict[str, object] = {"mode": "enforce" if self.enforce else "shadow", **self._stats}
+            checked = self._stats["checked"]
+            stats["avg_ms"] = round(self._total_ms / checked, 2) if checked else 0.0
+            stats["max_ms"] = round(self._max_ms, 2)
+        # 以 LLM 结论为准的精确率与召回率；enforce 模式下被拦截的请求没有 LLM 结论，无法计算
+        stats["precision"] = stats["recall"] = None
+        if not self.enforce:
+            flagged_total = stats["flagged_llm_error"] + stats["flagged_llm_success"]
+            llm_errors = stats["flagged_llm_error"] + stats["passed_llm_error"]
+            stats["precision"] = round(stats["flagged_llm_error"] / flagged_total, 3) if flagged_total else None
+            stats["recall"] = round(stats["flagged_llm_error"] / llm_errors, 3) if llm_errors else None
+        return stats
@@ -0,0 +1,252 @@
+"""
+GLM 服务商调用的自适应并发控制（AIMD）
+
+所有对模型服务商的请求都经过同一个 AdaptiveLimiter：
+- 调用成功且延迟正常时，并发上限按“每轮 +1”加性增长（每次成功 +1/limit）；
+- 遇到 429 / 5xx / 连接错误或延迟突增时，并发上限乘性回退，且同一冷却窗口内只回退一次；
+  各阶段（keyword / stage1 / stage3）的生成长度差别很大，延迟基线按阶段分别维护；
+- 429 / 503 响应携带 Retry-After 时，在该时间之前暂停所有新请求；
+- 可重试错误按 Retry-After 或指数退避（带抖动）重试，重试次数用尽后向上抛出。
+
+客户端自带的重试需关闭（max_retries=0），否则限流信号会被 SDK 吞掉。
+"""
+import time
+import random
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import config.config as config
+import utils.scheduler as scheduler
+
+# 错误分类
+OUTCOME_OK = "ok"
+OUTCOME_THROTTLED = "throttled"      # 429
+OUTCOME_SERVER_ERROR = "server_error"  # 5xx / 连接错误 / 超时
+OUTCOME_FATAL = "fatal"              # 其他错误（4xx、解析失败等），不重试、不影响并发上限
+OUTCOME_CANCELLED = "cancelled"      # 调用方主动取消（如对冲请求的落败方），不影响并发上限
+
+_RETRYABLE = (OUTCOME_THROTTLED, OUTCOME_SERVER_ERROR)
+
+
+class CallCancelled(Exception):
+    """调用方主动取消了进行中的服务商调用"""
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    """解析 retry-after-ms / Retry-After（秒数或 HTTP 日期），返回秒数"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: BaseException) -> Tuple[str, Optional[float]]:
+    """根据异常判断错误类别，并提取 Retry-After（秒）
+
+    兼容 openai / zhipuai SDK 的异常：二者都在异常上携带 status_code 与 httpx 响应。
+    """
+    if isinstance(exc, CallCancelled):
+        return OUTCOME_CANCELLED, None
+    response = getattr(exc, "response", None)
+    status_code = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    retry_after = _parse_retry_after(getattr(response, "headers", None))
+
+    if status_code == 429:
+        return OUTCOME_THROTTLED, retry_after
+    if status_code is not None and status_code >= 500:
+        return OUTCOME_SERVER_ERROR, retry_after
+    if status_code is None and type(exc).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return OUTCOME_SERVER_ERROR, None
+    return OUTCOME_FATAL, None
+
+
+class AdaptiveLimiter:
+    """AIMD 自适应并发限制器"""
+
+    def __init__(self, name: str, initial_limit: float, min_limit: float, max_limit: float,
+                 backoff_ratio: float, latency_spike_factor: float, max_retries: int,
+                 acquire_timeout: float, default_retry_after: float):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_spike_factor = latency_spike_factor
+        self.max_retries = max_retries
+        self.acquire_timeout = acquire_timeout
+        self.default_retry_after = default_retry_after
+
+        self._cond = threading.Condition()
+        self._limit = float(initial_limit)
+        self._inflight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        # 各阶段的正常延迟基线（EWMA，秒），用于识别延迟突增
+        self._latency_ewma: Dict[str, float] = {}
+        self._stats = {"calls": 0, "ok": 0, "throttled": 0, "server_error": 0,
+                       "fatal": 0, "cancelled": 0, "retries": 0, "decreases": 0}
+
+    @classmethod
+    def from_config(cls, name: str = "glm") -> "AdaptiveLimiter":
+        return cls(
+            name,
+            initial_limit=config.PROVIDER_LIMIT_INITIAL,
+            min_limit=config.PROVIDER_LIMIT_MIN,
+            max_limit=config.PROVIDER_LIMIT_MAX,
+            backoff_ratio=config.PROVIDER_BACKOFF_RATIO,
+            latency_spike_factor=config.PROVIDER_LATENCY_SPIKE_FACTOR,
+            max_retries=config.PROVIDER_MAX_RETRIES,
+            acquire_timeout=config.PROVIDER_ACQUIRE_TIMEOUT,
+            default_retry_after=config.PROVIDER_DEFAULT_RETRY_AFTER,
+        )
+
+    @property
+    def limit(self) -> float:
+        return self._limit
+
+    # ---------------- 名额管理 ----------------
+
+    def _acquire(self, request_deadline: Optional[float] = None) -> float:
+        """获取一个调用名额，返回开始时刻（time.monotonic）；等待不超过请求截止时间"""
+        deadline = time.monotonic() + self.acquire_timeout
+        if request_deadline is not None:
+            deadline = min(deadline, request_deadline)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now >= self._paused_until and self._inflight < int(self._limit):
+                    self._inflight += 1
+                    self._stats["calls"] += 1
+                    return now
+                if now >= deadline:
+                    raise scheduler.SchedulerRejected(self.name, "模型服务并发名额等待超时")
+                wake_at = deadline
+                if self._paused_until > now:
+                    wake_at = min(wake_at, self._paused_until)
+                self._cond.wait(wake_at - now)
+
+    def _record(self, stage: str, started: float, outcome: str, retry_after: Optional[float] = None,
+                release: bool = True) -> None:
+        """记录一次调用结果并调整并发上限；release=False 时继续占用名额（流式读取）"""
+        latency = time.monotonic() - started
+        with self._cond:
+            if release:
+                self._inflight -= 1
+            self._stats[outcome] += 1
+            if outcome == OUTCOME_OK:
+                self._on_success(stage, latency)
+            elif outcome in _RETRYABLE:
+                self._decrease()
+                if outcome == OUTCOME_THROTTLED or retry_after is not None:
+                    pause = retry_after if retry_after is not None else self.default_retry_after
+                    self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self._cond.notify_all()
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _on_success(self, stage: str, latency: float) -> None:
+        baseline = self._latency_ewma.get(stage)
+        self._latency_ewma[stage] = latency if baseline is None else baseline * 0.9 + latency * 0.1
+        if baseline is not None and latency > baseline * self.latency_spike_factor:
+            # 延迟突增视为拥塞信号；突增同样按权重计入基线，服务商整体变慢后基线随之上移，不会持续回退
+            self._decrease()
+            return
+        self._limit = min(self.max_limit, self._limit + 1.0 / max(self._limit, 1.0))
+
+    def _decrease(self) -> None:
+        """乘性回退；同一批在途请求的失败只回退一次（冷却窗口取最慢阶段的延迟基线）"""
+        now = time.monotonic()
+        cooldown = max(self._latency_ewma.values()) if self._latency_ewma else self.default_retry_after
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+        self._stats["decreases"] += 1
+
+    # ---------------- 对外接口 ----------------
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return retry_after
+        return self.default_retry_after * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _run(self, fn: Callable[[], Any], hold: bool, deadline: Optional[float], stage: str) -> Any:
+        attempt = 0
+        while True:
+            started = self._acquire(deadline)
+            try:
+                result = fn()
+            except Exception as e:
+                outcome, retry_after = classify_error(e)
+                self._record(stage, started, outcome, retry_after)
+                if outcome not in _RETRYABLE:
+                    raise
+                if attempt >= self.max_retries:
+                    if outcome == OUTCOME_THROTTLED:
+                        raise scheduler.SchedulerRejected(self.name, "模型服务持续限流") from e
+                    raise
+                delay = self._backoff_delay(attempt, retry_after)
+                # 退避后已超过请求截止时间的不再重试
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                with self._cond:
+                    self._stats["retries"] += 1
+                time.sleep(delay)
+                attempt += 1
+                continue
+            # 流式调用只以建立连接的耗时作为延迟信号
+            self._record(stage, started, OUTCOME_OK, release=not hold)
+            return result
+
+    def call(self, fn: Callable[[], Any], deadline: Optional[float] = None, stage: str = "default") -> Any:
+        """在限流器控制下执行一次服务商调用（含重试）；deadline 为请求截止时间（time.monotonic），
+        stage 决定与哪个阶段的延迟基线比较"""
+        return self._run(fn, hold=False, deadline=deadline, stage=stage)
+
+    @contextmanager
+    def stream(self, create_fn: Callable[[], Any], deadline: Optional[float] = None, stage: str = "default"):
+        """创建流式响应并在整个读取过程中占用名额
+
+        仅在建立连接阶段重试；已开始输出后出错直接抛出，避免重复输出。
+        """
+        response = self._run(create_fn, hold=True, deadline=deadline, stage=stage)
+        try:
+            yield response
+        except Exception as e:
+            outcome, _ = classify_error(e)
+            if outcome == OUTCOME_SERVER_ERROR:
+                # 输出中途断开同样视为拥塞信号
+                with self._cond:
+                    self._decrease()
+            raise
+        finally:
+            self._release_slot()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._stats,
+                "limit": round(self._limit, 2),
+                "inflight": self._inflight,
+                "paused_for_s": round(max(self._paused_until - time.monotonic(), 0.0), 2),
+                "latency_baseline_ms": {stage: round(ewma * 1000, 1) for stage, ewma in self._latency_ewma.items()},
+            }
@@ -0,0 +1,61 @@
+"""
+最终报告关键信息提取
+
+FINAL_REPORT_PROMPT 要求模型按固定结构输出 Markdown：每个段落以 "### N. 【标题 (English)】" 开头，
+段落内为 "* **条目**：内容" 形式的条目。报告生成后在 AI 服务端解析一次，填入 AnalysisReport.key_info，
+后端直接读取类型化字段，无需再解析 Markdown。
+"""
+import re
+from typing import Dict, List
+
+# 段落标题行，如 "### 1. 【患者主诉 (Subjective)】"
+_SECTION_PATTERN = re.compile(r"^#{1,4}\s*\d+\.\s*【([^】(（]+)")
+# 条目行，如 "* **核心症状**：咽喉疼痛"
+_ITEM_PATTERN = re.compile(r"^[*\-]\s*\*\*([^*]+)\*\*\s*[：:]\s*(.*)$")
+
+# key_info 字段 -> 依次取用的条目名称（多个条目时以 "；" 连接）
+KEY_INFO_ITEMS: Dict[str, List[str]] = {
+    "chief_complaint": ["核心症状"],
+    "key_symptoms": ["症状细节"],
+    "image_summary": ["图像主体识别", "视觉特征精细描述"],
+    "important_notes": ["客观风险提示"],
+    "risk_level": ["风险等级"],
+    "suggested_department": ["建议科室"],
+}
+
+
+def _clean(value: str) -> str:
+    """去掉模型照抄的占位方括号和 Markdown 强调符号"""
+    value = value.strip().replace("**", "")
+    if value.startswith("[") and value.endswith("]"):
+        value = value[1:-1].strip()
+    return value
+
+
+def parse_report_items(report_text: str) -> Dict[str, str]:
+    """解析报告中的全部条目，返回 条目名称 -> 内容；条目内容跨行时合并"""
+    items: Dict[str, str] = {}
+    current = None
+    for raw_line in report_text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        if _SECTION_PATTERN.match(line):
+            current = None
+            continue
+        match = _ITEM_PATTERN.match(line)
+        if match:
+            current = match.group(1).strip()
+            items[current] = _clean(match.group(2))
+        elif current is not None:
+            items[current] = f"{items[current]} {_clean(line)}".strip()
+    return items
+
+
+def extract_key_info(report_text: str) -> Dict[str, str]:
+    """从最终报告中提取 key_info 各字段；报告中缺少的条目为空字符串"""
+    items = parse_report_items(report_text)
+    return {
+        field: "；".join(items[name] for name in names if items.get(name))
+        for field, names in KEY_INFO_ITEMS.items()
+    }
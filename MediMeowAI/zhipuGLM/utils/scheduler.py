@@ -0,0 +1,221 @@
+"""
+LLM 调用准入控制与优先级调度
+
+每个阶段（stage1 / keyword / stage3）有独立的并发上限和有界等待队列：
+- 有空闲名额且无人排队时直接放行；
+- 否则按优先级（交互式优先于批量）排队，超过等待截止时间即放弃；
+- 队列已满时立即拒绝，让调用方尽快走降级逻辑，而不是长时间挂起。
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import config.config as config
+import utils.cancellation as cancellation
+
+# 与 proto 中 Priority 枚举取值一致
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BATCH: "batch",
+}
+
+
+class SchedulerRejected(Exception):
+    """请求未获准入（队列已满或等待超时）"""
+
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("granted", "abandoned")
+
+    def __init__(self):
+        self.granted = False
+        self.abandoned = False
+
+
+class StageLimiter:
+    """单个阶段的并发限制器：固定并发上限 + 优先级有界等待队列"""
+
+    def __init__(self, stage: str, max_concurrent: int, max_queue: int, batch_queue_share: float):
+        self.stage = stage
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_batch_queue = int(max_queue * batch_queue_share)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "abandoned_cancelled": 0}
+
+    def acquire(self, priority: int, deadline: float,
+                token: Optional[cancellation.CancelToken] = None) -> float:
+        """获取一个执行名额，返回排队耗时（秒）；无法获得时抛出 SchedulerRejected
+
+        token 被取消时放弃排队并抛出 cancellation.AnalysisAborted。
+        """
+        start = time.monotonic()
+        with self._cond:
+            total_queued = sum(self._queued.values())
+            if self._active < self.max_concurrent and total_queued == 0:
+                self._active += 1
+                self._stats["admitted"] += 1
+                return 0.0
+
+            if total_queued >= self.max_queue or (
+                priority == PRIORITY_BATCH and self._queued[PRIORITY_BATCH] >= self.max_batch_queue
+            ):
+                self._stats["rejected_queue_full"] += 1
+                raise SchedulerRejected(self.stage, "等待队列已满")
+
+            waiter = _Waiter()
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+            self._queued[priority] += 1
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                cancelled = token is not None and token.cancelled
+                if remaining <= 0 or cancelled:
+                    # 留在堆中，由 release 跳过
+                    waiter.abandoned = True
+                    self._queued[priority] -= 1
+                    if cancelled:
+                        self._stats["abandoned_cancelled"] += 1
+                        raise cancellation.AnalysisAborted(token.reason, self.stage)
+                    self._stats["rejected_timeout"] += 1
+                    raise SchedulerRejected(self.stage, "排队等待超时")
+                # 有取消凭证时分段等待，以便及时发现客户端取消
+                self._cond.wait(min(remaining, 0.25) if token is not None else remaining)
+            self._stats["admitted"] += 1
+            return time.monotonic() - start
+
+    def release(self) -> None:
+        """归还名额；有等待者时直接移交给优先级最高的等待者"""
+        with self._cond:
+            while self._heap:
+                priority, _, waiter = heapq.heappop(self._heap)
+                if waiter.abandoned:
+                    continue
+                self._queued[priority] -= 1
+                waiter.granted = True
+                self._cond.notify_all()
+                return
+            self._active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                **self._stats,
+                "active": self._active,
+                "queued_interactive": self._queued[PRIORITY_INTERACTIVE],
+                "queued_batch": self._queued[PRIORITY_BATCH],
+            }
+
+
+class Ticket:
+    """单个请求的准入凭证：记录优先级、截止时间、取消凭证和累计排队耗时
+
+    waited_ms 按顺序执行的各阶段累加；同一阶段内并行的调用通过 parallel() 申请名额，排队耗时取最大值。
+    """
+
+    def __init__(self, scheduler: "AdmissionScheduler", priority: int, deadline: Optional[float],
+                 token: Optional[cancellation.CancelToken] = None):
+        self._scheduler = scheduler
+        self.priority = priority
+        self.deadline = deadline
+        self.token = token
+        self.waited_ms = 0.0
+        self._lock = threading.Lock()
+
+    def _acquire(self, limiter: StageLimiter) -> float:
+        """获取 limiter 的名额，返回排队耗时（毫秒）"""
+        max_wait = config.SCHEDULER_MAX_WAIT_SECONDS[PRIORITY_NAMES.get(self.priority, "interactive")]
+        wait_deadline = time.monotonic() + max_wait
+        if self.deadline is not None:
+            wait_deadline = min(wait_deadline, self.deadline)
+        return limiter.acquire(self.priority, wait_deadline, self.token) * 1000
+
+    def _add_wait(self, waited_ms: float) -> None:
+        with self._lock:
+            self.waited_ms += waited_ms
+
+    @contextmanager
+    def slot(self, stage: str):
+        limiter = self._scheduler.limiters[stage]
+        self._add_wait(self._acquire(limiter))
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    @contextmanager
+    def parallel(self, stage: str):
+        """在 stage 并行发起多次调用：每次调用使用返回对象的 slot()
+
+        本请求同时占用的名额不超过该阶段并发上限的 SCHEDULER_REQUEST_STAGE_SHARE，避免单个请求占满阶段；
+        退出时将组内排队耗时的最大值计入 waited_ms（并行的等待相互重叠，求和会超过实际耗时）。
+        """
+        group = ParallelSlots(self, stage)
+        try:
+            yield group
+        finally:
+            self._add_wait(group.waited_ms)
+
+
+class ParallelSlots:
+    """同一请求在单个阶段内并行的一组调用（由 Ticket.parallel 创建）"""
+
+    def __init__(self, ticket: Ticket, stage: str):
+        self._ticket = ticket
+        self._limiter = ticket._scheduler.limiters[stage]
+        self.max_parallel = max(1, int(self._limiter.max_concurrent * config.SCHEDULER_REQUEST_STAGE_SHARE))
+        self._semaphore = threading.Semaphore(self.max_parallel)
+        self._lock = threading.Lock()
+        self.waited_ms = 0.0
+
+    @contextmanager
+    def slot(self):
+        # 等待本请求的并行份额不计入排队耗时，只统计在调度器中的排队
+        with self._semaphore:
+            waited_ms = self._ticket._acquire(self._limiter)
+            with self._lock:
+                self.waited_ms = max(self.waited_ms, waited_ms)
+            try:
+                yield
+            finally:
+                self._limiter.release()
+
+
+class AdmissionScheduler:
+    """按阶段管理 StageLimiter"""
+
+    def __init__(self, stage_concurrency: Dict[str, int], max_queue: int, batch_queue_share: float):
+        self.limiters = {
+            stage: StageLimiter(stage, limit, max_queue, batch_queue_share)
+            for stage, limit in stage_concurrency.items()
+        }
+
+    @classmethod
+    def from_config(cls) -> "AdmissionScheduler":
+        return cls(
+            config.SCHEDULER_STAGE_CONCURRENCY,
+            config.SCHEDULER_MAX_QUEUE,
+            config.SCHEDULER_BATCH_QUEUE_SHARE
+        )
+
+    def ticket(self, priority: int, deadline: Optional[float] = None,
+               token: Optional[cancellation.CancelToken] = None) -> Ticket:
+        """deadline 为 time.monotonic() 时间戳；None 表示仅受优先级最长等待时间约束"""
+        return Ticket(self, priority, deadline, token)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {stage: limiter.stats() for stage, limiter in self.limiters.items()}
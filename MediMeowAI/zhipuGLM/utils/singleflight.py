@@ -0,0 +1,95 @@
+"""
+同一提交的并发分析去重（single-flight）
+
+后端重试、降级重分析或多个后端进程可能同时为同一提交（request_id）发起分析。
+同一键的请求同时只运行一条分析流程：第一个请求执行，其余请求等待并共享其结果，
+避免重复调用 LLM。
+
+等待方按自己的取消凭证等待；执行方因自身客户端取消或超时而中止时，
+仍在等待的请求会重新竞争执行（已完成阶段可从检查点恢复）。
+"""
+import threading
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+import utils.cancellation as cancellation
+
+T = TypeVar("T")
+
+# 等待执行结果时检查取消状态的间隔（秒）
+_WAIT_SLICE_SECONDS = 0.25
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并并发调用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {"executed": 0, "shared": 0, "leader_aborted": 0}
+
+    def do(self, key: str, fn: Callable[[], T],
+           token: Optional[cancellation.CancelToken] = None) -> Tuple[T, bool]:
+        """执行 fn 或等待同键的进行中调用，返回 (结果, 是否为共享结果)"""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self._stats["executed"] += 1
+                else:
+                    call.waiters += 1
+
+            if leader:
+                return self._execute(key, call, fn), False
+
+            try:
+                self._wait(call, token)
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+            if isinstance(call.error, cancellation.AnalysisAborted):
+                # 执行方的客户端已放弃，结果不代表本请求：重新竞争执行
+                with self._lock:
+                    self._stats["leader_aborted"] += 1
+                continue
+            if call.error is not None:
+                raise call.error
+            with self._lock:
+                self._stats["shared"] += 1
+            return call.result, True
+
+    def _execute(self, key: str, call: _Call, fn: Callable[[], T]) -> T:
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @staticmethod
+    def _wait(call: _Call, token: Optional[cancellation.CancelToken]) -> None:
+        while not call.done.wait(_WAIT_SLICE_SECONDS if token is not None else None):
+            reason = token.aborted_reason()
+            if reason is not None:
+                cancellation.ABORT_STATS.record_request(reason, "singleflight")
+                raise cancellation.AnalysisAborted(reason, "singleflight")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+            stats["waiting"] = sum(call.waiters for call in self._calls.values())
+        return stats
@@ -0,0 +1,58 @@
+"""
+流式输出合并
+
+LLM 流式响应每个 token 一个增量，逐个转发会产生大量很小的 gRPC 消息（HTTP/2 帧）。
+ChunkCoalescer 将增量缓存起来，累计字节数达到阈值或距缓存中第一个增量超过时间窗口时
+合并为一条消息发送。
+
+时间窗口在收到下一个增量时检查：生成速度远快于窗口（通常每秒数十个 token）时，
+消息间隔约等于窗口；生成停顿时已缓存内容在下一个增量到达或流结束时发送。
+"""
+import time
+from typing import List, Optional
+
+import config.config as config
+
+
+class ChunkCoalescer:
+    """按字节阈值或时间窗口合并文本增量；阈值为 0 表示不按该条件发送，两者均为 0 时逐个透传"""
+
+    def __init__(self, max_bytes: int, window_ms: float):
+        self.max_bytes = max_bytes
+        self.window = window_ms / 1000
+        self._passthrough = max_bytes <= 0 and window_ms <= 0
+        self._parts: List[str] = []
+        self._bytes = 0
+        self._first_at = 0.0
+
+        # 统计
+        self.deltas = 0
+        self.messages = 0
+
+    @classmethod
+    def from_config(cls) -> "ChunkCoalescer":
+        return cls(config.STREAM_COALESCE_BYTES, config.STREAM_COALESCE_WINDOW_MS)
+
+    def add(self, text: str) -> Optional[str]:
+        """加入一个增量；达到发送条件时返回合并后的文本，否则返回 None"""
+        self.deltas += 1
+        now = time.perf_counter()
+        if not self._parts:
+            self._first_at = now
+        self._parts.append(text)
+        self._bytes += len(text.encode("utf-8"))
+        if (self._passthrough
+                or (self.max_bytes > 0 and self._bytes >= self.max_bytes)
+                or (self.window > 0 and now - self._first_at >= self.window)):
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """取出全部缓存内容；没有缓存时返回 None"""
+        if not self._parts:
+            return None
+        text = "".join(self._parts)
+        self._parts = []
+        self._bytes = 0
+        self.messages += 1
+        return text
@@ -0,0 +1,101 @@
+"""
+OpenTelemetry 链路追踪
+
+为 gRPC 服务端与三阶段分析流程创建 span，并从 gRPC metadata 中还原后端传入的
+trace 上下文，使一次提交从后端请求到每次 GLM 调用都位于同一条 trace 中。
+"""
+import os
+import inspect
+import threading
+import functools
+from typing import Iterable, Optional, Sequence, Tuple
+
+from opentelemetry import trace, propagate
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider, ReadableSpan
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+    SpanExportResult,
+)
+
+import config.config as config
+
+_TRACER_NAME = "medimeow.ai"
+_init_lock = threading.Lock()
+_initialized = False
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """将 span 以 JSON Lines 格式追加写入本地文件（本地 Collector 替代）"""
+
+    def __init__(self, file_path: str):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self._file = open(file_path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _create_exporter() -> Optional[SpanExporter]:
+    exporter = config.TRACING_EXPORTER.lower()
+    if exporter == "file":
+        return JsonLinesSpanExporter(config.TRACING_FILE)
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter(endpoint=config.OTLP_ENDPOINT, insecure=True)
+    if exporter == "console":
+        return ConsoleSpanExporter()
+    return None
+
+
+def init_tracing(service_name: str = "medimeow-ai") -> None:
+    """初始化全局 TracerProvider（重复调用无副作用）"""
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        exporter = _create_exporter()
+        if exporter is not None:
+            provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _initialized = True
+
+
+def get_tracer() -> trace.Tracer:
+    return trace.get_tracer(_TRACER_NAME)
+
+
+def extract_context(metadata: Optional[Iterable[Tuple[str, str]]]):
+    """从 gRPC invocation metadata 中提取上游 trace 上下文"""
+    carrier = {key: value for key, value in (metadata or ()) if isinstance(value, str)}
+    return propagate.extract(carrier)
+
+
+def traced(span_name: str):
+    """为函数创建 span 的装饰器；生成器函数的 span 覆盖整个迭代过程"""
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                with get_tracer().start_as_current_span(span_name):
+                    yield from func(*args, **kwargs)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_tracer().start_as_current_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
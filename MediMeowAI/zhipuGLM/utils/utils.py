@@ -1,11 +1,16 @@
 import os
 import base64
+import functools
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_openai import ChatOpenAI
 import config.config as config
 
+@functools.lru_cache(maxsize=1)
 def get_bge_embedding_model():
-    """配置 BAAI/bge-small-zh 本地词嵌入模型 (零成本)"""
+    """配置 BAAI/bge-small-zh 本地词嵌入模型 (零成本)
+
+    进程内只加载一次：多进程模式下父进程加载后 fork，工作进程直接复用该实例（模型权重写时复制共享）。
+    """
     model_name = config.BGE_EMBEDDING_MODEL_NAME
     model_kwargs = {'device': 'cpu'}
     encode_kwargs = {'normalize_embeddings': True}
@@ -20,11 +25,13 @@ def get_bge_embedding_model():
 def get_glm4_llm():
     """配置GLM-4.1V-Thinking-Flash 模型"""
     return ChatOpenAI(
-        model="glm-4.1v-thinking-flash",  
+        model=config.LLM_MODEL_NAME,
         temperature=config.TEMPERATURE,
         openai_api_base=config.GLM_API_BASE,
         openai_api_key=os.environ["GLM_API_KEY"],
-        max_tokens=config.MAX_TOKENS
+        max_tokens=config.MAX_TOKENS,
+        # 重试由 provider_limiter 统一处理，SDK 内置重试会吞掉 429 信号
+        max_retries=0
     )
 
 def image_to_base64(image_path: str) -> str:
@@ -0,0 +1,39 @@
+"""Add ai_retry_backlog table
+
+Revision ID: 003
+Revises: 002
+Create Date: 2025-02-10
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # AI 服务不可用时降级的提交进入重试队列，服务恢复后由后台任务重新分析
+    op.create_table(
+        'ai_retry_backlog',
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('submission_id', sa.String(36), sa.ForeignKey('questionnaire_submissions.id'), nullable=False),
+        sa.Column('status', sa.String(20), nullable=True, comment='状态 (pending/failed)'),
+        sa.Column('attempts', sa.Integer(), nullable=True, comment='已重试次数'),
+        sa.Column('last_error', sa.Text(), nullable=True, comment='最近一次失败原因'),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True, comment='下次重试时间'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint('submission_id', name='uq_ai_retry_backlog_submission_id'),
+    )
+    op.create_index('ix_ai_retry_backlog_status', 'ai_retry_backlog', ['status'])
+    op.create_index('ix_ai_retry_backlog_next_attempt_at', 'ai_retry_backlog', ['next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_ai_retry_backlog_next_attempt_at', table_name='ai_retry_backlog')
+    op.drop_index('ix_ai_retry_backlog_status', table_name='ai_retry_backlog')
+    op.drop_table('ai_retry_backlog')
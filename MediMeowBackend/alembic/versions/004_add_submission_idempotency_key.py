@@ -0,0 +1,33 @@
+"""Add idempotency_key to questionnaire_submissions
+
+Revision ID: 004
+Revises: 003
+Create Date: 2025-02-14
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 客户端重试或重复点击时携带相同的 Idempotency-Key，后端据此返回原提交而不重复创建
+    op.add_column(
+        'questionnaire_submissions',
+        sa.Column('idempotency_key', sa.String(64), nullable=True, comment='客户端提供的幂等键 (Idempotency-Key)')
+    )
+    op.create_unique_constraint(
+        'uq_submissions_user_idempotency_key',
+        'questionnaire_submissions',
+        ['user_id', 'idempotency_key']
+    )
+
+
+def downgrade():
+    op.drop_constraint('uq_submissions_user_idempotency_key', 'questionnaire_submissions', type_='unique')
+    op.drop_column('questionnaire_submissions', 'idempotency_key')
@@ -0,0 +1,64 @@
+"""Add department category and department_aliases table
+
+Revision ID: 005
+Revises: 004
+Create Date: 2025-02-18
+
+"""
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.department_taxonomy import DEFAULT_DEPARTMENT_TAXONOMY
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 科室所属大类与别名用于判断AI建议科室与用户所选科室是否匹配
+    op.add_column(
+        'departments',
+        sa.Column('category', sa.String(50), nullable=True, comment='所属大类（如 内科、外科），同一大类的科室视为匹配')
+    )
+    op.create_table(
+        'department_aliases',
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('department_id', sa.String(36), sa.ForeignKey('departments.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('alias', sa.String(100), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.UniqueConstraint('alias', name='uq_department_aliases_alias'),
+    )
+    op.create_index('ix_department_aliases_department_id', 'department_aliases', ['department_id'])
+
+    # 为已有科室写入默认大类和别名
+    bind = op.get_bind()
+    departments = bind.execute(sa.text("SELECT id, department_name FROM departments")).all()
+    aliases_table = sa.table(
+        'department_aliases',
+        sa.column('id', sa.String),
+        sa.column('department_id', sa.String),
+        sa.column('alias', sa.String),
+    )
+    rows = []
+    for department_id, name in departments:
+        if name not in DEFAULT_DEPARTMENT_TAXONOMY:
+            continue
+        category, aliases = DEFAULT_DEPARTMENT_TAXONOMY[name]
+        bind.execute(
+            sa.text("UPDATE departments SET category = :category WHERE id = :id"),
+            {"category": category, "id": department_id}
+        )
+        rows.extend({"id": str(uuid.uuid4()), "department_id": department_id, "alias": alias} for alias in aliases)
+    if rows:
+        op.bulk_insert(aliases_table, rows)
+
+
+def downgrade():
+    op.drop_index('ix_department_aliases_department_id', table_name='department_aliases')
+    op.drop_table('department_aliases')
+    op.drop_column('departments', 'category')
@@ -1,17 +1,20 @@
 from app.database import Base
 from app.models.user import User
 from app.models.doctor import Doctor
-from app.models.department import Department
+from app.models.department import Department, DepartmentAlias
 from app.models.questionnaire import Questionnaire, QuestionnaireSubmission, UploadedFile
 from app.models.medical_record import MedicalRecord
+from app.models.ai_retry import AIRetryTask
 
 __all__ = [
     "Base",
     "User",
     "Doctor",
     "Department",
+    "DepartmentAlias",
     "Questionnaire",
     "QuestionnaireSubmission",
     "UploadedFile",
-    "MedicalRecord"
+    "MedicalRecord",
+    "AIRetryTask"
 ]
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Integer
+from sqlalchemy.sql import func
+from app.database import Base
+import uuid
+
+
+class AIRetryTask(Base):
+    """AI 分析重试队列（AI 服务不可用时降级的提交，恢复后重新分析）"""
+    __tablename__ = "ai_retry_backlog"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    submission_id = Column(String(36), ForeignKey("questionnaire_submissions.id"), nullable=False, unique=True)
+
+    status = Column(String(20), default="pending", index=True, comment="状态 (pending/failed)")
+    attempts = Column(Integer, default=0, comment="已重试次数")
+    last_error = Column(Text, nullable=True, comment="最近一次失败原因")
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), index=True, comment="下次重试时间")
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
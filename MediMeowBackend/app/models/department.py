@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime
+from sqlalchemy import Column, String, DateTime, ForeignKey
 from sqlalchemy.sql import func
 from app.database import Base
 import uuid
@@ -10,7 +10,19 @@ class Department(Base):
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     department_name = Column(String(100), nullable=False, unique=True)
+    category = Column(String(50), nullable=True, comment="所属大类（如 内科、外科），同一大类的科室视为匹配")
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     deleted_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class DepartmentAlias(Base):
+    """科室别名表（AI建议科室与用户所选科室匹配时使用）"""
+    __tablename__ = "department_aliases"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    department_id = Column(String(36), ForeignKey("departments.id", ondelete="CASCADE"), nullable=False, index=True)
+    alias = Column(String(100), nullable=False, unique=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
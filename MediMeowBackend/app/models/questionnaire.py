@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Text, JSON, Integer
+from sqlalchemy import Column, String, DateTime, Text, JSON, Integer, UniqueConstraint
 from sqlalchemy.sql import func
 from app.database import Base
 import uuid
@@ -24,9 +24,14 @@ class Questionnaire(Base):
 class QuestionnaireSubmission(Base):
     """问卷提交表"""
     __tablename__ = "questionnaire_submissions"
+    __table_args__ = (
+        # 同一用户的同一幂等键只能对应一次提交（NULL 不受约束）
+        UniqueConstraint("user_id", "idempotency_key", name="uq_submissions_user_idempotency_key"),
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String(36), nullable=False)
+    idempotency_key = Column(String(64), nullable=True, comment="客户端提供的幂等键 (Idempotency-Key)")
     questionnaire_id = Column(String(64), nullable=False)
     department_id = Column(String(36), nullable=False)
     answers = Column(JSON, nullable=False)  # 答案数据
@@ -2,10 +2,12 @@ from app.routers.user import router as user_router
 from app.routers.doctor import router as doctor_router
 from app.routers.questionnaire import router as questionnaire_router
 from app.routers.department import router as department_router
+from app.routers.admin import router as admin_router
 
 __all__ = [
     "user_router",
     "doctor_router",
     "questionnaire_router",
-    "department_router"
+    "department_router",
+    "admin_router"
 ]
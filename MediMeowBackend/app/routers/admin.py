@@ -0,0 +1,149 @@
+from fastapi import APIRouter, Depends, Query
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from app.database import get_db
+from app.models.questionnaire import QuestionnaireSubmission
+from app.models.department import Department
+from app.services.ai_service import AIService, AI_CIRCUIT_BREAKER
+from app.services.ai_retry import AI_RETRY_WORKER
+from app.utils import (
+    get_current_doctor,
+    success_response,
+    error_response
+)
+
+router = APIRouter(prefix="/admin", tags=["管理模块"])
+
+# 与 AnalysisReport.timings 字段保持一致
+TIMING_FIELDS = [
+    "queue_wait_ms",
+    "stage1_ms",
+    "keyword_ms",
+    "vector_search_ms",
+    "stage3_ms",
+    "total_ms",
+    "pretriage_ms",
+]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """线性插值百分位数（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def _summarize(values: List[float]) -> Dict[str, float]:
+    """计算一组耗时的 p50/p95/p99/max"""
+    values = sorted(values)
+    return {
+        "p50": round(_percentile(values, 50), 1),
+        "p95": round(_percentile(values, 95), 1),
+        "p99": round(_percentile(values, 99), 1),
+        "max": round(values[-1], 1) if values else 0.0,
+    }
+
+
+@router.get("/ai-timings")
+async def get_ai_timing_stats(
+    hours: int = Query(24, ge=1, le=720, description="统计时间窗口（小时）"),
+    department_id: Optional[str] = Query(None, description="科室ID，不传则统计所有科室"),
+    current_doctor: dict = Depends(get_current_doctor),
+    db: Session = Depends(get_db)
+):
+    """按科室统计时间窗口内 AI 分析各阶段耗时的百分位数"""
+    since = datetime.now() - timedelta(hours=hours)
+
+    query = db.query(
+        QuestionnaireSubmission.department_id,
+        QuestionnaireSubmission.ai_result
+    ).filter(
+        QuestionnaireSubmission.submit_time >= since,
+        QuestionnaireSubmission.ai_result.isnot(None)
+    )
+    if department_id:
+        query = query.filter(QuestionnaireSubmission.department_id == department_id)
+
+    # department_id -> {"samples": {stage: [ms, ...]}, "status_counts": {...}}
+    grouped: Dict[str, dict] = {}
+    for dept_id, ai_result in query.all():
+        group = grouped.setdefault(dept_id, {
+            "samples": {field: [] for field in TIMING_FIELDS},
+            "status_counts": {}
+        })
+        status = ai_result.get("status", "unknown")
+        group["status_counts"][status] = group["status_counts"].get(status, 0) + 1
+
+        # 降级结果没有实测耗时，不计入百分位统计
+        timings = ai_result.get("timings")
+        if not timings:
+            continue
+        for field in TIMING_FIELDS:
+            if field in timings:
+                group["samples"][field].append(float(timings[field]))
+
+    department_names = {
+        dept.id: dept.department_name
+        for dept in db.query(Department).filter(Department.id.in_(list(grouped.keys()))).all()
+    } if grouped else {}
+
+    departments = []
+    for dept_id, group in grouped.items():
+        departments.append({
+            "department_id": dept_id,
+            "department_name": department_names.get(dept_id, "未知科室"),
+            "sample_count": len(group["samples"]["total_ms"]),
+            "status_counts": group["status_counts"],
+            "timings": {
+                field: _summarize(values)
+                for field, values in group["samples"].items()
+                if values
+            }
+        })
+    departments.sort(key=lambda d: d["sample_count"], reverse=True)
+
+    return success_response(
+        data={
+            "window_hours": hours,
+            "since": since.strftime("%Y-%m-%d %H:%M:%S"),
+            "departments": departments
+        }
+    )
+
+
+@router.get("/ai-service")
+async def get_ai_service_status(
+    current_doctor: dict = Depends(get_current_doctor),
+    db: Session = Depends(get_db)
+):
+    """AI 服务熔断器状态、降级重试队列概况，以及 AI 服务端的调度与取消/超时统计"""
+    return success_response(
+        data={
+            "circuit_breaker": AI_CIRCUIT_BREAKER.stats(),
+            "retry_backlog": AI_RETRY_WORKER.stats(db),
+            "ai_server": AIService.get_service_stats()
+        }
+    )
+
+
+@router.post("/ai-service/knowledge-base/reload")
+async def reload_ai_knowledge_base(
+    wait: bool = Query(False, description="是否等待重建、校验与切换完成"),
+    current_doctor: dict = Depends(get_current_doctor)
+):
+    """重建 AI 服务的 medical_docs 知识库，校验通过后原子切换，进行中的分析不受影响"""
+    result = await run_in_threadpool(
+        AIService.reload_knowledge_base, wait, f"管理接口（医生 {current_doctor['user_id']}）"
+    )
+    if "error" in result:
+        return error_response(code="10017", msg=f"AI服务不可达: {result['error']}")
+    if not result["ok"]:
+        return error_response(code="10018", msg=f"知识库重建未完成: {result['message']}")
+    return success_response(msg=result["message"], data=result["knowledge_base"])
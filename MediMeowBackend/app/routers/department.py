@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, Body
 from sqlalchemy.orm import Session
 from app.database import get_db
-from app.models.department import Department
+from app.models.department import Department, DepartmentAlias
 from app.schemas.department import DepartmentCreate
+from app.services.department_taxonomy import DEPARTMENT_TAXONOMY
 from app.utils import (
     get_current_user,
     success_response,
@@ -12,6 +13,30 @@ from app.utils import (
 router = APIRouter(prefix="/departments", tags=["科室模块"])
 
 
+def _clean_aliases(aliases, department_name: str) -> list:
+    """去除空白、重复以及与科室名称相同的别名"""
+    cleaned = []
+    for alias in aliases or []:
+        alias = alias.strip()
+        if alias and alias != department_name and alias not in cleaned:
+            cleaned.append(alias)
+    return cleaned
+
+
+def _alias_taken(db: Session, aliases: list, department_id: str = None) -> bool:
+    """别名是否已被其他科室使用（作为别名或科室名称）"""
+    if not aliases:
+        return False
+    alias_query = db.query(DepartmentAlias).filter(DepartmentAlias.alias.in_(aliases))
+    name_query = db.query(Department).filter(
+        Department.department_name.in_(aliases),
+        Department.deleted_at.is_(None)
+    )
+    if department_id:
+        alias_query = alias_query.filter(DepartmentAlias.department_id != department_id)
+    return alias_query.first() is not None or name_query.first() is not None
+
+
 @router.get("")
 async def get_departments(
     current_user: dict = Depends(get_current_user),
@@ -45,14 +70,23 @@ async def create_department(
     if existing_dept:
         return error_response(code="10009", msg="科室名称已存在")
     
+    aliases = _clean_aliases(dept_data.aliases, dept_data.department_name)
+    if _alias_taken(db, aliases):
+        return error_response(code="10009", msg="科室别名已存在")
+    
     # 创建新科室
     new_dept = Department(
-        department_name=dept_data.department_name
+        department_name=dept_data.department_name,
+        category=dept_data.category or None
     )
     
     db.add(new_dept)
+    db.flush()
+    for alias in aliases:
+        db.add(DepartmentAlias(department_id=new_dept.id, alias=alias))
     db.commit()
     db.refresh(new_dept)
+    DEPARTMENT_TAXONOMY.invalidate()
     
     return success_response(msg="创建成功")
 
@@ -76,6 +110,7 @@ async def delete_department(
     from datetime import datetime
     department.deleted_at = datetime.utcnow()
     db.commit()
+    DEPARTMENT_TAXONOMY.invalidate()
     
     return success_response(msg="删除成功")
 
@@ -106,14 +141,32 @@ async def update_department(
     if existing_dept:
         return error_response(code="10009", msg="科室名称已存在")
     
-    # 更新科室名称
+    aliases = None
+    if dept_data.aliases is not None:
+        aliases = _clean_aliases(dept_data.aliases, dept_data.department_name)
+        if _alias_taken(db, aliases, department_id):
+            return error_response(code="10009", msg="科室别名已存在")
+    
+    # 更新科室名称、所属大类和别名
     department.department_name = dept_data.department_name
+    if dept_data.category is not None:
+        department.category = dept_data.category or None
+    if aliases is not None:
+        db.query(DepartmentAlias).filter(DepartmentAlias.department_id == department_id).delete()
+        for alias in aliases:
+            db.add(DepartmentAlias(department_id=department_id, alias=alias))
     db.commit()
     db.refresh(department)
+    DEPARTMENT_TAXONOMY.invalidate()
     
+    department_aliases = db.query(DepartmentAlias.alias).filter(
+        DepartmentAlias.department_id == department_id
+    ).all()
     department_info = {
         "department_id": department.id,
         "department_name": department.department_name,
+        "category": department.category,
+        "aliases": [row.alias for row in department_aliases],
         "created_at": department.created_at.isoformat() if department.created_at else None,
         "updated_at": department.updated_at.isoformat() if department.updated_at else None,
         "deleted_at": department.deleted_at.isoformat() if department.deleted_at else None
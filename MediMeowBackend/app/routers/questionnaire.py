@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, UploadFile, File, Form, Query, HTTPException, BackgroundTasks
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
 import json
 import re
+import logging
 import pandas as pd
 from io import BytesIO
 from app.database import get_db
@@ -17,6 +20,12 @@ from app.utils import (
     error_response
 )
 from app.services.ai_service import AIService
+from app.services.ai_retry import apply_ai_result, release_failed_analysis
+from app.services.question_labels import QUESTION_LABEL_CACHE
+from app.utils.tracing import current_carrier, start_background_span
+from app.utils.log import log_context
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/questionnaires", tags=["问卷模块"])
 
@@ -82,7 +91,7 @@ async def import_questionnaire(
 
             # 验证问题标题：如果为空或为'nan'，跳过并记录警告
             if not question_text or question_text.lower() == 'nan':
-                print(f"跳过无效问题标题: '{question_text}', 题号: {question_id}")
+                logger.warning("跳过无效问题标题: '%s', 题号: %s", question_text, question_id)
                 continue
 
             # 构建问题对象
@@ -124,7 +133,7 @@ async def import_questionnaire(
                     question_obj["placeholder"] = options_str
             else:
                 # 未知类型，跳过或记录警告
-                print(f"未知题目类型: {question_type}, 题号: {question_id}")
+                logger.warning("未知题目类型: %s, 题号: %s", question_type, question_id)
                 continue
             
             questions.append(question_obj)
@@ -164,8 +173,10 @@ async def import_questionnaire(
         db.add(new_questionnaire)
         db.commit()
         db.refresh(new_questionnaire)
+        # 预先缓存题目标签映射，分析该版本问卷的提交时无需再解析 questions
+        QUESTION_LABEL_CACHE.put(new_questionnaire.id, new_version, questions)
         
-        print(f"问卷导入成功 - ID: {new_questionnaire.id}, 版本: {new_version}, 问题数: {len(questions)}")
+        logger.info("问卷导入成功", extra={"questionnaire_id": new_questionnaire.id, "version": new_version, "questions": len(questions)})
         
         return success_response(
             msg="问卷导入成功",
@@ -180,9 +191,7 @@ async def import_questionnaire(
     except pd.errors.EmptyDataError:
         return error_response(code="10014", msg="Excel文件为空")
     except Exception as e:
-        print(f"问卷导入失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("问卷导入失败")
         return error_response(code="10015", msg=f"问卷导入失败: {str(e)}")
 
 
@@ -195,7 +204,7 @@ async def get_submitted_questionnaires(
     """获取用户的所有已提交问卷列表"""
     target_user_id = user_id if user_id else current_user["user_id"]
     
-    print(f"[DEBUG] 查询用户 {target_user_id} 的已提交问卷")
+    logger.debug("查询用户的已提交问卷", extra={"user_id": target_user_id})
     
     # 查询该用户的所有就诊记录（按创建时间倒序）
     records = db.query(MedicalRecord).filter(
@@ -203,7 +212,7 @@ async def get_submitted_questionnaires(
         MedicalRecord.deleted_at.is_(None)
     ).order_by(MedicalRecord.created_at.desc()).all()
     
-    print(f"[DEBUG] 找到 {len(records)} 条就诊记录")
+    logger.debug("找到就诊记录", extra={"user_id": target_user_id, "records": len(records)})
     
     if not records:
         return success_response(
@@ -227,7 +236,7 @@ async def get_submitted_questionnaires(
         ).first()
         
         if not submission:
-            print(f"[DEBUG] 警告：就诊记录 {record.id} 没有找到对应的问卷提交记录 {record.submission_id}")
+            logger.warning("就诊记录没有找到对应的问卷提交记录", extra={"record_id": record.id, "submission_id": record.submission_id})
             continue
         
         # 获取问卷信息
@@ -288,7 +297,7 @@ async def get_questionnaire(
     db: Session = Depends(get_db)
 ):
     """获取问卷（根据科室ID）"""
-    print(f"请求获取问卷 - 科室ID: {department_id}, 用户ID: {current_user['user_id']}")
+    logger.debug("请求获取问卷", extra={"department_id": department_id, "user_id": current_user["user_id"]})
     
     # 查询该科室的激活问卷，优先返回 active 状态
     questionnaire = db.query(Questionnaire).filter(
@@ -304,14 +313,14 @@ async def get_questionnaire(
         ).first()
 
         if not department:
-            print(f"科室不存在: {department_id}")
+            logger.info("科室不存在", extra={"department_id": department_id})
             return error_response(code="10006", msg=f"科室不存在 (ID: {department_id})")
 
         # 科室存在但没有问卷
-        print(f"科室 '{department.department_name}' 暂无可用问卷")
+        logger.info("科室暂无可用问卷", extra={"department_id": department_id})
         return error_response(code="10006", msg=f"该科室({department.department_name})暂无可用问卷")
     
-    print(f"找到问卷: {questionnaire.title} (ID: {questionnaire.id})")
+    logger.debug("找到问卷", extra={"department_id": department_id, "questionnaire_id": questionnaire.id})
     
     # 查询用户已保存的答案
     saved_submission = db.query(QuestionnaireSubmission).filter(
@@ -360,8 +369,12 @@ async def get_questionnaire(
 
 
 
-from fastapi import Body
+from fastapi import Body, Header
 from pydantic import BaseModel
+
+# Idempotency-Key 最大长度（与 questionnaire_submissions.idempotency_key 列一致）
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
 class QuestionnaireSubmitRequest(BaseModel):
     questionnaire_id: str
     department_id: str
@@ -374,10 +387,15 @@ class QuestionnaireSubmitRequest(BaseModel):
 async def submit_questionnaire(
     background_tasks: BackgroundTasks,
     body: QuestionnaireSubmitRequest = Body(...),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """提交问卷（JSON参数，file_id为数组）"""
+    """提交问卷（JSON参数，file_id为数组）
+
+    客户端可携带 Idempotency-Key 请求头：重复点击或网络重试时使用相同的键，
+    后端直接返回首次提交的 record_id，不会重复创建提交、就诊记录和AI分析任务。
+    """
     # 验证用户类型：只有患者（user）可以提交问卷
     if current_user.get("user_type") == "doctor":
         return error_response(code="10009", msg="医生账号不能提交问卷，请使用患者账号")
@@ -399,10 +417,20 @@ async def submit_questionnaire(
         return error_response(code="10007", msg="缺少科室ID (department_id)")
     if not answers:
         return error_response(code="10007", msg="缺少问卷答案 (answers)")
+    if idempotency_key is not None:
+        idempotency_key = idempotency_key.strip() or None
+    if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return error_response(code="10007", msg=f"Idempotency-Key 长度不能超过{IDEMPOTENCY_KEY_MAX_LENGTH}个字符")
+
+    if idempotency_key:
+        replay = _replay_submission(db, current_user["user_id"], idempotency_key, body)
+        if replay is not None:
+            return replay
 
     # 创建问卷提交记录
     submission = QuestionnaireSubmission(
         user_id=current_user["user_id"],
+        idempotency_key=idempotency_key,
         questionnaire_id=questionnaire_id,
         department_id=department_id,
         answers=answers,
@@ -412,8 +440,8 @@ async def submit_questionnaire(
         status="pending"
     )
     db.add(submission)
-    db.commit()
-    db.refresh(submission)
+    # 提交记录与就诊记录在同一事务中创建，重放时总能找到对应的就诊记录
+    db.flush()
 
     # 创建就诊记录
     medical_record = MedicalRecord(
@@ -423,7 +451,15 @@ async def submit_questionnaire(
         status="waiting"
     )
     db.add(medical_record)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # 携带相同幂等键的并发请求已先提交：返回该请求的结果
+        db.rollback()
+        replay = _replay_submission(db, current_user["user_id"], idempotency_key, body) if idempotency_key else None
+        if replay is None:
+            raise
+        return replay
     db.refresh(medical_record)
 
     # 构建完整的问卷数据用于AI分析
@@ -438,7 +474,8 @@ async def submit_questionnaire(
 
     # 异步处理AI分析，避免阻塞响应
     # 注意：不传入 db session，让后台任务创建自己的 session
-    background_tasks.add_task(process_ai_analysis, submission.id, questionnaire_data, file_id)
+    # 传递 trace 上下文，使后台分析任务与本次请求位于同一条 trace
+    background_tasks.add_task(process_ai_analysis, submission.id, questionnaire_data, file_id, current_carrier())
 
     return success_response(
         msg="提交成功",
@@ -446,14 +483,54 @@ async def submit_questionnaire(
     )
 
 
-def process_ai_analysis(submission_id: str, questionnaire_data: dict, file_ids: list):
+def _replay_submission(db: Session, user_id: str, idempotency_key: str, body: QuestionnaireSubmitRequest):
+    """幂等键已使用过时返回首次提交的响应；未使用过返回 None"""
+    submission = db.query(QuestionnaireSubmission).filter(
+        QuestionnaireSubmission.user_id == user_id,
+        QuestionnaireSubmission.idempotency_key == idempotency_key
+    ).first()
+    if not submission:
+        return None
+
+    # 同一个键只能用于同一份问卷内容，防止客户端误复用键导致新提交被吞掉
+    if (submission.questionnaire_id != body.questionnaire_id
+            or submission.department_id != body.department_id
+            or submission.answers != body.answers):
+        return error_response(code="10016", msg="Idempotency-Key 已用于另一份问卷提交")
+
+    medical_record = db.query(MedicalRecord).filter(
+        MedicalRecord.submission_id == submission.id
+    ).first()
+    return success_response(
+        msg="提交成功",
+        data={"record_id": medical_record.id if medical_record else None}
+    )
+
+
+def process_ai_analysis(submission_id: str, questionnaire_data: dict, file_ids: list, trace_carrier: Optional[dict] = None):
     """后台同步处理AI分析（在独立的数据库session中）"""
+    with start_background_span("process_ai_analysis", trace_carrier, **{"submission.id": submission_id}), \
+            log_context(submission_id=submission_id):
+        _run_ai_analysis(submission_id, questionnaire_data, file_ids)
+
+
+def _run_ai_analysis(submission_id: str, questionnaire_data: dict, file_ids: list):
     import asyncio
     from app.database import SessionLocal
     
     # 创建独立的数据库 session
     db = SessionLocal()
     try:
+        # 认领分析任务（pending -> processing）：同一提交只会启动一次AI分析
+        # updated_at 记录认领时间，分析中断（如进程重启）时由重试任务按 AI_PROCESSING_TIMEOUT_SECONDS 回收
+        claimed = db.query(QuestionnaireSubmission).filter(
+            QuestionnaireSubmission.id == submission_id,
+            QuestionnaireSubmission.status == "pending"
+        ).update({"status": "processing", "updated_at": func.now()}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return
+
         submission = db.query(QuestionnaireSubmission).filter(
             QuestionnaireSubmission.id == submission_id
         ).first()
@@ -468,33 +545,25 @@ def process_ai_analysis(submission_id: str, questionnaire_data: dict, file_ids:
             ai_result = loop.run_until_complete(
                 AIService.analyze_questionnaire(
                     questionnaire_data=questionnaire_data,
-                    file_ids=file_ids
+                    file_ids=file_ids,
+                    request_id=submission_id
                 )
             )
-            # 保存完整AI分析结果
-            submission.ai_result = ai_result
-            submission.status = "completed"
-            
-            # 检查是否为科室错误
-            if ai_result.get("status") == "department_error":
-                # 科室错误：取消关联的就诊记录，不发送给医生
-                medical_record = db.query(MedicalRecord).filter(
-                    MedicalRecord.submission_id == submission_id
-                ).first()
-                
-                if medical_record:
-                    # 将就诊记录状态设为已取消
-                    medical_record.status = "cancelled"
-                    print(f"科室选择错误，就诊记录 {medical_record.id} 已取消，不会发送给医生")
-            
+            # 保存完整AI分析结果（科室错误时取消就诊记录，降级结果进入重试队列）
+            apply_ai_result(db, submission, ai_result)
             db.commit()
         finally:
             loop.close()
     except Exception as e:
-        print(f"AI分析失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        # AI 失败不影响提交
+        logger.exception("AI分析失败")
+        # AI 失败不影响提交：恢复为 pending 并加入重试队列，由后台重试任务重新分析
+        try:
+            db.rollback()
+            release_failed_analysis(db, submission_id, str(e)[:500])
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("恢复提交状态失败，将由重试任务按超时回收")
     finally:
         db.close()
 
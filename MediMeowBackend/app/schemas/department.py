@@ -1,16 +1,20 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 
 
 class DepartmentCreate(BaseModel):
     """创建科室请求"""
     department_name: str = Field(..., description="科室名称")
+    category: Optional[str] = Field(None, description="所属大类，如 内科、外科")
+    aliases: Optional[List[str]] = Field(None, description="科室别名，修改时传入则整体替换")
 
 
 class DepartmentInfo(BaseModel):
     """科室信息"""
     department_id: str
     department_name: str
+    category: Optional[str] = None
+    aliases: List[str] = []
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
     deleted_at: Optional[str] = None
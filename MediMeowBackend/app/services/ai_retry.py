@@ -0,0 +1,259 @@
+"""
+AI 分析降级重试
+
+AI 服务不可用时提交会保存降级结果（status: fallback），并记录到 ai_retry_backlog。
+后台线程在熔断器放行后按限速逐条重新分析（以提交ID作为请求ID，AI服务端从已完成阶段继续），
+成功后用真实结果替换降级结果；仍失败的按指数退避推迟，超过最大次数后标记为 failed 不再重试。
+
+分析过程中出错（未得到任何结果）的提交恢复为 pending 并同样加入队列；进程在分析中途退出时，
+提交会停留在 processing，超过 AI_PROCESSING_TIMEOUT_SECONDS 后由后台线程回收并加入队列。
+"""
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import settings
+from app.database import SessionLocal
+from app.models.ai_retry import AIRetryTask
+from app.models.medical_record import MedicalRecord
+from app.models.questionnaire import QuestionnaireSubmission
+from app.services.ai_service import AIService, AI_CIRCUIT_BREAKER
+from app.utils.log import log_context
+from .grpc_client import medical_ai_pb2 as pb2
+
+logger = logging.getLogger(__name__)
+
+# 认领任务后的租约时间，期间其他后端进程不会重复处理同一提交
+CLAIM_LEASE_SECONDS = 600
+
+
+def enqueue_retry(db: Session, submission_id: str, reason: Optional[str] = None) -> None:
+    """将降级的提交加入重试队列（已存在则忽略）"""
+    exists = db.query(AIRetryTask.id).filter(AIRetryTask.submission_id == submission_id).first()
+    if exists:
+        return
+    db.add(AIRetryTask(
+        submission_id=submission_id,
+        status="pending",
+        attempts=0,
+        last_error=reason,
+        next_attempt_at=datetime.now()
+    ))
+
+
+def release_failed_analysis(db: Session, submission_id: str, reason: Optional[str] = None) -> bool:
+    """分析未完成的提交从 processing 恢复为 pending 并加入重试队列，返回是否恢复（调用方负责提交事务）"""
+    released = db.query(QuestionnaireSubmission).filter(
+        QuestionnaireSubmission.id == submission_id,
+        QuestionnaireSubmission.status == "processing"
+    ).update({"status": "pending", "updated_at": func.now()}, synchronize_session=False)
+    if released:
+        enqueue_retry(db, submission_id, reason)
+    return bool(released)
+
+
+def apply_ai_result(db: Session, submission: QuestionnaireSubmission, ai_result: Dict[str, Any]) -> None:
+    """保存 AI 分析结果，并根据结果状态更新就诊记录和重试队列（调用方负责提交事务）"""
+    submission.ai_result = ai_result
+    submission.status = "completed"
+
+    if ai_result.get("status") == "fallback":
+        enqueue_retry(db, submission.id, ai_result.get("fallback_reason"))
+        return
+
+    db.query(AIRetryTask).filter(AIRetryTask.submission_id == submission.id).delete(synchronize_session=False)
+
+    # 检查是否为科室错误
+    if ai_result.get("status") == "department_error":
+        # 科室错误：取消关联的就诊记录，不发送给医生（医生已接诊的不再取消）
+        medical_record = db.query(MedicalRecord).filter(
+            MedicalRecord.submission_id == submission.id
+        ).first()
+
+        if medical_record and medical_record.status == "waiting":
+            # 将就诊记录状态设为已取消
+            medical_record.status = "cancelled"
+            logger.info("科室选择错误，就诊记录已取消，不会发送给医生", extra={"record_id": medical_record.id})
+
+
+def build_questionnaire_data(submission: QuestionnaireSubmission) -> Dict[str, Any]:
+    """从提交记录还原 AIService.analyze_questionnaire 所需的问卷数据"""
+    return {
+        'questionnaire_id': submission.questionnaire_id,
+        'user_id': submission.user_id,
+        'department_id': submission.department_id,
+        'answers': submission.answers or {},
+        'height': submission.height,
+        'weight': submission.weight
+    }
+
+
+class AIRetryWorker:
+    """后台重试线程（单线程逐条处理，速率受 AI_RETRY_RATE_PER_MINUTE 限制）"""
+
+    def __init__(self):
+        self.interval = 60.0 / max(settings.AI_RETRY_RATE_PER_MINUTE, 0.1)
+        self.poll_interval = settings.AI_RETRY_POLL_SECONDS
+        self.max_attempts = settings.AI_RETRY_MAX_ATTEMPTS
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 统计
+        self.recovered = 0
+        self.retry_failures = 0
+        self.last_run_at: Optional[datetime] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ai-retry-worker", daemon=True)
+        self._thread.start()
+        logger.info("AI 重试任务已启动（每 %.1fs 最多处理 1 条）", self.interval)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            processed = False
+            try:
+                self.reclaim_stale()
+                # 熔断中不消耗重试次数；半开时本线程的请求即作为探测请求
+                if AI_CIRCUIT_BREAKER.allow_request():
+                    processed = self.process_next()
+            except Exception:
+                logger.exception("AI 重试任务异常")
+            # 成功处理后按限速间隔继续；队列为空、熔断中或重试失败时按轮询间隔等待
+            self._stop.wait(self.interval if processed else self.poll_interval)
+
+    def _backoff(self, attempts: int) -> timedelta:
+        seconds = settings.AI_RETRY_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0))
+        return timedelta(seconds=min(seconds, settings.AI_RETRY_MAX_BACKOFF_SECONDS))
+
+    def reclaim_stale(self) -> int:
+        """回收停留在 processing 超过 AI_PROCESSING_TIMEOUT_SECONDS 的提交（分析进程中途退出），返回回收数量"""
+        db = SessionLocal()
+        try:
+            deadline = datetime.now() - timedelta(seconds=settings.AI_PROCESSING_TIMEOUT_SECONDS)
+            stale = db.query(QuestionnaireSubmission.id).filter(
+                QuestionnaireSubmission.status == "processing",
+                QuestionnaireSubmission.deleted_at.is_(None),
+                func.coalesce(QuestionnaireSubmission.updated_at, QuestionnaireSubmission.created_at) < deadline
+            ).all()
+            reclaimed = 0
+            for (submission_id,) in stale:
+                if release_failed_analysis(db, submission_id, "分析超时未完成，已回收"):
+                    reclaimed += 1
+            db.commit()
+            if reclaimed:
+                logger.warning("回收了 %d 个分析中断的提交，已加入重试队列", reclaimed)
+            return reclaimed
+        finally:
+            db.close()
+
+    def process_next(self) -> bool:
+        """处理一条到期的重试任务，返回是否成功替换了降级结果或清理了无效任务"""
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            self.last_run_at = now
+            task = db.query(AIRetryTask).filter(
+                AIRetryTask.status == "pending",
+                AIRetryTask.next_attempt_at <= now
+            ).order_by(AIRetryTask.next_attempt_at).first()
+            if not task:
+                return False
+
+            # 多个后端进程同时运行时，通过条件更新认领任务
+            claimed = db.query(AIRetryTask).filter(
+                AIRetryTask.id == task.id,
+                AIRetryTask.next_attempt_at == task.next_attempt_at
+            ).update(
+                {"next_attempt_at": now + timedelta(seconds=CLAIM_LEASE_SECONDS)},
+                synchronize_session=False
+            )
+            db.commit()
+            if not claimed:
+                return True
+            db.refresh(task)
+
+            submission = db.query(QuestionnaireSubmission).filter(
+                QuestionnaireSubmission.id == task.submission_id,
+                QuestionnaireSubmission.deleted_at.is_(None)
+            ).first()
+            # 提交已删除，或已有非降级结果（例如被手动重新分析），无需再处理；
+            # 没有结果的提交（分析中途出错或被回收）需要重新分析
+            if not submission or (submission.ai_result is not None
+                                  and submission.ai_result.get("status") != "fallback"):
+                db.delete(task)
+                db.commit()
+                return True
+
+            with log_context(submission_id=submission.id):
+                return self._reanalyze(db, task, submission)
+        finally:
+            db.close()
+
+    def _reanalyze(self, db: Session, task: AIRetryTask, submission: QuestionnaireSubmission) -> bool:
+        """重新分析一条降级的提交，返回是否成功替换了降级结果"""
+        loop = asyncio.new_event_loop()
+        try:
+            ai_result = loop.run_until_complete(
+                AIService.analyze_questionnaire(
+                    questionnaire_data=build_questionnaire_data(submission),
+                    file_ids=submission.file_ids,
+                    priority=pb2.BATCH,
+                    request_id=submission.id
+                )
+            )
+        finally:
+            loop.close()
+
+        if ai_result.get("status") == "fallback":
+            if submission.ai_result is None:
+                # 尚无任何结果的提交先保存降级结果，与首次分析降级时一致
+                apply_ai_result(db, submission, ai_result)
+            task.attempts = (task.attempts or 0) + 1
+            task.last_error = ai_result.get("fallback_reason")
+            if task.attempts >= self.max_attempts:
+                task.status = "failed"
+                logger.warning("重试 %d 次仍失败，放弃重新分析", task.attempts)
+            else:
+                task.next_attempt_at = datetime.now() + self._backoff(task.attempts)
+            db.commit()
+            self.retry_failures += 1
+            return False
+
+        attempt = (task.attempts or 0) + 1
+        apply_ai_result(db, submission, ai_result)
+        db.commit()
+        self.recovered += 1
+        logger.info("已重新分析，替换降级结果（第 %d 次尝试）", attempt)
+        return True
+
+    def stats(self, db: Session) -> Dict[str, Any]:
+        counts = dict(
+            db.query(AIRetryTask.status, func.count(AIRetryTask.id)).group_by(AIRetryTask.status).all()
+        )
+        oldest = db.query(func.min(AIRetryTask.created_at)).filter(AIRetryTask.status == "pending").scalar()
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "rate_per_minute": settings.AI_RETRY_RATE_PER_MINUTE,
+            "pending": counts.get("pending", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_at": oldest.strftime("%Y-%m-%d %H:%M:%S") if oldest else None,
+            "recovered": self.recovered,
+            "retry_failures": self.retry_failures,
+            "last_run_at": self.last_run_at.strftime("%Y-%m-%d %H:%M:%S") if self.last_run_at else None
+        }
+
+
+AI_RETRY_WORKER = AIRetryWorker()
@@ -3,58 +3,100 @@ AI 服务模块
 
 此模块用于与AI服务进行交互，分析问卷数据并返回分析结果
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import json
+import asyncio
 import grpc
-import base64
 import os
-import re
+import logging
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, select, literal
 
+from config import settings
 from app.database import SessionLocal
 from app.models.questionnaire import Questionnaire, QuestionnaireSubmission
 from app.models.department import Department
 from app.models.user import User
+from app.utils.tracing import GrpcClientTracingInterceptor
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.question_labels import QUESTION_LABEL_CACHE
+from app.services.department_taxonomy import DEPARTMENT_TAXONOMY
 from .grpc_client import medical_ai_pb2 as pb2
 from .grpc_client import medical_ai_pb2_grpc as pb2_grpc
 
+logger = logging.getLogger(__name__)
+
+# 进程内共享的 AI 服务熔断器
+AI_CIRCUIT_BREAKER = CircuitBreaker.from_settings("ai_service")
+
+# AI服务未返回图像摘要时 key_info.image_summary 的占位文本
+IMAGE_SUMMARY_PLACEHOLDER = "图片已分析"
+
 
 class AIService:
     """AI服务类"""
 
     @staticmethod
-    def _get_question_label_mapping(questionnaire_id: str, db: Session) -> Dict[str, str]:
-        """获取问题ID到标签的映射"""
-        questionnaire = db.query(Questionnaire).filter(Questionnaire.id == questionnaire_id).first()
-        if not questionnaire or not questionnaire.questions:
-            return {}
-
-        question_mapping = {}
-        for question in questionnaire.questions:
-            if isinstance(question, dict) and 'id' in question and 'label' in question:
-                question_mapping[question['id']] = question['label']
-        return question_mapping
+    def _load_analysis_context(
+        questionnaire_id: str,
+        user_id: str,
+        department_id: str,
+        db: Session
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """
+        一次查询获取科室名称、患者信息和问卷版本，题目标签映射优先从缓存读取
 
-    @staticmethod
-    def _get_department_name(department_id: str, db: Session) -> str:
-        """获取科室名称"""
-        department = db.query(Department).filter(Department.id == department_id).first()
-        return department.department_name if department else "未知科室"
+        Returns:
+            (科室名称, 问题ID到标签的映射, 用户信息)
+        """
+        department_name = (
+            select(Department.department_name).where(Department.id == department_id).scalar_subquery()
+        )
+        questionnaire_version = (
+            select(Questionnaire.version).where(Questionnaire.id == questionnaire_id).scalar_subquery()
+        )
+        # 以单行常量表为起点外连接用户表：用户不存在时仍能取到科室名称和问卷版本
+        anchor = select(literal(1).label("anchor")).subquery()
+        row = db.execute(
+            select(
+                department_name.label("department_name"),
+                questionnaire_version.label("questionnaire_version"),
+                User.username,
+                User.gender,
+                User.birth
+            )
+            .select_from(anchor)
+            .outerjoin(User, User.id == user_id)
+        ).one()
+
+        version = row.questionnaire_version
+        question_mapping = QUESTION_LABEL_CACHE.get(questionnaire_id, version) if version is not None else None
+        if question_mapping is None:
+            questions = db.execute(
+                select(Questionnaire.questions).where(Questionnaire.id == questionnaire_id)
+            ).scalar_one_or_none()
+            if version is not None:
+                question_mapping = QUESTION_LABEL_CACHE.put(questionnaire_id, version, questions)
+            else:
+                question_mapping = {}
+
+        return (
+            row.department_name or "未知科室",
+            question_mapping,
+            # 用户不存在时各字段为 NULL，整理后即为“未知患者”
+            AIService._format_user_info(row.username, row.gender, row.birth)
+        )
 
     @staticmethod
-    def _get_user_info(user_id: str, db: Session) -> Dict[str, Any]:
-        """获取用户信息"""
+    def _format_user_info(username: Optional[str], gender: Optional[str], birth: Any) -> Dict[str, Any]:
+        """整理用户信息（计算年龄）"""
         from datetime import datetime
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return {"name": "未知患者", "gender": "未知", "age": "未知"}
-        
+
         # 计算年龄
         age_display = "未知"
-        if user.birth:
+        if birth:
             try:
-                birth_date = datetime.strptime(str(user.birth), "%Y-%m-%d")
+                birth_date = datetime.strptime(str(birth), "%Y-%m-%d")
                 today = datetime.now()
                 age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
                 age_display = f"{age}岁"
@@ -62,8 +104,8 @@ class AIService:
                 pass
         
         return {
-            "name": user.username or "未知患者",
-            "gender": user.gender or "未知",
+            "name": username or "未知患者",
+            "gender": gender or "未知",
             "age": age_display
         }
 
@@ -144,156 +186,118 @@ class AIService:
         Returns:
             True 如果匹配，False 如果不匹配
         """
-        if not suggested_department or not user_department:
-            return True  # 如果缺少信息，默认匹配
-        
-        # 标准化处理：去除空白、转小写
-        user_dept = user_department.strip().lower()
-        suggested_dept = suggested_department.strip().lower()
-        
-        # 完全匹配
-        if user_dept == suggested_dept:
-            return True
-        
-        # 包含匹配（处理"内科" vs "呼吸内科"等情况）
-        if user_dept in suggested_dept or suggested_dept in user_dept:
-            return True
-        
-        # 科室别名映射（可扩展）
-        department_aliases = {
-            "内科": ["呼吸内科", "消化内科", "心内科", "神经内科", "内分泌科", "血液科", "肾内科", "风湿免疫科"],
-            "外科": ["普外科", "骨科", "泌尿外科", "神经外科", "心胸外科", "肝胆外科", "胃肠外科"],
-            "妇产科": ["妇科", "产科", "妇产"],
-            "儿科": ["小儿科", "新生儿科", "儿童"],
-            "五官科": ["眼科", "耳鼻喉科", "口腔科", "耳鼻咽喉科"],
-            "皮肤科": ["皮肤性病科", "皮肤"],
-            "精神科": ["心理科", "精神心理科", "心理"],
-            "急诊科": ["急诊", "急救"],
-        }
-        
-        # 检查是否属于同一大类
-        for main_dept, sub_depts in department_aliases.items():
-            main_dept_lower = main_dept.lower()
-            sub_depts_lower = [s.lower() for s in sub_depts]
-            
-            user_in_group = (user_dept == main_dept_lower or 
-                           user_dept in sub_depts_lower or
-                           any(sub in user_dept for sub in sub_depts_lower) or
-                           main_dept_lower in user_dept)
-            
-            suggested_in_group = (suggested_dept == main_dept_lower or 
-                                 suggested_dept in sub_depts_lower or
-                                 any(sub in suggested_dept for sub in sub_depts_lower) or
-                                 main_dept_lower in suggested_dept)
-            
-            if user_in_group and suggested_in_group:
-                return True
-        
-        return False
+        # 科室名称、别名和所属大类来自数据库，编译后缓存在进程内
+        return DEPARTMENT_TAXONOMY.match(user_department, suggested_department)
 
     @staticmethod
-    def _parse_markdown_structured_report(markdown_text: str) -> Dict[str, Any]:
-        """解析Markdown格式的structured_report"""
+    def _extract_key_info(report) -> Dict[str, Any]:
+        """读取 AnalysisReport.key_info 的类型化字段；AI服务未提取到的条目使用默认值"""
         key_info = {
-            "chief_complaint": "",
+            "chief_complaint": "AI分析完成",
             "key_symptoms": "",
-            "image_summary": "图片已分析",
+            "image_summary": IMAGE_SUMMARY_PLACEHOLDER,
             "important_notes": "请查看详细报告",
             "risk_level": "中等",
             "suggested_department": ""
         }
+        if report.HasField("key_info"):
+            for field in report.key_info.DESCRIPTOR.fields:
+                value = getattr(report.key_info, field.name)
+                if value:
+                    key_info[field.name] = value
+        return key_info
 
-        # 使用正则表达式匹配标题和内容
-        # 模式：### 数字. 【标题 (英文)】
-        pattern = r'### \d+\. 【([^】]+) \([^)]+\)】\s*\n(.*?)(?=### \d+\. 【|$)'
-        matches = re.findall(pattern, markdown_text, re.DOTALL)
-
-        # 标题映射到字段
-        title_mapping = {
-            "患者主诉": "chief_complaint",
-            "关键症状": "key_symptoms",
-            "影像总结": "image_summary",
-            "重要笔记": "important_notes",
-            "风险等级": "risk_level",
-            "建议科室": "suggested_department"
+    @staticmethod
+    def _extract_timing_info(report) -> Dict[str, Any]:
+        """从 AnalysisReport 中提取实测耗时与模型标识"""
+        timings = {
+            field.name: round(getattr(report.timings, field.name), 1)
+            for field in report.timings.DESCRIPTOR.fields
+        }
+        return {
+            "analysis_time": f"{timings['total_ms'] / 1000:.2f}s",
+            "timings": timings,
+            "model_version": report.model_info.service_version or "v1.0",
+            "models": {
+                "llm": report.model_info.llm_model,
+                "embedding": report.model_info.embedding_model
+            }
         }
-
-        for title, content in matches:
-            content = content.strip()
-            if content:
-                for key, field in title_mapping.items():
-                    if key in title:
-                        key_info[field] = content
-                        break
-
-        # 如果未提取到chief_complaint，使用默认值
-        if not key_info["chief_complaint"]:
-            key_info["chief_complaint"] = "AI分析完成"
-
-        return key_info
 
     @staticmethod
-    def _call_grpc_ai_service(patient_text_data: str, image_base64: str, department_name: str) -> Dict[str, Any]:
+    def _call_grpc_ai_service(
+        patient_text_data: str,
+        images: List[Tuple[bytes, str]],
+        department_name: str,
+        priority: int = pb2.INTERACTIVE,
+        request_id: str = ""
+    ) -> Dict[str, Any]:
         """
         调用gRPC AI服务（非流式）
         
         Args:
             patient_text_data: 患者文本数据
-            image_base64: 图片base64编码
+            images: 图片列表 [(原始字节, MIME类型)]，AI服务逐张并行生成描述
             department_name: 用户选择的科室名称（用于匹配判断）
+            priority: 调度优先级（后台重新分析使用 BATCH）
+            request_id: 请求ID（提交ID），AI服务据此保存阶段检查点，重试时跳过已完成阶段
             
         Returns:
             包含 is_department 判断结果的分析结果
         """
         try:
             ai_service_host = os.getenv('AI_SERVICE_HOST', '127.0.0.1:50051')
-            with grpc.insecure_channel(ai_service_host) as channel:
-                stub = pb2_grpc.MedicalAIServiceStub(channel)
+            # 不共享子通道：并发的分析请求各用一条连接，AI 服务多进程模式下由内核分配到不同的工作进程
+            with grpc.insecure_channel(
+                ai_service_host, options=[("grpc.use_local_subchannel_pool", 1)]
+            ) as channel:
+                traced_channel = grpc.intercept_channel(channel, GrpcClientTracingInterceptor())
+                stub = pb2_grpc.MedicalAIServiceStub(traced_channel)
                 request = pb2.AnalysisRequest(
                     patient_text_data=patient_text_data,
-                    image_base64=image_base64,
                     stream=False,
-                    patient_department=department_name
+                    patient_department=department_name,
+                    priority=priority,
+                    request_id=request_id
                 )
+                # 逐个追加到请求中（构造 Image 后再放入请求会多复制一次图片内容）
+                for data, mime_type in images:
+                    request.images.add(data=data, mime_type=mime_type)
+
+                # 熔断中直接失败，由调用方立即降级，不再等待连接失败
+                AI_CIRCUIT_BREAKER.before_call()
+                try:
+                    # 使用新的非流式RPC方法；超时会传递给AI服务，由其中止剩余阶段
+                    sync_report = stub.ProcessMedicalAnalysisSync(request, timeout=settings.AI_RPC_TIMEOUT_SECONDS)
+                except grpc.RpcError as e:
+                    # 服务端过载拒绝说明服务可达，不计入熔断失败
+                    if e.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+                        AI_CIRCUIT_BREAKER.record_success()
+                    else:
+                        AI_CIRCUIT_BREAKER.record_failure()
+                    raise
 
-                # 使用新的非流式RPC方法
-                sync_report = stub.ProcessMedicalAnalysisSync(request)
+                if sync_report.status in ("SUCCESS", "DEPARTMENT_ERROR"):
+                    AI_CIRCUIT_BREAKER.record_success()
+                else:
+                    AI_CIRCUIT_BREAKER.record_failure()
                 
                 # 处理 SUCCESS 状态
                 if sync_report.status == "SUCCESS":
-                    # 解析structured_report，假设是JSON字符串
-                    try:
-                        result_data = json.loads(sync_report.structured_report)
-                        key_info = result_data.get("key_info", {})
-                        suggested_dept = key_info.get("suggested_department", "")
-                        
-                        # 判断科室是否匹配
-                        is_dept_match = AIService._check_department_match(department_name, suggested_dept)
-                        
-                        return {
-                            "is_department": is_dept_match,
-                            "key_info": key_info,
-                            "analysis_time": result_data.get("analysis_time", "0.5s"),
-                            "model_version": result_data.get("model_version", "v1.0"),
-                            "status": "success",
-                            "structured_report": sync_report.structured_report
-                        }
-                    except json.JSONDecodeError:
-                        # 尝试解析Markdown格式
-                        key_info = AIService._parse_markdown_structured_report(sync_report.structured_report)
-                        suggested_dept = key_info.get("suggested_department", "")
-                        
-                        # 判断科室是否匹配
-                        is_dept_match = AIService._check_department_match(department_name, suggested_dept)
-                        
-                        return {
-                            "is_department": is_dept_match,
-                            "key_info": key_info,
-                            "analysis_time": "0.5s",
-                            "model_version": "v1.0",
-                            "status": "success",
-                            "structured_report": sync_report.structured_report
-                        }
+                    # 关键信息由AI服务从报告中提取，直接读取类型化字段
+                    key_info = AIService._extract_key_info(sync_report)
+                    suggested_dept = key_info.get("suggested_department", "")
+                    
+                    # 判断科室是否匹配
+                    is_dept_match = AIService._check_department_match(department_name, suggested_dept)
+                    
+                    return {
+                        "is_department": is_dept_match,
+                        "key_info": key_info,
+                        **AIService._extract_timing_info(sync_report),
+                        "status": "success",
+                        "structured_report": sync_report.structured_report
+                    }
                 
                 # 处理 DEPARTMENT_ERROR 状态
                 elif sync_report.status == "DEPARTMENT_ERROR":
@@ -306,10 +310,10 @@ class AIService:
                             "image_summary": "由于科室选择错误，未进行完整分析",
                             "important_notes": "请重新选择正确的科室",
                             "risk_level": "未评估",
-                            "suggested_department": "请根据症状重新选择"
+                            # AI服务本地预分诊拦截时会给出最接近的科室
+                            "suggested_department": sync_report.key_info.suggested_department or "请根据症状重新选择"
                         },
-                        "analysis_time": "0.1s",
-                        "model_version": "v1.0",
+                        **AIService._extract_timing_info(sync_report),
                         "status": "department_error",
                         "structured_report": sync_report.structured_report,
                         "error_message": "科室选择错误，请重新选择正确的科室"
@@ -322,6 +326,37 @@ class AIService:
         except Exception as e:
             raise Exception(f"gRPC调用失败: {str(e)}")
 
+    @staticmethod
+    def get_service_stats(timeout: float = 3.0) -> Dict[str, Any]:
+        """获取AI服务的调度、限流与取消/超时统计；服务不可达时返回错误信息"""
+        try:
+            ai_service_host = os.getenv('AI_SERVICE_HOST', '127.0.0.1:50051')
+            with grpc.insecure_channel(ai_service_host) as channel:
+                stub = pb2_grpc.MedicalAIServiceStub(channel)
+                stats = stub.GetServiceStats(pb2.ServiceStatsRequest(), timeout=timeout)
+                return json.loads(stats.stats_json)
+        except grpc.RpcError as e:
+            return {"error": f"{e.code().name}: {e.details()}"}
+
+    @staticmethod
+    def reload_knowledge_base(wait: bool = False, reason: str = "", timeout: float = 600.0) -> Dict[str, Any]:
+        """触发AI服务重建知识库；wait=True 时等待切换完成。服务不可达时返回错误信息"""
+        try:
+            ai_service_host = os.getenv('AI_SERVICE_HOST', '127.0.0.1:50051')
+            with grpc.insecure_channel(ai_service_host) as channel:
+                stub = pb2_grpc.MedicalAIServiceStub(channel)
+                response = stub.ReloadKnowledgeBase(
+                    pb2.ReloadKnowledgeBaseRequest(wait=wait, reason=reason),
+                    timeout=timeout if wait else 10.0
+                )
+                return {
+                    "ok": response.ok,
+                    "message": response.message,
+                    "knowledge_base": json.loads(response.status_json or "null")
+                }
+        except grpc.RpcError as e:
+            return {"error": f"{e.code().name}: {e.details()}"}
+
     @staticmethod
     def _get_fallback_result(department_name: str) -> Dict[str, Any]:
         """降级策略：返回模拟结果"""
@@ -340,10 +375,45 @@ class AIService:
             "status": "fallback"
         }
 
+    @staticmethod
+    def _read_image_file(file_id: str) -> Tuple[bytes, str]:
+        """读取上传的图片，返回原始字节和MIME类型（Base64 编码由 AI 服务完成）"""
+        from app.utils.file_handler import get_file_path
+        file_path = get_file_path(file_id)
+        with open(file_path, 'rb') as image_file:
+            data = image_file.read()
+
+        # MIME类型（简单判断文件类型）
+        file_ext = file_path.lower().split('.')[-1]
+        mime_type = {
+            'jpg': 'image/jpeg',
+            'jpeg': 'image/jpeg',
+            'png': 'image/png',
+            'gif': 'image/gif',
+        }.get(file_ext, 'image/png')  # 默认当作PNG
+        return data, mime_type
+
+    @staticmethod
+    async def _read_images(file_ids: List[str]) -> List[Tuple[bytes, str]]:
+        """并发读取全部图片（在线程池中执行，不阻塞事件循环）；读取失败的图片跳过"""
+        results = await asyncio.gather(
+            *(asyncio.to_thread(AIService._read_image_file, file_id) for file_id in file_ids),
+            return_exceptions=True
+        )
+        images = []
+        for file_id, result in zip(file_ids, results):
+            if isinstance(result, Exception):
+                logger.warning("图片处理失败: %s", result, extra={"file_id": file_id})
+            else:
+                images.append(result)
+        return images
+
     @staticmethod
     async def analyze_questionnaire(
         questionnaire_data: Dict[str, Any],
-        file_ids: Optional[List[str]] = None
+        file_ids: Optional[List[str]] = None,
+        priority: int = pb2.INTERACTIVE,
+        request_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         分析问卷数据
@@ -351,6 +421,8 @@ class AIService:
         Args:
             questionnaire_data: 问卷数据，包含questionnaire_id, user_id, department_id, answers等
             file_ids: 上传的文件ID列表
+            priority: 调度优先级
+            request_id: 请求ID（通常为提交ID），同一提交的重新分析可复用AI服务端已完成的阶段
 
         Returns:
             AI分析结果
@@ -369,56 +441,34 @@ class AIService:
             if not isinstance(questionnaire_id, str) or not isinstance(user_id, str) or not isinstance(department_id, str):
                 raise ValueError("数据类型错误：questionnaire_id, user_id, department_id必须是字符串")
 
-            # 获取科室名称
-            department_name = AIService._get_department_name(department_id, db)
-
-            # 获取问题映射和用户信息
-            question_mapping = AIService._get_question_label_mapping(questionnaire_id, db)
-            user_info = AIService._get_user_info(user_id, db)
+            # 获取科室名称、问题映射和用户信息
+            department_name, question_mapping, user_info = AIService._load_analysis_context(
+                questionnaire_id, user_id, department_id, db
+            )
 
             # 构造患者文本数据
             patient_text_data = AIService._construct_patient_text_data(
                 questionnaire_data, question_mapping, department_name, user_info
             )
 
-            # 处理图片
-            image_base64 = ""
-            if file_ids:
-                try:
-                    # 处理第一个文件（假设是图片）
-                    from app.utils.file_handler import get_file_path
-                    file_path = get_file_path(file_ids[0])
-
-                    # 读取文件并转换为base64
-                    with open(file_path, 'rb') as image_file:
-                        image_data = image_file.read()
-                        image_base64 = base64.b64encode(image_data).decode('utf-8')
-
-                    # 添加MIME类型前缀（简单判断文件类型）
-                    file_ext = file_path.lower().split('.')[-1]
-                    if file_ext in ['jpg', 'jpeg']:
-                        image_base64 = f"data:image/jpeg;base64,{image_base64}"
-                    elif file_ext == 'png':
-                        image_base64 = f"data:image/png;base64,{image_base64}"
-                    elif file_ext == 'gif':
-                        image_base64 = f"data:image/gif;base64,{image_base64}"
-                    else:
-                        image_base64 = f"data:image/png;base64,{image_base64}"  # 默认当作PNG
-
-                except Exception as e:
-                    print(f"图片处理失败: {str(e)}")
-                    image_base64 = ""
+            # 处理图片：全部上传文件并发读取
+            images = await AIService._read_images(file_ids) if file_ids else []
 
             # 调用gRPC AI服务
             try:
-                result = AIService._call_grpc_ai_service(patient_text_data, image_base64, department_name)
-                result["key_info"]["image_summary"] = f"已上传{len(file_ids) if file_ids else 0}个文件进行分析"
+                result = AIService._call_grpc_ai_service(
+                    patient_text_data, images, department_name, priority, request_id or ""
+                )
+                # 只在AI服务未给出图像摘要时以上传数量代替，保留报告中的图像描述与科室错误提示
+                if result["key_info"].get("image_summary") == IMAGE_SUMMARY_PLACEHOLDER:
+                    result["key_info"]["image_summary"] = f"已上传{len(file_ids) if file_ids else 0}个文件，分析{len(images)}张图片"
                 return result
             except Exception as e:
                 # 降级策略
-                print(f"AI服务调用失败，使用降级策略: {str(e)}")
+                logger.warning("AI服务调用失败，使用降级策略: %s", e)
                 result = AIService._get_fallback_result(department_name)
                 result["key_info"]["image_summary"] = f"AI服务降级，未分析{len(file_ids) if file_ids else 0}个文件"
+                result["fallback_reason"] = str(e)
                 return result
 
         except ValueError as e:
@@ -426,8 +476,10 @@ class AIService:
             raise e
         except Exception as e:
             # 其他错误，使用降级策略
-            print(f"分析过程中发生错误: {str(e)}")
-            return AIService._get_fallback_result("未知科室")
+            logger.exception("分析过程中发生错误，使用降级策略")
+            result = AIService._get_fallback_result("未知科室")
+            result["fallback_reason"] = str(e)
+            return result
         finally:
             db.close()
     
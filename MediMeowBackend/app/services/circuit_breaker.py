@@ -0,0 +1,128 @@
+"""
+AI 服务熔断器
+
+AI 服务宕机时，每次调用都要等到连接失败才会降级。熔断器在连续失败达到阈值后
+进入 open 状态，之后的调用直接失败（立即降级）；冷却时间过后进入 half_open，
+只放行少量探测请求，探测成功则恢复 closed，失败则重新 open。
+"""
+import time
+import logging
+import threading
+from typing import Any, Dict
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于 open 状态，调用被直接拒绝"""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"{name} 熔断中，{retry_in:.1f}s 后允许探测")
+
+
+class CircuitBreaker:
+    """线程安全的熔断器（closed → open → half_open → closed）"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_inflight = 0
+
+        # 统计
+        self._rejected = 0
+        self._opened_count = 0
+
+    @classmethod
+    def from_settings(cls, name: str = "ai_service") -> "CircuitBreaker":
+        return cls(
+            name,
+            failure_threshold=settings.AI_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=settings.AI_BREAKER_RECOVERY_SECONDS,
+            half_open_max_calls=settings.AI_BREAKER_HALF_OPEN_CALLS
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        # 调用方需持有锁；冷却时间到达后惰性切换为 half_open
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = STATE_HALF_OPEN
+            self._half_open_inflight = 0
+        return self._state
+
+    def allow_request(self) -> bool:
+        """当前是否会放行请求（不占用探测名额，供后台重试任务判断是否值得尝试）"""
+        with self._lock:
+            state = self._current_state()
+            return state == STATE_CLOSED or (
+                state == STATE_HALF_OPEN and self._half_open_inflight < self.half_open_max_calls
+            )
+
+    def before_call(self) -> None:
+        """调用前检查，open 或探测名额已满时抛出 CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == STATE_CLOSED:
+                return
+            if state == STATE_HALF_OPEN and self._half_open_inflight < self.half_open_max_calls:
+                self._half_open_inflight += 1
+                return
+            self._rejected += 1
+            retry_in = max(self.recovery_timeout - (time.monotonic() - self._opened_at), 0.0)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info("熔断器 %s 探测成功，恢复 closed", self.name)
+            self._state = STATE_CLOSED
+            self._consecutive_failures = 0
+            self._half_open_inflight = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            state = self._current_state()
+            if state == STATE_HALF_OPEN or (
+                state == STATE_CLOSED and self._consecutive_failures >= self.failure_threshold
+            ):
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+                self._half_open_inflight = 0
+                self._opened_count += 1
+                logger.warning("熔断器 %s 打开（连续失败 %d 次），%.0fs 后探测",
+                               self.name, self._consecutive_failures, self.recovery_timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._current_state()
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "recovery_timeout_seconds": self.recovery_timeout,
+                "retry_in_seconds": round(max(self.recovery_timeout - (time.monotonic() - self._opened_at), 0.0), 1)
+                if state == STATE_OPEN else 0.0,
+                "opened_count": self._opened_count,
+                "rejected_calls": self._rejected
+            }
@@ -0,0 +1,209 @@
+"""
+科室分类匹配
+
+判断用户所选科室与AI建议科室是否匹配。科室名称、别名（department_aliases 表）和所属大类
+（departments.category）从数据库加载后编译为 Aho-Corasick 自动机，匹配时对文本扫描一次，
+耗时与文本长度成线性关系。科室增删改后调用 invalidate()，其他进程的修改在 TTL 到期后生效。
+"""
+import time
+import logging
+import threading
+import unicodedata
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# 科室名称 -> (所属大类, 别名列表)，create_departments.py 创建科室时按此写入
+DEFAULT_DEPARTMENT_TAXONOMY: Dict[str, Tuple[Optional[str], List[str]]] = {
+    "呼吸内科": ("内科", ["呼吸科"]),
+    "消化内科": ("内科", ["消化科"]),
+    "心内科": ("内科", ["心血管内科", "心脏内科"]),
+    "神经内科": ("内科", ["神经科"]),
+    "内分泌科": ("内科", ["内分泌内科"]),
+    "血液科": ("内科", ["血液内科"]),
+    "骨科": ("外科", []),
+    "泌尿外科": ("外科", ["泌尿科"]),
+    "妇科": ("妇产科", ["产科", "妇产"]),
+    "儿科": (None, ["小儿科", "新生儿科", "儿童"]),
+    "眼科": ("五官科", []),
+    "耳鼻喉科": ("五官科", ["耳鼻咽喉科"]),
+    "口腔科": ("五官科", ["牙科"]),
+    "皮肤科": (None, ["皮肤性病科", "皮肤"]),
+    "肿瘤科": (None, ["肿瘤内科"]),
+}
+
+
+def normalize(text: str) -> str:
+    """全角转半角、转小写并去除空白"""
+    return "".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+class _AhoCorasick:
+    """多模式串匹配自动机，返回最左最长且互不重叠的匹配"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态命中的模式串长度（含失败链上的输出）
+        self._out: List[List[int]] = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(len(pattern))
+
+    def _build(self) -> None:
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[int, int]]:
+        """返回 [(起始位置, 结束位置)]，重叠时保留起始更靠前、其次更长的匹配"""
+        matches = []
+        state = 0
+        for end, ch in enumerate(text, 1):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length in self._out[state]:
+                matches.append((end - length, end))
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        last_end = 0
+        for start, end in matches:
+            if start >= last_end:
+                selected.append((start, end))
+                last_end = end
+        return selected
+
+
+class DepartmentMatcher:
+    """编译后的科室分类：词条（科室名/别名/大类名）-> 匹配键集合"""
+
+    def __init__(self, departments: Dict[str, Tuple[Optional[str], List[str]]]):
+        # 匹配键："dept:科室名" 表示具体科室，"cat:大类" 表示所属大类
+        self._terms: Dict[str, FrozenSet[str]] = {}
+        for name, (category, aliases) in departments.items():
+            keys = {f"dept:{normalize(name)}"}
+            if category:
+                category_key = f"cat:{normalize(category)}"
+                keys.add(category_key)
+                self._add_term(category, {category_key})
+            for term in [name, *aliases]:
+                self._add_term(term, keys)
+        self._automaton = _AhoCorasick(self._terms)
+        self.size = len(self._terms)
+
+    def _add_term(self, term: str, keys: Set[str]) -> None:
+        term = normalize(term)
+        if term:
+            self._terms[term] = self._terms.get(term, frozenset()) | keys
+
+    def keys(self, text: str) -> Set[str]:
+        """文本中出现的全部科室与大类"""
+        normalized = normalize(text)
+        keys: Set[str] = set()
+        for start, end in self._automaton.find(normalized):
+            keys |= self._terms[normalized[start:end]]
+        return keys
+
+    def match(self, user_department: str, suggested_department: str) -> bool:
+        """
+        判断用户选择的科室与AI建议的科室是否匹配
+
+        同一科室（含别名）或同一大类（如 "内科" 与 "呼吸内科"、"呼吸内科" 与 "消化内科"）视为匹配；
+        任一方无法识别时退化为包含判断。
+        """
+        if not suggested_department or not user_department:
+            return True  # 如果缺少信息，默认匹配
+
+        user_keys = self.keys(user_department)
+        suggested_keys = self.keys(suggested_department)
+        if user_keys and suggested_keys:
+            return not user_keys.isdisjoint(suggested_keys)
+
+        user_dept = normalize(user_department)
+        suggested_dept = normalize(suggested_department)
+        return user_dept in suggested_dept or suggested_dept in user_dept
+
+
+class DepartmentTaxonomy:
+    """从数据库加载并缓存编译后的科室分类"""
+
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._matcher: Optional[DepartmentMatcher] = None
+        self._loaded_at = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "DepartmentTaxonomy":
+        return cls(ttl_seconds=settings.DEPARTMENT_TAXONOMY_TTL_SECONDS)
+
+    def invalidate(self) -> None:
+        """科室或别名变更后调用，下次匹配时重新加载"""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def matcher(self) -> DepartmentMatcher:
+        with self._lock:
+            if self._matcher is None or time.monotonic() - self._loaded_at >= self.ttl_seconds:
+                self._matcher = self._load()
+                self._loaded_at = time.monotonic()
+            return self._matcher
+
+    def match(self, user_department: str, suggested_department: str) -> bool:
+        return self.matcher().match(user_department, suggested_department)
+
+    def _load(self) -> DepartmentMatcher:
+        """加载未删除的科室及其别名；数据库不可用时沿用上次结果或默认分类"""
+        from app.database import SessionLocal
+        from app.models.department import Department, DepartmentAlias
+
+        db = SessionLocal()
+        try:
+            departments: Dict[str, Tuple[Optional[str], List[str]]] = {}
+            rows = db.execute(
+                select(Department.department_name, Department.category, DepartmentAlias.alias)
+                .outerjoin(DepartmentAlias, DepartmentAlias.department_id == Department.id)
+                .where(Department.deleted_at.is_(None))
+            ).all()
+            for name, category, alias in rows:
+                entry = departments.setdefault(name, (category, []))
+                if alias:
+                    entry[1].append(alias)
+            if not departments:
+                departments = DEFAULT_DEPARTMENT_TAXONOMY
+            matcher = DepartmentMatcher(departments)
+            logger.info("科室分类已加载", extra={"departments": len(departments), "terms": matcher.size})
+            return matcher
+        except Exception:
+            logger.exception("加载科室分类失败，使用%s", "上次结果" if self._matcher else "默认分类")
+            return self._matcher or DepartmentMatcher(DEFAULT_DEPARTMENT_TAXONOMY)
+        finally:
+            db.close()
+
+
+# 进程内共享的科室分类
+DEPARTMENT_TAXONOMY = DepartmentTaxonomy.from_settings()
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10medical_ai.proto\x12\nmedical_ai\"n\n\x0f\x41nalysisRequest\x12\x19\n\x11patient_text_data\x18\x01 \x01(\t\x12\x14\n\x0cimage_base64\x18\x02 \x01(\t\x12\x0e\n\x06stream\x18\x03 \x01(\x08\x12\x1a\n\x12patient_department\x18\x04 \x01(\t\"L\n\x0e\x41nalysisReport\x12\x19\n\x11structured_report\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"1\n\x0bStreamChunk\x12\x12\n\nchunk_data\x18\x01 \x01(\x0c\x12\x0e\n\x06is_end\x18\x02 \x01(\x08\x32\xbb\x01\n\x10MedicalAIService\x12U\n\x1aProcessMedicalAnalysisSync\x12\x1b.medical_ai.AnalysisRequest\x1a\x1a.medical_ai.AnalysisReport\x12P\n\x16ProcessMedicalAnalysis\x12\x1b.medical_ai.AnalysisRequest\x1a\x17.medical_ai.StreamChunk0\x01\x42\x18\n\x0b\x63om.exampleH\x01\xf8\x01\x01\xa2\x02\x03MEDb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10medical_ai.proto\x12\nmedical_ai\"\xe4\x01\n\x0f\x41nalysisRequest\x12\x19\n\x11patient_text_data\x18\x01 \x01(\t\x12\x14\n\x0cimage_base64\x18\x02 \x01(\t\x12\x0e\n\x06stream\x18\x03 \x01(\x08\x12\x1a\n\x12patient_department\x18\x04 \x01(\t\x12&\n\x08priority\x18\x05 \x01(\x0e\x32\x14.medical_ai.Priority\x12\x12\n\nrequest_id\x18\x06 \x01(\t\x12\x15\n\rimages_base64\x18\x07 \x03(\t\x12!\n\x06images\x18\x08 \x03(\x0b\x32\x11.medical_ai.Image\"(\n\x05Image\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\x12\x11\n\tmime_type\x18\x02 \x01(\t\"\xc9\x01\n\x0e\x41nalysisReport\x12\x19\n\x11structured_report\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\x12)\n\x07timings\x18\x04 \x01(\x0b\x32\x18.medical_ai.StageTimings\x12)\n\nmodel_info\x18\x05 \x01(\x0b\x32\x15.medical_ai.ModelInfo\x12%\n\x08key_info\x18\x06 \x01(\x0b\x32\x13.medical_ai.KeyInfo\"\xa1\x01\n\x0cStageTimings\x12\x15\n\rqueue_wait_ms\x18\x01 \x01(\x01\x12\x11\n\tstage1_ms\x18\x02 \x01(\x01\x12\x12\n\nkeyword_ms\x18\x03 \x01(\x01\x12\x18\n\x10vector_search_ms\x18\x04 \x01(\x01\x12\x11\n\tstage3_ms\x18\x05 \x01(\x01\x12\x10\n\x08total_ms\x18\x06 \x01(\x01\x12\x14\n\x0cpretriage_ms\x18\x07 \x01(\x01\"P\n\tModelInfo\x12\x11\n\tllm_model\x18\x01 \x01(\t\x12\x17\n\x0f\x65mbedding_model\x18\x02 \x01(\t\x12\x17\n\x0fservice_version\x18\x03 \x01(\t\"\x9a\x01\n\x07KeyInfo\x12\x17\n\x0f\x63hief_complaint\x18\x01 \x01(\t\x12\x14\n\x0ckey_symptoms\x18\x02 \x01(\t\x12\x15\n\rimage_summary\x18\x03 \x01(\t\x12\x17\n\x0fimportant_notes\x18\x04 \x01(\t\x12\x12\n\nrisk_level\x18\x05 \x01(\t\x12\x1c\n\x14suggested_department\x18\x06 \x01(\t\"]\n\x0bStreamChunk\x12\x12\n\nchunk_data\x18\x01 \x01(\x0c\x12\x0e\n\x06is_end\x18\x02 \x01(\x08\x12*\n\x06report\x18\x03 \x01(\x0b\x32\x1a.medical_ai.AnalysisReport\"\x15\n\x13ServiceStatsRequest\"\"\n\x0cServiceStats\x12\x12\n\nstats_json\x18\x01 \x01(\t\":\n\x1aReloadKnowledgeBaseRequest\x12\x0c\n\x04wait\x18\x01 \x01(\x08\x12\x0e\n\x06reason\x18\x02 \x01(\t\"O\n\x1bReloadKnowledgeBaseResponse\x12\n\n\x02ok\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x13\n\x0bstatus_json\x18\x03 \x01(\t*&\n\x08Priority\x12\x0f\n\x0bINTERACTIVE\x10\x00\x12\t\n\x05\x42\x41TCH\x10\x01\x32\xf1\x02\n\x10MedicalAIService\x12U\n\x1aProcessMedicalAnalysisSync\x12\x1b.medical_ai.AnalysisRequest\x1a\x1a.medical_ai.AnalysisReport\x12P\n\x16ProcessMedicalAnalysis\x12\x1b.medical_ai.AnalysisRequest\x1a\x17.medical_ai.StreamChunk0\x01\x12L\n\x0fGetServiceStats\x12\x1f.medical_ai.ServiceStatsRequest\x1a\x18.medical_ai.ServiceStats\x12\x66\n\x13ReloadKnowledgeBase\x12&.medical_ai.ReloadKnowledgeBaseRequest\x1a\'.medical_ai.ReloadKnowledgeBaseResponseB\x18\n\x0b\x63om.exampleH\x01\xf8\x01\x01\xa2\x02\x03MEDb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -32,12 +32,30 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'medical_ai_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   _globals['DESCRIPTOR']._loaded_options = None
   _globals['DESCRIPTOR']._serialized_options = b'\n\013com.exampleH\001\370\001\001\242\002\003MED'
-  _globals['_ANALYSISREQUEST']._serialized_start=32
-  _globals['_ANALYSISREQUEST']._serialized_end=142
-  _globals['_ANALYSISREPORT']._serialized_start=144
-  _globals['_ANALYSISREPORT']._serialized_end=220
-  _globals['_STREAMCHUNK']._serialized_start=222
-  _globals['_STREAMCHUNK']._serialized_end=271
-  _globals['_MEDICALAISERVICE']._serialized_start=274
-  _globals['_MEDICALAISERVICE']._serialized_end=461
+  _globals['_PRIORITY']._serialized_start=1207
+  _globals['_PRIORITY']._serialized_end=1245
+  _globals['_ANALYSISREQUEST']._serialized_start=33
+  _globals['_ANALYSISREQUEST']._serialized_end=261
+  _globals['_IMAGE']._serialized_start=263
+  _globals['_IMAGE']._serialized_end=303
+  _globals['_ANALYSISREPORT']._serialized_start=306
+  _globals['_ANALYSISREPORT']._serialized_end=507
+  _globals['_STAGETIMINGS']._serialized_start=510
+  _globals['_STAGETIMINGS']._serialized_end=671
+  _globals['_MODELINFO']._serialized_start=673
+  _globals['_MODELINFO']._serialized_end=753
+  _globals['_KEYINFO']._serialized_start=756
+  _globals['_KEYINFO']._serialized_end=910
+  _globals['_STREAMCHUNK']._serialized_start=912
+  _globals['_STREAMCHUNK']._serialized_end=1005
+  _globals['_SERVICESTATSREQUEST']._serialized_start=1007
+  _globals['_SERVICESTATSREQUEST']._serialized_end=1028
+  _globals['_SERVICESTATS']._serialized_start=1030
+  _globals['_SERVICESTATS']._serialized_end=1064
+  _globals['_RELOADKNOWLEDGEBASEREQUEST']._serialized_start=1066
+  _globals['_RELOADKNOWLEDGEBASEREQUEST']._serialized_end=1124
+  _globals['_RELOADKNOWLEDGEBASERESPONSE']._serialized_start=1126
+  _globals['_RELOADKNOWLEDGEBASERESPONSE']._serialized_end=1205
+  _globals['_MEDICALAISERVICE']._serialized_start=1248
+  _globals['_MEDICALAISERVICE']._serialized_end=1617
 # @@protoc_insertion_point(module_scope)
@@ -26,7 +26,7 @@ if _version_not_supported:
 
 
 class MedicalAIServiceStub(object):
-    """4. gRPC服务接口
+    """5. gRPC服务接口
     """
 
     def __init__(self, channel):
@@ -45,10 +45,20 @@ class MedicalAIServiceStub(object):
                 request_serializer=medical__ai__pb2.AnalysisRequest.SerializeToString,
                 response_deserializer=medical__ai__pb2.StreamChunk.FromString,
                 _registered_method=True)
+        self.GetServiceStats = channel.unary_unary(
+                '/medical_ai.MedicalAIService/GetServiceStats',
+                request_serializer=medical__ai__pb2.ServiceStatsRequest.SerializeToString,
+                response_deserializer=medical__ai__pb2.ServiceStats.FromString,
+                _registered_method=True)
+        self.ReloadKnowledgeBase = channel.unary_unary(
+                '/medical_ai.MedicalAIService/ReloadKnowledgeBase',
+                request_serializer=medical__ai__pb2.ReloadKnowledgeBaseRequest.SerializeToString,
+                response_deserializer=medical__ai__pb2.ReloadKnowledgeBaseResponse.FromString,
+                _registered_method=True)
 
 
 class MedicalAIServiceServicer(object):
-    """4. gRPC服务接口
+    """5. gRPC服务接口
     """
 
     def ProcessMedicalAnalysisSync(self, request, context):
@@ -65,6 +75,20 @@ class MedicalAIServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def GetServiceStats(self, request, context):
+        """运行统计
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReloadKnowledgeBase(self, request, context):
+        """知识库热更新：后台重建 medical_docs 索引，校验通过后原子切换
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_MedicalAIServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -78,6 +102,16 @@ def add_MedicalAIServiceServicer_to_server(servicer, server):
                     request_deserializer=medical__ai__pb2.AnalysisRequest.FromString,
                     response_serializer=medical__ai__pb2.StreamChunk.SerializeToString,
             ),
+            'GetServiceStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetServiceStats,
+                    request_deserializer=medical__ai__pb2.ServiceStatsRequest.FromString,
+                    response_serializer=medical__ai__pb2.ServiceStats.SerializeToString,
+            ),
+            'ReloadKnowledgeBase': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReloadKnowledgeBase,
+                    request_deserializer=medical__ai__pb2.ReloadKnowledgeBaseRequest.FromString,
+                    response_serializer=medical__ai__pb2.ReloadKnowledgeBaseResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'medical_ai.MedicalAIService', rpc_method_handlers)
@@ -87,7 +121,7 @@ def add_MedicalAIServiceServicer_to_server(servicer, server):
 
  # This class is part of an EXPERIMENTAL API.
 class MedicalAIService(object):
-    """4. gRPC服务接口
+    """5. gRPC服务接口
     """
 
     @staticmethod
@@ -143,3 +177,57 @@ class MedicalAIService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def GetServiceStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/medical_ai.MedicalAIService/GetServiceStats',
+            medical__ai__pb2.ServiceStatsRequest.SerializeToString,
+            medical__ai__pb2.ServiceStats.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReloadKnowledgeBase(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/medical_ai.MedicalAIService/ReloadKnowledgeBase',
+            medical__ai__pb2.ReloadKnowledgeBaseRequest.SerializeToString,
+            medical__ai__pb2.ReloadKnowledgeBaseResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
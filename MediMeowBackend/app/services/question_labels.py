@@ -0,0 +1,73 @@
+"""
+问卷题目标签缓存
+
+问卷导入新版本时会新建记录，已有版本的 questions 不再修改，因此 question_id → 题目标签
+的映射以 (问卷ID, 版本号) 为键缓存：导入问卷时写入，分析提交时命中则无需再读取和解析
+questions JSON。进程重启或其他进程导入的问卷在首次分析时从数据库加载并写入缓存。
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+
+def build_label_mapping(questions: Optional[List[Any]]) -> Dict[str, str]:
+    """从问卷的 questions 列表构造 question_id → 题目标签 的映射
+
+    Excel 导入和 Markdown 导入的题目文本保存在 question 字段，兼容使用 label 字段的旧数据。
+    """
+    mapping = {}
+    for question in questions or []:
+        if not isinstance(question, dict) or 'id' not in question:
+            continue
+        label = question.get('question') or question.get('label')
+        if label:
+            mapping[question['id']] = label
+    return mapping
+
+
+class QuestionLabelCache:
+    """线程安全的 LRU 缓存，键为 (问卷ID, 版本号)"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, int], Dict[str, str]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def from_settings(cls) -> "QuestionLabelCache":
+        return cls(max_entries=settings.QUESTION_LABEL_CACHE_SIZE)
+
+    def get(self, questionnaire_id: str, version: int) -> Optional[Dict[str, str]]:
+        key = (questionnaire_id, version)
+        with self._lock:
+            mapping = self._entries.get(key)
+            if mapping is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return mapping
+
+    def put(self, questionnaire_id: str, version: int, questions: Optional[List[Any]]) -> Dict[str, str]:
+        """解析 questions 并写入缓存，返回映射（调用方不得修改返回的字典）"""
+        mapping = build_label_mapping(questions)
+        if self.max_entries <= 0:
+            return mapping
+        with self._lock:
+            self._entries[(questionnaire_id, version)] = mapping
+            self._entries.move_to_end((questionnaire_id, version))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return mapping
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+# 进程内共享的题目标签缓存
+QUESTION_LABEL_CACHE = QuestionLabelCache.from_settings()
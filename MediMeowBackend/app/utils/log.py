@@ -0,0 +1,214 @@
+"""
+结构化日志
+
+- 每条日志输出为一行 JSON（LOG_FORMAT=text 时为可读文本），附带 request_id / submission_id / trace_id；
+- 请求线程只把记录放入内存队列（QueueHandler），由 QueueListener 后台线程写 stdout 或文件，
+  队列满时丢弃并计数，不阻塞请求；
+- LOG_LEVEL 为全局级别，LOG_LEVELS 按模块覆盖（如 "app.routers.questionnaire=DEBUG,sqlalchemy=WARNING"）；
+- DEBUG 记录按 LOG_DEBUG_SAMPLE_RATE 采样，单条记录可用 extra={"sample_rate": 1.0} 覆盖。
+
+用法:
+    logger = logging.getLogger(__name__)
+    logger.info("AI分析完成", extra={"status": "success", "elapsed_ms": 1234})
+"""
+import sys
+import copy
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from opentelemetry import trace
+
+from config import settings
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# 当前请求 / 提交的标识，由中间件和后台任务设置，记录日志时自动附加
+_CONTEXT: Dict[str, ContextVar] = {
+    "request_id": ContextVar("request_id", default=None),
+    "submission_id": ContextVar("submission_id", default=None),
+}
+
+# LogRecord 的标准属性，其余属性视为 extra 字段输出
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+_QUEUE_HANDLER: Optional["DroppingQueueHandler"] = None
+
+# 在调用线程中格式化异常堆栈（traceback 对象不能留到后台线程再处理）
+_EXC_FORMATTER = logging.Formatter()
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程中附加上下文标识和 trace_id（进入队列之前）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, var in _CONTEXT.items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, var.get())
+        span_context = trace.get_current_span().get_span_context()
+        record.trace_id = format(span_context.trace_id, "032x") if span_context.is_valid else None
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """按比例采样 DEBUG 记录，避免高频调试事件淹没日志"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = getattr(record, "sample_rate", self.rate)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON"""
+
+    def __init__(self, service_name: str):
+        super().__init__()
+        self.service_name = service_name
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "service": self.service_name,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and value is not None:
+                entry[key] = value
+        # 异常与调用栈由 DroppingQueueHandler.prepare 在入队前格式化为文本
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """本地开发用的可读格式，上下文字段附在行尾"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RESERVED_ATTRS and value is not None
+        )
+        return f"{line} [{fields}]" if fields else line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录并计数，不阻塞调用线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """在调用线程中固定消息与异常文本，供后台线程格式化
+
+        标准库的 prepare 会把异常堆栈拼进 msg 并清空 exc_info，JSON 中无法单独取出堆栈；
+        这里只合并 args，堆栈文本保存在 exc_text 中，由格式化器输出为单独的字段。
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(service_name: str = "medimeow-backend") -> None:
+    """配置根日志器：请求线程 -> 队列 -> 后台线程输出；重复调用无副作用"""
+    global _LISTENER, _QUEUE_HANDLER
+    if _LISTENER is not None:
+        return
+
+    if settings.LOG_FILE:
+        output = logging.FileHandler(settings.LOG_FILE, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(service_name) if settings.LOG_FORMAT == "json" else TextFormatter())
+
+    _QUEUE_HANDLER = DroppingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    _QUEUE_HANDLER.addFilter(DebugSamplingFilter(settings.LOG_DEBUG_SAMPLE_RATE))
+    _QUEUE_HANDLER.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [_QUEUE_HANDLER]
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in _parse_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _LISTENER = logging.handlers.QueueListener(_QUEUE_HANDLER.queue, output, respect_handler_level=True)
+    _LISTENER.start()
+
+
+def shutdown_logging() -> None:
+    """停止后台线程并写出队列中剩余的记录"""
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+
+def dropped_records() -> int:
+    return _QUEUE_HANDLER.dropped if _QUEUE_HANDLER is not None else 0
+
+
+@contextmanager
+def log_context(**fields):
+    """在代码块内为日志附加上下文标识（如后台任务的 submission_id）"""
+    tokens = [(_CONTEXT[key], _CONTEXT[key].set(value)) for key, value in fields.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+async def _bind_request_id(request: Request, call_next):
+    """为每个 HTTP 请求分配 request_id（沿用客户端的 X-Request-ID），并在响应头中返回"""
+    request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    with log_context(request_id=request_id):
+        response = await call_next(request)
+    response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
+def setup_request_context(app: FastAPI) -> None:
+    app.middleware("http")(_bind_request_id)
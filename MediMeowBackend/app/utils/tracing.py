@@ -0,0 +1,189 @@
+"""
+OpenTelemetry 链路追踪
+
+覆盖 FastAPI 请求、SQLAlchemy 查询、后台 AI 分析任务和 gRPC 客户端调用，
+并通过 gRPC metadata 将 trace 上下文传递给 AI 服务，便于按提交定位长尾耗时。
+"""
+import os
+import threading
+from typing import Dict, Optional, Sequence
+
+import grpc
+from fastapi import FastAPI, Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from opentelemetry import trace, propagate
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider, ReadableSpan
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+    SpanExportResult,
+)
+from config import settings
+
+_TRACER_NAME = "medimeow.backend"
+_SPAN_ATTR = "_otel_span"
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """将 span 以 JSON Lines 格式追加写入本地文件（本地 Collector 替代）"""
+
+    def __init__(self, file_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self._file = open(file_path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _create_exporter() -> Optional[SpanExporter]:
+    exporter = settings.TRACING_EXPORTER.lower()
+    if exporter == "file":
+        return JsonLinesSpanExporter(settings.TRACING_FILE)
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter(endpoint=settings.OTLP_ENDPOINT, insecure=True)
+    if exporter == "console":
+        return ConsoleSpanExporter()
+    return None
+
+
+def get_tracer() -> trace.Tracer:
+    return trace.get_tracer(_TRACER_NAME)
+
+
+def setup_tracing(app: FastAPI, engine: Engine, service_name: str = "medimeow-backend") -> None:
+    """初始化 TracerProvider，并为 FastAPI 应用和数据库引擎挂载追踪"""
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    exporter = _create_exporter()
+    if exporter is not None:
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    app.middleware("http")(_trace_http_request)
+    _instrument_engine(engine)
+
+
+async def _trace_http_request(request: Request, call_next):
+    """为每个 HTTP 请求创建服务端 span"""
+    tracer = get_tracer()
+    with tracer.start_as_current_span(
+        f"{request.method} {request.url.path}",
+        context=propagate.extract(dict(request.headers)),
+        kind=SpanKind.SERVER,
+        attributes={
+            "http.method": request.method,
+            "http.target": request.url.path,
+        }
+    ) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            # 使用路由模板命名，避免 record_id 等路径参数导致 span 名称发散
+            span.update_name(f"{request.method} {route.path}")
+            span.set_attribute("http.route", route.path)
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_status(Status(StatusCode.ERROR))
+        return response
+
+
+def _instrument_engine(engine: Engine) -> None:
+    """通过 SQLAlchemy 事件为每条 SQL 创建 span"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = get_tracer().start_span(
+            statement.split(None, 1)[0].upper() if statement else "SQL",
+            kind=SpanKind.CLIENT,
+            attributes={
+                "db.system": engine.dialect.name,
+                "db.statement": statement[:500],
+            }
+        )
+        setattr(context, _SPAN_ATTR, span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, _SPAN_ATTR, None)
+        if span is not None:
+            span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        span = getattr(exception_context.execution_context, _SPAN_ATTR, None)
+        if span is not None:
+            span.set_status(Status(StatusCode.ERROR, str(exception_context.original_exception)[:200]))
+            span.end()
+
+
+def current_carrier() -> Dict[str, str]:
+    """导出当前 trace 上下文，用于传递给后台任务"""
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def start_background_span(name: str, carrier: Optional[Dict[str, str]], **attributes):
+    """在后台任务中创建 span，并关联到发起请求的 trace"""
+    return get_tracer().start_as_current_span(
+        name,
+        context=propagate.extract(carrier or {}),
+        kind=SpanKind.INTERNAL,
+        attributes=attributes
+    )
+
+
+class _ClientCallDetails(grpc.ClientCallDetails):
+    def __init__(self, method, timeout, metadata, credentials, wait_for_ready, compression):
+        self.method = method
+        self.timeout = timeout
+        self.metadata = metadata
+        self.credentials = credentials
+        self.wait_for_ready = wait_for_ready
+        self.compression = compression
+
+
+class GrpcClientTracingInterceptor(grpc.UnaryUnaryClientInterceptor):
+    """为 gRPC 调用创建客户端 span，并将 traceparent 注入 metadata"""
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        method = client_call_details.method
+        if isinstance(method, bytes):
+            method = method.decode("utf-8")
+        with get_tracer().start_as_current_span(
+            method.lstrip("/"),
+            kind=SpanKind.CLIENT,
+            attributes={"rpc.system": "grpc", "rpc.method": method}
+        ) as span:
+            metadata = list(client_call_details.metadata or [])
+            carrier: Dict[str, str] = {}
+            propagate.inject(carrier)
+            metadata.extend(carrier.items())
+
+            details = _ClientCallDetails(
+                client_call_details.method,
+                client_call_details.timeout,
+                metadata,
+                client_call_details.credentials,
+                client_call_details.wait_for_ready,
+                client_call_details.compression
+            )
+            call = continuation(details, request)
+            code = call.code()
+            span.set_attribute("rpc.grpc.status_code", code.value[0])
+            if code != grpc.StatusCode.OK:
+                span.set_status(Status(StatusCode.ERROR, code.name))
+            return call
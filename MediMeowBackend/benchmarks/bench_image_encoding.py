@@ -0,0 +1,159 @@
+"""
+图片读取/编码对比测试
+
+生成若干张随机内容的大图片（默认 3 张 × 10 MB），分别按以下方式构造发往 AI 服务的请求并序列化：
+- inline:     在事件循环中同步读取、Base64 编码、拼接 data URL 字符串（原实现）；
+- thread-b64: 在线程池中并发读取并编码为 data URL 字符串（images_base64 字段）；
+- thread-raw: 在线程池中并发读取，原始字节直接放入 Image 消息（images 字段，当前实现）。
+
+每种方式在独立子进程中运行，输出：
+- 事件循环阻塞：读取/编码期间心跳协程每 1ms 唤醒一次，统计最大延迟与累计延迟；
+- 序列化耗时（gRPC 发送前在调用线程中进行）与序列化后的请求大小；
+- 峰值内存：进程 RSS 峰值（ru_maxrss）相对处理前的增量，包含序列化。
+
+注意：Base64 编码和消息复制不释放 GIL，放入线程池后仍会与事件循环线程争抢 GIL，
+因此 thread-b64 方式的累计阻塞并不会明显减少。
+
+运行:
+    python benchmarks/bench_image_encoding.py --images 3 --image-mb 10
+"""
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+MODES = ["inline", "thread-b64", "thread-raw"]
+
+
+def _peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _heartbeat(lags_ms: List[float], stop: asyncio.Event) -> None:
+    """每 1ms 唤醒一次，记录实际唤醒时间比预期晚了多少（即事件循环被阻塞的时间）"""
+    interval = 0.001
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags_ms.append(max((time.perf_counter() - start - interval) * 1000, 0.0))
+
+
+def _inline_encode(file_path: str) -> str:
+    """原实现：读取、编码、拼接前缀均在调用线程中完成"""
+    with open(file_path, 'rb') as image_file:
+        image_data = image_file.read()
+        image_base64 = base64.b64encode(image_data).decode('utf-8')
+    return f"data:image/jpeg;base64,{image_base64}"
+
+
+async def _read(mode: str, file_ids: List[str], upload_dir: str):
+    from app.services.ai_service import AIService
+
+    if mode == "inline":
+        return [_inline_encode(os.path.join(upload_dir, f"{file_id}.jpg")) for file_id in file_ids]
+    if mode == "thread-b64":
+        return await asyncio.gather(*(
+            asyncio.to_thread(_inline_encode, os.path.join(upload_dir, f"{file_id}.jpg")) for file_id in file_ids
+        ))
+    return await AIService._read_images(file_ids)
+
+
+def _serialize(mode: str, images) -> int:
+    """按 AIService._call_grpc_ai_service 的方式构造请求并序列化，返回字节数"""
+    from app.services.ai_service import pb2
+
+    if mode == "thread-raw":
+        request = pb2.AnalysisRequest(patient_text_data="压测")
+        for data, mime_type in images:
+            request.images.add(data=data, mime_type=mime_type)
+    else:
+        request = pb2.AnalysisRequest(patient_text_data="压测", images_base64=images)
+    return len(request.SerializeToString())
+
+
+async def _run_child(mode: str, file_ids: List[str], upload_dir: str) -> dict:
+    lags_ms: List[float] = []
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(lags_ms, stop))
+    await asyncio.sleep(0.05)
+    lags_ms.clear()
+
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    images = await _read(mode, file_ids, upload_dir)
+    read_ms = (time.perf_counter() - start) * 1000
+    stop.set()
+    await heartbeat
+
+    start = time.perf_counter()
+    payload_bytes = _serialize(mode, images)
+    serialize_ms = (time.perf_counter() - start) * 1000
+    return {
+        "mode": mode,
+        "read_ms": round(read_ms, 1),
+        "serialize_ms": round(serialize_ms, 1),
+        "loop_max_lag_ms": round(max(lags_ms, default=0.0), 1),
+        "loop_total_lag_ms": round(sum(lags_ms), 1),
+        "peak_rss_delta_mb": round(_peak_rss_mb() - rss_before, 1),
+        "payload_mb": round(payload_bytes / 1024 / 1024, 1),
+    }
+
+
+def child_main(args) -> None:
+    os.environ["UPLOAD_DIR"] = args.upload_dir
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(args.upload_dir, "bench.db"))
+    os.environ.setdefault("TRACING_EXPORTER", "none")
+    sys.path.insert(0, str(BACKEND_DIR))
+    # 预先导入，避免将模块加载计入内存和耗时
+    import app.services.ai_service  # noqa: F401
+    file_ids = [f"bench-{i}" for i in range(args.images)]
+    print(json.dumps(asyncio.run(_run_child(args.mode, file_ids, args.upload_dir))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片读取/编码对比测试")
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--image-mb", type=float, default=10)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--upload-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        child_main(args)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="medimeow-bench-images-") as upload_dir:
+        size = int(args.image_mb * 1024 * 1024)
+        for i in range(args.images):
+            with open(os.path.join(upload_dir, f"bench-{i}.jpg"), "wb") as f:
+                f.write(os.urandom(size))
+
+        results = []
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--upload-dir", upload_dir,
+                 "--images", str(args.images)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"\n图片 {args.images} 张 × {args.image_mb:g} MB")
+    print(f"{'方式':<12} {'读取/编码ms':>11} {'循环最大阻塞ms':>14} {'循环累计阻塞ms':>14} {'序列化ms':>9} "
+          f"{'峰值内存增量MB':>14} {'请求大小MB':>10}")
+    for r in results:
+        print(f"{r['mode']:<12} {r['read_ms']:>11} {r['loop_max_lag_ms']:>14} {r['loop_total_lag_ms']:>14} "
+              f"{r['serialize_ms']:>9} {r['peak_rss_delta_mb']:>14} {r['payload_mb']:>10}")
+
+
+if __name__ == "__main__":
+    main()
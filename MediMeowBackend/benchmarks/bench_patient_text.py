@@ -0,0 +1,131 @@
+"""
+患者文本构造吞吐对比测试（题目标签缓存）
+
+构造一份包含 N 道题（每题若干选项）的问卷和对应答案，比较每次分析提交前准备患者文本的吞吐：
+- 纯 CPU：无缓存（解析 questions JSON → 构造标签映射 → _construct_patient_text_data）
+  与有缓存（缓存命中 → _construct_patient_text_data）；
+- 含数据库（临时 SQLite）：原实现（科室、问卷、用户三次查询，每次解析 questions）
+  与当前实现（_load_analysis_context 一次查询 + 缓存命中）。
+
+运行:
+    python benchmarks/bench_patient_text.py --questions 30 --options 5 --seconds 2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _throughput(fn: Callable[[], object], seconds: float) -> float:
+    """在 seconds 秒内反复调用 fn，返回每秒调用次数"""
+    fn()
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(20):
+            fn()
+        count += 20
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="患者文本构造吞吐对比测试")
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--options", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medimeow-bench-text-")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.setdefault("UPLOAD_DIR", workdir)
+    os.environ.setdefault("TRACING_EXPORTER", "none")
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from app.database import Base, engine, SessionLocal
+    from app.models.user import User
+    from app.models.department import Department
+    from app.models.questionnaire import Questionnaire
+    from app.services.ai_service import AIService
+    from app.services.question_labels import QuestionLabelCache, build_label_mapping, QUESTION_LABEL_CACHE
+
+    questions = [
+        {
+            "id": f"f{i}",
+            "type": "single",
+            "question": f"请选择您的第{i}项症状表现",
+            "required": True,
+            "options": [f"{chr(65 + j)}. 选项{j}：持续时间与伴随症状描述" for j in range(args.options)],
+        }
+        for i in range(args.questions)
+    ]
+    questions_json = json.dumps(questions, ensure_ascii=False)
+    questionnaire_data = {
+        "questionnaire_id": "bench-q",
+        "user_id": "bench-u",
+        "department_id": "bench-d",
+        "height": 176,
+        "weight": 85,
+        "answers": {q["id"]: q["options"][0] for q in questions},
+    }
+    user_info = AIService._format_user_info("压测患者", "男", "2005-01-01")
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.add(User(id="bench-u", username="压测患者", phone_number="13800000000", password="x",
+                gender="男", birth="2005-01-01"))
+    db.add(Department(id="bench-d", department_name="呼吸内科"))
+    db.add(Questionnaire(id="bench-q", department_id="bench-d", title="压测问卷", questions=questions, version=1))
+    db.commit()
+
+    cache = QuestionLabelCache(max_entries=16)
+    cache.put("bench-q", 1, questions)
+
+    def cpu_uncached():
+        mapping = build_label_mapping(json.loads(questions_json))
+        return AIService._construct_patient_text_data(questionnaire_data, mapping, "呼吸内科", user_info)
+
+    def cpu_cached():
+        mapping = cache.get("bench-q", 1)
+        return AIService._construct_patient_text_data(questionnaire_data, mapping, "呼吸内科", user_info)
+
+    def db_legacy():
+        # 原实现：三次独立查询，每次重新加载并解析 questions
+        db.expire_all()
+        department = db.query(Department).filter(Department.id == "bench-d").first()
+        questionnaire = db.query(Questionnaire).filter(Questionnaire.id == "bench-q").first()
+        mapping = build_label_mapping(questionnaire.questions)
+        user = db.query(User).filter(User.id == "bench-u").first()
+        info = AIService._format_user_info(user.username, user.gender, user.birth)
+        return AIService._construct_patient_text_data(questionnaire_data, mapping, department.department_name, info)
+
+    def db_current():
+        db.expire_all()
+        department_name, mapping, info = AIService._load_analysis_context("bench-q", "bench-u", "bench-d", db)
+        return AIService._construct_patient_text_data(questionnaire_data, mapping, department_name, info)
+
+    assert cpu_uncached() == cpu_cached() == db_legacy() == db_current()
+
+    results = [
+        ("纯CPU 无缓存", _throughput(cpu_uncached, args.seconds)),
+        ("纯CPU 缓存", _throughput(cpu_cached, args.seconds)),
+        ("SQLite 原实现(3次查询)", _throughput(db_legacy, args.seconds)),
+        ("SQLite 当前(1次查询+缓存)", _throughput(db_current, args.seconds)),
+    ]
+    db.close()
+
+    print(f"\n问卷 {args.questions} 题 × {args.options} 选项，questions JSON {len(questions_json.encode())} 字节")
+    print(f"{'方式':<26} {'次/秒':>10} {'单次µs':>9}")
+    for name, rate in results:
+        print(f"{name:<26} {rate:>10.0f} {1e6 / rate:>9.1f}")
+    print(f"缓存统计: {QUESTION_LABEL_CACHE.stats()}")
+
+
+if __name__ == "__main__":
+    main()
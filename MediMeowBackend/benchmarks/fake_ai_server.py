@@ -0,0 +1,127 @@
+"""
+压测用假 AI 服务（gRPC MedicalAIService）
+
+按可配置的延迟返回固定的 Markdown 结构化报告，接口与真实 AI 服务一致，
+用于在没有模型和 GPU 的环境中压测后端的提交 → 分析 → 医生审阅流程。
+
+运行:
+    python benchmarks/fake_ai_server.py --port 50061 --latency-ms 2000
+"""
+import sys
+import time
+import random
+import argparse
+import threading
+from concurrent import futures
+from pathlib import Path
+
+import grpc
+
+# grpc_client 目录没有 __init__.py，按命名空间包导入以保留生成代码中的相对导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app" / "services"))
+from grpc_client import medical_ai_pb2 as pb2
+from grpc_client import medical_ai_pb2_grpc as pb2_grpc
+
+FAKE_REPORT = """### 1. 【患者主诉 (Subjective)】
+咽喉疼痛两天，伴低热（压测假数据）。
+
+### 2. 【关键症状 (Key Symptoms)】
+吞咽痛、咳嗽、低热。
+
+### 3. 【影像总结 (Image Observation)】
+舌质偏红，苔薄黄。
+
+### 4. 【重要笔记 (Key Considerations)】
+注意体温变化，排除化脓性扁桃体炎。
+
+### 5. 【风险等级 (Risk Level)】
+低
+
+### 6. 【建议科室 (Department)】
+{department}
+"""
+
+
+class FakeMedicalAIService(pb2_grpc.MedicalAIServiceServicer):
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.served = 0
+
+    def _analyze(self, request) -> pb2.AnalysisReport:
+        with self._lock:
+            self.inflight += 1
+        start = time.perf_counter()
+        try:
+            delay = max(self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0.0) / 1000
+            time.sleep(delay)
+            total_ms = (time.perf_counter() - start) * 1000
+            if random.random() < self.error_rate:
+                return pb2.AnalysisReport(status="INTERNAL_ERROR", message="假服务随机错误")
+            return pb2.AnalysisReport(
+                structured_report=FAKE_REPORT.format(department=request.patient_department),
+                status="SUCCESS",
+                message="AI分析完成",
+                timings=pb2.StageTimings(
+                    stage1_ms=total_ms * 0.3,
+                    keyword_ms=total_ms * 0.2,
+                    vector_search_ms=total_ms * 0.05,
+                    stage3_ms=total_ms * 0.45,
+                    total_ms=total_ms
+                ),
+                model_info=pb2.ModelInfo(llm_model="fake", embedding_model="fake", service_version="fake"),
+                key_info=pb2.KeyInfo(
+                    chief_complaint="咽喉疼痛两天，伴低热（压测假数据）。",
+                    key_symptoms="吞咽痛、咳嗽、低热。",
+                    image_summary="舌质偏红，苔薄黄。",
+                    important_notes="注意体温变化，排除化脓性扁桃体炎。",
+                    risk_level="低",
+                    suggested_department=request.patient_department
+                )
+            )
+        finally:
+            with self._lock:
+                self.inflight -= 1
+                self.served += 1
+
+    def ProcessMedicalAnalysisSync(self, request, context):
+        return self._analyze(request)
+
+    def ProcessMedicalAnalysis(self, request, context):
+        report = self._analyze(request)
+        yield pb2.StreamChunk(chunk_data=report.SerializeToString(), is_end=True)
+
+
+def start_fake_ai_server(port: int, latency_ms: float = 2000, jitter_ms: float = 500,
+                         error_rate: float = 0.0, max_workers: int = 64):
+    """启动假 AI 服务，返回 (grpc.Server, servicer)"""
+    servicer = FakeMedicalAIService(latency_ms, jitter_ms, error_rate)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    pb2_grpc.add_MedicalAIServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+    return server, servicer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测用假 AI 服务")
+    parser.add_argument("--port", type=int, default=50061)
+    parser.add_argument("--latency-ms", type=float, default=2000)
+    parser.add_argument("--jitter-ms", type=float, default=500)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=64)
+    args = parser.parse_args()
+
+    server, _ = start_fake_ai_server(args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.workers)
+    print(f"假 AI 服务已启动: 127.0.0.1:{args.port}")
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,6 +42,55 @@ class Settings(BaseSettings):
         default="127.0.0.1:50051",
         description="AI服务主机地址"
     )
+    AI_RPC_TIMEOUT_SECONDS: float = Field(
+        default=120.0,
+        description="单次AI分析RPC的超时时间（秒），超时后AI服务会中止进行中的LLM调用"
+    )
+
+    # AI服务熔断与降级重试
+    AI_BREAKER_FAILURE_THRESHOLD: int = Field(default=5, description="连续失败多少次后熔断")
+    AI_BREAKER_RECOVERY_SECONDS: float = Field(default=30.0, description="熔断后多久允许探测请求")
+    AI_BREAKER_HALF_OPEN_CALLS: int = Field(default=1, description="半开状态下同时放行的探测请求数")
+    AI_RETRY_ENABLED: bool = Field(default=True, description="是否在后台重新分析降级的提交")
+    AI_RETRY_RATE_PER_MINUTE: float = Field(default=30.0, description="重新分析的速率上限（次/分钟）")
+    AI_RETRY_POLL_SECONDS: float = Field(default=10.0, description="重试队列为空或熔断中时的轮询间隔")
+    AI_RETRY_MAX_ATTEMPTS: int = Field(default=10, description="单个提交的最大重试次数")
+    AI_RETRY_BACKOFF_SECONDS: float = Field(default=60.0, description="重试失败后的初始退避时间（指数增长）")
+    AI_RETRY_MAX_BACKOFF_SECONDS: float = Field(default=3600.0, description="重试退避时间上限")
+    AI_PROCESSING_TIMEOUT_SECONDS: float = Field(
+        default=900.0,
+        description="提交停留在 processing 状态超过该时间（秒）视为分析中断（如进程重启），由重试任务重新分析"
+    )
+    QUESTION_LABEL_CACHE_SIZE: int = Field(default=1024, description="缓存的问卷版本数（题目ID到标签的映射），0 表示不缓存")
+    DEPARTMENT_TAXONOMY_TTL_SECONDS: float = Field(
+        default=300.0,
+        description="科室分类（名称、别名、大类）缓存时间（秒），其他进程修改科室后最多经过该时间生效"
+    )
+
+    # 日志配置
+    LOG_LEVEL: str = Field(default="INFO", description="全局日志级别")
+    LOG_LEVELS: str = Field(
+        default="",
+        description="按模块覆盖日志级别，如 app.routers.questionnaire=DEBUG,sqlalchemy=WARNING"
+    )
+    LOG_FORMAT: str = Field(default="json", description="日志格式 (json/text)")
+    LOG_FILE: str = Field(default="", description="日志文件路径，为空时输出到 stdout")
+    LOG_QUEUE_SIZE: int = Field(default=10000, description="日志队列容量，队列满时丢弃新记录")
+    LOG_DEBUG_SAMPLE_RATE: float = Field(default=0.1, description="DEBUG 日志的采样比例")
+
+    # 链路追踪配置 (OpenTelemetry)
+    TRACING_EXPORTER: str = Field(
+        default="none",
+        description="追踪导出方式 (file/otlp/console/none)；file 方式持续追加、不轮转，只适合本地短时排查"
+    )
+    TRACING_FILE: str = Field(
+        default="./traces/backend-spans.jsonl",
+        description="file 导出方式的输出文件"
+    )
+    OTLP_ENDPOINT: str = Field(
+        default="http://127.0.0.1:4317",
+        description="OTLP Collector 地址"
+    )
 
     class Config:
         env_file = ".env"
@@ -9,7 +9,8 @@ project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
 from app.database import SessionLocal
-from app.models.department import Department
+from app.models.department import Department, DepartmentAlias
+from app.services.department_taxonomy import DEFAULT_DEPARTMENT_TAXONOMY
 import uuid
 
 
@@ -38,6 +39,11 @@ def create_departments_from_questionnaires():
         from app.models.medical_record import MedicalRecord
         records_deleted = db.query(MedicalRecord).delete()
         print(f"   已删除 {records_deleted} 个就诊记录")
+
+        # AI 重试队列同样依赖 submission_id
+        from app.models.ai_retry import AIRetryTask
+        retry_deleted = db.query(AIRetryTask).delete()
+        print(f"   已删除 {retry_deleted} 个 AI 重试任务")
         
         # 2. 删除问卷提交记录
         from app.models.questionnaire import QuestionnaireSubmission
@@ -54,7 +60,8 @@ def create_departments_from_questionnaires():
         doctors_deleted = db.query(Doctor).delete()
         print(f"   已删除 {doctors_deleted} 个医生")
         
-        # 5. 删除科室
+        # 5. 删除科室别名和科室
+        db.query(DepartmentAlias).delete()
         departments_deleted = db.query(Department).delete()
         print(f"   已删除 {departments_deleted} 个科室")
         
@@ -68,11 +75,16 @@ def create_departments_from_questionnaires():
         created_count = 0
         
         for dept_name in required_departments:
+            # 所属大类和别名用于AI建议科室的匹配，未在默认分类中的科室仅按名称匹配
+            category, aliases = DEFAULT_DEPARTMENT_TAXONOMY.get(dept_name, (None, []))
             department = Department(
                 id=str(uuid.uuid4()),
-                department_name=dept_name
+                department_name=dept_name,
+                category=category
             )
             db.add(department)
+            for alias in aliases:
+                db.add(DepartmentAlias(department_id=department.id, alias=alias))
             print(f"  ✅ 创建科室: {dept_name}")
             created_count += 1
         
@@ -121,6 +121,11 @@ def import_questionnaires():
         from app.models.medical_record import MedicalRecord
         records_deleted = db.query(MedicalRecord).delete()
         print(f"   已删除 {records_deleted} 个就诊记录")
+
+        # AI 重试队列同样依赖 submission_id
+        from app.models.ai_retry import AIRetryTask
+        retry_deleted = db.query(AIRetryTask).delete()
+        print(f"   已删除 {retry_deleted} 个 AI 重试任务")
         
         # 2. 再删除问卷提交记录（依赖 questionnaire_id）
         from app.models.questionnaire import QuestionnaireSubmission
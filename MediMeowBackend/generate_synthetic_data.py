@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+生成大规模合成数据（用户、问卷提交、就诊记录、AI 分析结果）
+
+用于在生产量级下检查查询计划与分页行为：
+- 答案取自数据库中已导入的问卷（即 docs/questionnaire 的题目和选项）；
+- 就诊记录覆盖 waiting / in_progress / completed / cancelled 各状态，ai_result 覆盖成功、科室错误、降级；
+- 相同 --seed 生成完全相同的数据（含 UUID）；
+- 默认按批次多行 INSERT；MariaDB 可使用 --method load-data 走 LOAD DATA LOCAL INFILE。
+
+前置条件：已运行 create_departments.py、create_questionnaires_from_md.py（建议再运行 create_doctors_for_all_departments.py）
+
+用法:
+    python generate_synthetic_data.py --users 200000 --submissions 1000000 --seed 42
+    python generate_synthetic_data.py --users 200000 --submissions 1000000 --method load-data
+"""
+import sys
+import os
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import bcrypt
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from config import settings
+from app.database import Base
+from app.models.user import User
+from app.models.department import Department
+from app.models.doctor import Doctor
+from app.models.questionnaire import Questionnaire, QuestionnaireSubmission
+from app.models.medical_record import MedicalRecord
+
+# 所有合成用户共用同一个密码（逐个计算 bcrypt 哈希会让生成速度下降几个数量级）
+SYNTHETIC_PASSWORD = "synthetic123"
+
+# 就诊记录状态分布
+RECORD_STATUS_WEIGHTS = {"completed": 0.70, "waiting": 0.15, "in_progress": 0.05, "cancelled": 0.10}
+
+# 科室错误的提交对应 cancelled 的就诊记录，其余按上面的分布
+AI_STATUS_WEIGHTS = {"success": 0.88, "fallback": 0.07, "department_error": 0.05}
+
+PRIORITY_WEIGHTS = {"normal": 0.80, "high": 0.12, "urgent": 0.03, "low": 0.05}
+
+GENDERS = ["男", "女"]
+ETHNICITIES = ["汉族"] * 18 + ["回族", "壮族", "满族", "维吾尔族"]
+ORIGINS = ["北京市", "上海市", "广东省", "浙江省", "江苏省", "四川省", "湖北省", "山东省", "河南省", "福建省"]
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗"
+GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂"
+HISTORY_TEXTS = ["无", "高血压病史 5 年", "2 型糖尿病", "青霉素过敏", "阑尾切除术后", "哮喘病史", "无特殊"]
+RISK_LEVELS = ["低", "中等", "高"]
+REPORT_TEXTS = [
+    "考虑上呼吸道感染，对症治疗，三日后复诊。",
+    "建议完善血常规及影像学检查。",
+    "症状较轻，注意休息，清淡饮食。",
+    "建议转专科进一步评估。",
+]
+
+
+def _weighted(rng: random.Random, weights: Dict[str, float]) -> str:
+    return rng.choices(list(weights.keys()), weights=list(weights.values()))[0]
+
+
+def _uuid(rng: random.Random) -> str:
+    """由种子随机数生成的 UUID4，保证结果可复现"""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+class SyntheticDataGenerator:
+    """按批次生成各表的行数据"""
+
+    def __init__(self, rng: random.Random, departments: List[dict], days: int, now: datetime):
+        self.rng = rng
+        self.departments = departments
+        self.days = days
+        self.now = now
+        self.queue_numbers = {dept["id"]: 0 for dept in departments}
+
+    def _random_time(self, after: Optional[datetime] = None) -> datetime:
+        start = after or self.now - timedelta(days=self.days)
+        span = max((self.now - start).total_seconds(), 1.0)
+        return start + timedelta(seconds=self.rng.random() * span)
+
+    def users(self, count: int, phone_base: int, password_hash: str) -> Iterator[dict]:
+        rng = self.rng
+        for i in range(count):
+            created_at = self._random_time()
+            birth = datetime(1940, 1, 1) + timedelta(days=rng.randint(0, 365 * 80))
+            yield {
+                "id": _uuid(rng),
+                # 15 开头的 11 位手机号，按序号递增保证唯一
+                "phone_number": f"15{(phone_base + i) % 10 ** 9:09d}",
+                "password": password_hash,
+                "username": rng.choice(SURNAMES) + "".join(rng.choices(GIVEN_NAMES, k=rng.randint(1, 2))),
+                "gender": rng.choice(GENDERS),
+                "birth": birth.strftime("%Y-%m-%d"),
+                "ethnicity": rng.choice(ETHNICITIES),
+                "origin": rng.choice(ORIGINS),
+                "created_at": created_at,
+                "updated_at": None,
+                "deleted_at": None,
+            }
+
+    def _answers(self, questions: List[dict]) -> dict:
+        rng = self.rng
+        answers = {}
+        for question in questions:
+            if question.get("options"):
+                answers[question["id"]] = rng.choice(question["options"])
+            elif question.get("type") in ("text", "textarea") and rng.random() < 0.4:
+                answers[question["id"]] = rng.choice(HISTORY_TEXTS)
+        return answers
+
+    def _ai_result(self, status: str, department_name: str, answers: dict) -> dict:
+        rng = self.rng
+        stage1 = rng.lognormvariate(8.6, 0.35)
+        keyword = rng.lognormvariate(7.6, 0.4)
+        vector = rng.lognormvariate(3.5, 0.5)
+        stage3 = rng.lognormvariate(9.4, 0.35)
+        queue_wait = rng.expovariate(1 / 150)
+        total = queue_wait + stage1 + keyword + vector + stage3
+        symptoms = "；".join(str(v) for v in list(answers.values())[:3]) or "患者描述了相关症状"
+
+        if status == "fallback":
+            return {
+                "is_department": True,
+                "key_info": {
+                    "chief_complaint": "AI服务暂时不可用，请医生根据问卷判断",
+                    "key_symptoms": "需要医生进一步询问",
+                    "image_summary": "AI服务降级，未分析图片",
+                    "important_notes": "AI服务暂时不可用，建议人工判断",
+                    "risk_level": "未知",
+                    "suggested_department": department_name
+                },
+                "analysis_time": "0.0s",
+                "model_version": "fallback-v1.0",
+                "status": "fallback"
+            }
+
+        result = {
+            "analysis_time": f"{total / 1000:.2f}s",
+            "timings": {
+                "queue_wait_ms": round(queue_wait, 1),
+                "stage1_ms": round(stage1, 1),
+                "keyword_ms": round(keyword, 1),
+                "vector_search_ms": round(vector, 1),
+                "stage3_ms": round(stage3, 1),
+                "total_ms": round(total, 1),
+            },
+            "model_version": "v1.1",
+            "models": {"llm": "glm-4.1v-thinking-flash", "embedding": "BAAI/bge-small-zh"},
+        }
+        if status == "department_error":
+            result.update({
+                "is_department": False,
+                "key_info": {
+                    "chief_complaint": "科室选择错误",
+                    "key_symptoms": symptoms,
+                    "image_summary": "由于科室选择错误，未进行完整分析",
+                    "important_notes": "请重新选择正确的科室",
+                    "risk_level": "未评估",
+                    "suggested_department": "请根据症状重新选择"
+                },
+                "status": "department_error",
+                "structured_report": "科室选择错误，请重新选择",
+                "error_message": "科室选择错误，请重新选择正确的科室"
+            })
+            return result
+
+        risk = rng.choice(RISK_LEVELS)
+        result.update({
+            "is_department": True,
+            "key_info": {
+                "chief_complaint": symptoms[:80],
+                "key_symptoms": symptoms,
+                "image_summary": "图片已分析",
+                "important_notes": "请结合线下检查判断",
+                "risk_level": risk,
+                "suggested_department": department_name
+            },
+            "status": "success",
+            "structured_report": (
+                f"### 1. 【患者主诉 (Chief Complaint)】\n{symptoms}\n\n"
+                f"### 5. 【风险等级 (Risk Level)】\n{risk}\n\n"
+                f"### 6. 【建议科室 (Department)】\n{department_name}\n"
+            )
+        })
+        return result
+
+    def submissions_and_records(self, count: int, users: List[tuple]) -> Iterator[tuple]:
+        """生成 (submission, medical_record) 行；users 为 [(user_id, created_at)]"""
+        rng = self.rng
+        for _ in range(count):
+            user_id, user_created_at = rng.choice(users)
+            dept = rng.choice(self.departments)
+            submit_time = self._random_time(user_created_at)
+            answers = self._answers(dept["questions"])
+
+            # 最近一小时内的提交有一部分仍在等待 AI 分析
+            recent = (self.now - submit_time).total_seconds() < 3600
+            if recent and rng.random() < 0.5:
+                ai_status, ai_result, submission_status = None, None, "pending"
+            else:
+                ai_status = _weighted(rng, AI_STATUS_WEIGHTS)
+                ai_result = self._ai_result(ai_status, dept["name"], answers)
+                submission_status = "completed"
+
+            submission_id = _uuid(rng)
+            analyzed_at = submit_time + timedelta(seconds=rng.uniform(5, 60))
+            submission = {
+                "id": submission_id,
+                "user_id": user_id,
+                "questionnaire_id": dept["questionnaire_id"],
+                "department_id": dept["id"],
+                "answers": answers,
+                "file_ids": [_uuid(rng)] if rng.random() < 0.6 else None,
+                "height": rng.randint(150, 192),
+                "weight": rng.randint(42, 110),
+                "ai_result": ai_result,
+                "status": submission_status,
+                "submit_time": submit_time,
+                "created_at": submit_time,
+                "updated_at": analyzed_at if ai_result else None,
+                "deleted_at": None,
+            }
+
+            if ai_status == "department_error":
+                record_status = "cancelled"
+            elif ai_status is None:
+                record_status = "waiting"
+            else:
+                record_status = _weighted(rng, RECORD_STATUS_WEIGHTS)
+
+            self.queue_numbers[dept["id"]] += 1
+            completed = record_status == "completed"
+            seen = record_status in ("completed", "in_progress")
+            doctor_id = dept["doctor_id"] if seen else None
+            consultation_time = analyzed_at + timedelta(minutes=rng.uniform(5, 240)) if seen else None
+            record = {
+                "id": _uuid(rng),
+                "user_id": user_id,
+                "doctor_id": doctor_id,
+                "submission_id": submission_id,
+                "department_id": dept["id"],
+                "report": rng.choice(REPORT_TEXTS) if completed else None,
+                "diagnosis": None,
+                "prescription": None,
+                "treatment_plan": None,
+                "status": record_status,
+                "priority": _weighted(rng, PRIORITY_WEIGHTS),
+                "queue_number": self.queue_numbers[dept["id"]],
+                "appointment_time": None,
+                "consultation_time": consultation_time,
+                "completion_time": consultation_time + timedelta(minutes=rng.uniform(5, 30)) if completed else None,
+                "created_at": submit_time,
+                "updated_at": consultation_time,
+                "deleted_at": None,
+            }
+            yield submission, record
+
+
+# ---------------------------------------------------------------------------
+# 写入方式
+# ---------------------------------------------------------------------------
+
+class BatchInserter:
+    """使用 executemany 批量写入（pymysql 会将其改写为多行 INSERT）"""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def write(self, table, rows: List[dict]) -> None:
+        if rows:
+            with self.engine.begin() as conn:
+                conn.execute(table.insert(), rows)
+
+    def finish(self) -> None:
+        pass
+
+
+class LoadDataWriter:
+    """先写入 TSV 文件，结束时通过 LOAD DATA LOCAL INFILE 导入（仅 MariaDB/MySQL）"""
+
+    def __init__(self, engine: Engine, workdir: str):
+        self.engine = engine
+        self.workdir = workdir
+        self._files = {}
+
+    @staticmethod
+    def _format(value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, datetime):
+            return value.strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+                .replace("\n", "\\n").replace("\r", "\\r"))
+
+    def write(self, table, rows: List[dict]) -> None:
+        if table.name not in self._files:
+            path = os.path.join(self.workdir, f"{table.name}.tsv")
+            self._files[table.name] = (table, path, open(path, "w", encoding="utf-8", newline="\n"))
+        _, _, f = self._files[table.name]
+        columns = [column.name for column in table.columns]
+        for row in rows:
+            f.write("\t".join(self._format(row.get(column)) for column in columns) + "\n")
+
+    def finish(self) -> None:
+        # 按外键依赖顺序导入
+        order = ["users", "questionnaire_submissions", "medical_records"]
+        for name in sorted(self._files, key=order.index):
+            table, path, f = self._files[name]
+            f.close()
+            columns = ", ".join(f"`{column.name}`" for column in table.columns)
+            start = time.time()
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE `{name}` "
+                    f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+                    f"LINES TERMINATED BY '\\n' ({columns})"
+                )
+            print(f"  📥 LOAD DATA {name}: {time.time() - start:.1f}s")
+
+
+# ---------------------------------------------------------------------------
+# 主流程
+# ---------------------------------------------------------------------------
+
+def load_departments(engine: Engine) -> List[dict]:
+    """读取科室及其当前激活问卷、任一医生"""
+    from sqlalchemy.orm import Session
+
+    with Session(engine) as db:
+        result = []
+        for dept in db.query(Department).filter(Department.deleted_at.is_(None)).order_by(Department.department_name):
+            questionnaire = db.query(Questionnaire).filter(
+                Questionnaire.department_id == dept.id,
+                Questionnaire.status == "active",
+                Questionnaire.deleted_at.is_(None)
+            ).order_by(Questionnaire.version.desc()).first()
+            if not questionnaire:
+                continue
+            doctor = db.query(Doctor).filter(
+                Doctor.department_id == dept.id,
+                Doctor.deleted_at.is_(None)
+            ).order_by(Doctor.username).first()
+            result.append({
+                "id": dept.id,
+                "name": dept.department_name,
+                "questionnaire_id": questionnaire.id,
+                "questions": questionnaire.questions,
+                "doctor_id": doctor.id if doctor else None,
+            })
+        return result
+
+
+def _progress(label: str, done: int, total: int, started: float) -> None:
+    elapsed = max(time.time() - started, 1e-6)
+    print(f"\r  {label}: {done:,}/{total:,} ({done / elapsed:,.0f} 行/秒)", end="", flush=True)
+
+
+def generate(args) -> None:
+    connect_args = {"local_infile": True} if args.method == "load-data" else {}
+    engine = create_engine(args.database_url or settings.DATABASE_URL, connect_args=connect_args)
+    if args.method == "load-data" and engine.dialect.name != "mysql":
+        print("❌ --method load-data 仅支持 MariaDB/MySQL")
+        return
+
+    Base.metadata.create_all(bind=engine)
+    departments = load_departments(engine)
+    if not departments:
+        print("❌ 未找到带问卷的科室，请先运行 create_departments.py 和 create_questionnaires_from_md.py")
+        return
+    print(f"📋 科室 {len(departments)} 个，医生覆盖 {sum(1 for d in departments if d['doctor_id'])} 个科室")
+
+    rng = random.Random(args.seed)
+    now = datetime(2025, 12, 31, 12, 0, 0) if args.fixed_now else datetime.now()
+    generator = SyntheticDataGenerator(rng, departments, args.days, now)
+    password_hash = bcrypt.hashpw(SYNTHETIC_PASSWORD.encode("ascii"), bcrypt.gensalt(rounds=10)).decode("ascii")
+    phone_base = rng.randint(0, 10 ** 8)
+
+    workdir = tempfile.mkdtemp(prefix="medimeow-synthetic-") if args.method == "load-data" else None
+    writer = LoadDataWriter(engine, workdir) if workdir else BatchInserter(engine)
+
+    # 1. 用户
+    started = time.time()
+    users: List[tuple] = []
+    batch: List[dict] = []
+    for row in generator.users(args.users, phone_base, password_hash):
+        users.append((row["id"], row["created_at"]))
+        batch.append(row)
+        if len(batch) >= args.batch_size:
+            writer.write(User.__table__, batch)
+            batch = []
+            _progress("用户", len(users), args.users, started)
+    writer.write(User.__table__, batch)
+    _progress("用户", len(users), args.users, started)
+    print()
+
+    # 2. 问卷提交 + 就诊记录
+    started = time.time()
+    submissions: List[dict] = []
+    records: List[dict] = []
+    done = 0
+    for submission, record in generator.submissions_and_records(args.submissions, users):
+        submissions.append(submission)
+        records.append(record)
+        if len(submissions) >= args.batch_size:
+            writer.write(QuestionnaireSubmission.__table__, submissions)
+            writer.write(MedicalRecord.__table__, records)
+            done += len(submissions)
+            submissions, records = [], []
+            _progress("提交与就诊记录", done, args.submissions, started)
+    writer.write(QuestionnaireSubmission.__table__, submissions)
+    writer.write(MedicalRecord.__table__, records)
+    done += len(submissions)
+    _progress("提交与就诊记录", done, args.submissions, started)
+    print()
+
+    writer.finish()
+    total_rows = args.users + args.submissions * 2
+    print(f"\n📊 共写入 {total_rows:,} 行（用户 {args.users:,}，提交 {args.submissions:,}，就诊记录 {args.submissions:,}）")
+    print(f"   🔐 合成用户密码: {SYNTHETIC_PASSWORD}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成大规模合成数据")
+    parser.add_argument("--users", type=int, default=100000, help="用户数")
+    parser.add_argument("--submissions", type=int, default=500000, help="问卷提交数（每条对应一条就诊记录）")
+    parser.add_argument("--days", type=int, default=365, help="提交时间分布在最近多少天内")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，相同种子生成相同数据")
+    parser.add_argument("--fixed-now", action="store_true", help="以固定时间点为“当前时间”，使时间字段也可复现")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批写入的行数")
+    parser.add_argument("--method", choices=["insert", "load-data"], default="insert",
+                        help="insert: 批量多行 INSERT；load-data: 生成 TSV 后 LOAD DATA LOCAL INFILE（MariaDB）")
+    parser.add_argument("--database-url", help="数据库地址，默认使用 .env 中的 DATABASE_URL")
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print("🧪 生成合成数据")
+    print("=" * 60 + "\n")
+    generate(args)
+    print("\n✨ 完成！\n")
+
+
+if __name__ == "__main__":
+    main()
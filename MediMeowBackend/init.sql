@@ -31,6 +31,7 @@ USE medimeow_db;
 CREATE TABLE IF NOT EXISTS `departments` (
     `id` VARCHAR(36) NOT NULL PRIMARY KEY COMMENT '科室ID (UUID)',
     `department_name` VARCHAR(100) NOT NULL UNIQUE COMMENT '科室名称',
+    `category` VARCHAR(50) DEFAULT NULL COMMENT '所属大类（如 内科、外科），同一大类的科室视为匹配',
     `description` TEXT COMMENT '科室描述',
     `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
@@ -39,6 +40,21 @@ CREATE TABLE IF NOT EXISTS `departments` (
     INDEX `idx_deleted_at` (`deleted_at`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='科室表';
 
+-- ------------------------------------------------------------
+-- 2.1.1 科室别名表 (department_aliases)
+-- AI建议科室与用户所选科室匹配时使用
+-- ------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS `department_aliases` (
+    `id` VARCHAR(36) NOT NULL PRIMARY KEY COMMENT '别名ID (UUID)',
+    `department_id` VARCHAR(36) NOT NULL COMMENT '科室ID',
+    `alias` VARCHAR(100) NOT NULL COMMENT '科室别名',
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    UNIQUE KEY `uk_alias` (`alias`),
+    INDEX `idx_department_id` (`department_id`),
+    CONSTRAINT `fk_alias_department` FOREIGN KEY (`department_id`)
+        REFERENCES `departments` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='科室别名表';
+
 -- ------------------------------------------------------------
 -- 2.2 用户表 (users)
 -- 存储患者/用户信息
@@ -135,6 +151,7 @@ CREATE TABLE IF NOT EXISTS `uploaded_files` (
 CREATE TABLE IF NOT EXISTS `questionnaire_submissions` (
     `id` VARCHAR(36) NOT NULL PRIMARY KEY COMMENT '提交ID (UUID)',
     `user_id` VARCHAR(36) NOT NULL COMMENT '用户ID',
+    `idempotency_key` VARCHAR(64) DEFAULT NULL COMMENT '客户端提供的幂等键 (Idempotency-Key)',
     `questionnaire_id` VARCHAR(36) NOT NULL COMMENT '问卷ID',
     `department_id` VARCHAR(36) NOT NULL COMMENT '科室ID',
     `answers` JSON NOT NULL COMMENT '答案数据 (JSON格式)',
@@ -153,6 +170,7 @@ CREATE TABLE IF NOT EXISTS `questionnaire_submissions` (
     INDEX `idx_status` (`status`),
     INDEX `idx_submit_time` (`submit_time`),
     INDEX `idx_deleted_at` (`deleted_at`),
+    UNIQUE KEY `uq_submissions_user_idempotency_key` (`user_id`, `idempotency_key`),
     CONSTRAINT `fk_submissions_user` FOREIGN KEY (`user_id`) 
         REFERENCES `users` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
     CONSTRAINT `fk_submissions_questionnaire` FOREIGN KEY (`questionnaire_id`) 
@@ -203,6 +221,26 @@ CREATE TABLE IF NOT EXISTS `medical_records` (
         REFERENCES `departments` (`id`) ON DELETE RESTRICT ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='就诊记录表';
 
+-- ------------------------------------------------------------
+-- 2.7.1 AI 分析重试队列 (ai_retry_backlog)
+-- AI 服务不可用时降级的提交，服务恢复后由后台任务重新分析
+-- ------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS `ai_retry_backlog` (
+    `id` VARCHAR(36) NOT NULL PRIMARY KEY COMMENT '任务ID (UUID)',
+    `submission_id` VARCHAR(36) NOT NULL COMMENT '问卷提交ID',
+    `status` VARCHAR(20) DEFAULT 'pending' COMMENT '状态 (pending/failed)',
+    `attempts` INT DEFAULT 0 COMMENT '已重试次数',
+    `last_error` TEXT COMMENT '最近一次失败原因',
+    `next_attempt_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '下次重试时间',
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+    UNIQUE KEY `uk_submission_id` (`submission_id`),
+    INDEX `idx_status` (`status`),
+    INDEX `idx_next_attempt_at` (`next_attempt_at`),
+    CONSTRAINT `fk_retry_submission` FOREIGN KEY (`submission_id`)
+        REFERENCES `questionnaire_submissions` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='AI分析重试队列';
+
 -- ------------------------------------------------------------
 -- 2.8 系统日志表 (system_logs)
 -- 存储系统操作日志
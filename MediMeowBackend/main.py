@@ -4,15 +4,24 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from pathlib import Path
+import logging
 from config import settings
 from app.routers import (
     user_router,
     doctor_router,
     questionnaire_router,
-    department_router
+    department_router,
+    admin_router
 )
 from app.database import engine, Base
 from app.utils.response import error_response
+from app.utils.tracing import setup_tracing
+from app.utils.log import setup_logging, setup_request_context, shutdown_logging
+from app.services.ai_retry import AI_RETRY_WORKER
+
+# 结构化日志（后台线程输出，请求线程不做 I/O）
+setup_logging("medimeow-backend")
+logger = logging.getLogger(__name__)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -32,6 +41,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 链路追踪（HTTP 请求 + SQL 查询）
+setup_tracing(app, engine)
+
+# 为每个请求分配 request_id，附加到该请求产生的所有日志
+setup_request_context(app)
+
 # 全局异常处理器
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -71,9 +86,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     """处理所有未捕获的异常"""
-    import traceback
-    print(f"未捕获的异常: {str(exc)}")
-    traceback.print_exc()
+    logger.error("未捕获的异常: %s", exc, exc_info=exc)
     
     return JSONResponse(
         status_code=500,  # 服务器错误返回 500
@@ -95,6 +108,7 @@ app.include_router(user_router)
 app.include_router(doctor_router)
 app.include_router(questionnaire_router)
 app.include_router(department_router)
+app.include_router(admin_router)
 
 
 @app.on_event("startup")
@@ -102,8 +116,18 @@ async def startup_event():
     """应用启动事件"""
     # 创建数据库表
     Base.metadata.create_all(bind=engine)
-    print("数据库表创建完成")
-    print("应用已启动")
+    logger.info("数据库表创建完成")
+    # 后台重新分析 AI 服务不可用期间降级的提交
+    if settings.AI_RETRY_ENABLED:
+        AI_RETRY_WORKER.start()
+    logger.info("应用已启动")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件"""
+    AI_RETRY_WORKER.stop()
+    shutdown_logging()
 
 
 @app.get("/", tags=["Root"])